@@ -13,70 +13,294 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+"""
+The arsenal client library.
+
+Importing the package is kept cheap for short lived cron and shell
+invocations: requests, ConfigParser, getpass and ast are imported where
+they are used and the shared session is built on first use. The import
+time budget is checked by benchmark.startup().
+"""
 import os
 import sys
-import subprocess
 import re
-import ConfigParser
+import time
+import threading
+import tempfile
 import logging
 import json
-import getpass
-import ast
-import requests
 
 import arsenalclientlib.settings as settings
+from arsenalclientlib.model import Model, record_type
 from arsenalclientlib.node import Node
+from arsenalclientlib.node_group import NodeGroup
 from arsenalclientlib.hardware_profile import HardwareProfile
 from arsenalclientlib.operating_system import OperatingSystem
 from arsenalclientlib.ec2 import Ec2
+from arsenalclientlib.bulk import BulkResult, run_concurrent
+from arsenalclientlib.cache import LookupCache, SingleFlight
+from arsenalclientlib.facts import FactCollector
+import arsenalclientlib.identity as identity
+import arsenalclientlib.registration as registration
+from arsenalclientlib.exceptions import (ArsenalError, ApiError, AuthenticationError,
+    NotFoundError, MethodNotAllowedError, ConflictError, ConnectionFailedError,
+    DeadlineExceededError, CircuitOpenError, error_for_status)
+from arsenalclientlib.retry import RetryPolicy, CircuitBreaker
+from arsenalclientlib.ratelimit import TokenBucket
+from arsenalclientlib.metrics import metrics, endpoint as metrics_endpoint
 
 log = logging.getLogger(__name__)
 
 # requests is chatty
 logging.getLogger("requests").setLevel(logging.WARNING)
-# FIXME: ssl issues
-requests.packages.urllib3.disable_warnings()
-session = requests.session()
 
 
-def facter():
+def build_session():
     """
-    Reads in facts from facter.
+    Builds a requests session with its connection pool sized from settings.
+    The pool is never smaller than settings.concurrency so bulk operations
+    don't discard connections when the pool is full.
+
+    Returns:
+        A requests.Session.
+    """
+
+    import requests
+    # FIXME: ssl issues
+    requests.packages.urllib3.disable_warnings()
+
+    s = requests.session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=int(settings.pool_connections),
+                                            pool_maxsize=max(int(settings.pool_maxsize),
+                                                             int(settings.concurrency)),
+                                            max_retries=int(settings.max_retries))
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+
+    if not settings.keep_alive:
+        s.headers['Connection'] = 'close'
+
+    return s
+
+
+def get_timeout():
+    """
+    Returns the (connect, read) timeout to pass to requests, None for no
+    timeout.
+    """
+
+    if settings.connect_timeout is None and settings.read_timeout is None:
+        return None
+    return (settings.connect_timeout, settings.read_timeout)
+
+
+def connection_stats():
+    """
+    Reports connection reuse for every host in the session's pools.
+
+    Usage:
+
+      >>> client.connection_stats()
+      {'https://arsenal.mycompany.com:443': {'connections': 4, 'requests': 5120, 'reused': 5116}}
+
+    Returns:
+        A dict keyed by scheme://host:port of dicts with the number of
+        connections opened, requests sent and requests that reused an open
+        connection.
+    """
+
+    stats = {}
+    for adapter in set(get_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = '{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)
+            stats[host] = {'connections': pool.num_connections,
+                           'requests': pool.num_requests,
+                           'reused': pool.num_requests - pool.num_connections,
+            }
+    return stats
+
+
+# The shared session, None until get_session() builds it. Assign to it to
+# replace it.
+session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the shared session, building it on first use."""
+
+    global session
+    s = session
+    if s is None:
+        with _session_lock:
+            if session is None:
+                session = build_session()
+            s = session
+    return s
+
+
+fact_collector = FactCollector()
+
+# The facts collect_data() reads.
+REGISTER_FACTS = [
+    'architecture',
+    'ct_fqdn',
+    'ct_loc',
+    'ec2_ami_id',
+    'ec2_hostname',
+    'ec2_instance_id',
+    'ec2_instance_type',
+    'ec2_placement_availability_zone',
+    'ec2_public_hostname',
+    'ec2_security_groups',
+    'facterversion',
+    'fqdn',
+    'is_virtual',
+    'kernel',
+    'lsbdistdescription',
+    'macaddress',
+    'manufacturer',
+    'operatingsystem',
+    'operatingsystemrelease',
+    'productname',
+    'puppetversion',
+    'uptime',
+    'virtual',
+]
+
+
+def facter(names=None):
+    """
+    Reads in facts from facter, using the on-disk fact cache where the facts
+    are still fresh.
+
+    Args:
+        names (list): Only collect these facts. All facts if None.
 
     Returns:
         A dict.
     """
 
-    # need this for custom facts - can add additional paths if needed
-    os.environ["FACTERLIB"] = "/var/lib/puppet/lib/facter"
-    p = subprocess.Popen( ['facter'], stdout=subprocess.PIPE )
-    p.wait()
-    lines = p.stdout.readlines()
-    lines = dict(k.split(' => ') for k in
-                   [s.strip() for s in lines if ' => ' in s])
+    return fact_collector.collect(names)
 
-    return lines
+
+class CookieCache(object):
+    """
+    Keeps the auth cookies in memory so the cookie file is read and parsed
+    once per process instead of once per request. The cached cookies are
+    only dropped on a 401, and concurrent 401s result in a single
+    re-authentication. If that fails, the callers that were waiting on it
+    get the same error instead of each trying again.
+    """
+
+    def __init__(self):
+        self._cookies = None
+        self._cookie_file = None
+        self._lock = threading.Lock()
+        self._logins = 0
+        self._error = None
+
+    def _authenticate(self, logins):
+        """
+        Authenticates, with the lock held. logins is the number of finished
+        logins the caller saw before waiting for the lock: if one failed
+        since, its error is raised again.
+        """
+
+        if self._error is not None and self._logins != logins:
+            raise self._error
+        self._error = None
+        self._cookie_file = settings.cookie_file
+        try:
+            self._cookies = authenticate()
+        except ArsenalError as e:
+            self._error = e
+            raise
+        finally:
+            self._logins += 1
+        return self._cookies
+
+    def get(self):
+        """
+        Returns the cached cookies, loading them from the cookie file or
+        authenticating on first use.
+        """
+
+        cookies = self._cookies
+        if cookies is not None and self._cookie_file == settings.cookie_file:
+            return cookies
+
+        logins = self._logins
+        with self._lock:
+            if self._cookies is None or self._cookie_file != settings.cookie_file:
+                self._cookie_file = settings.cookie_file
+                contents = read_cookie()
+                if contents:
+                    import ast
+                    self._cookies = ast.literal_eval(contents)
+                else:
+                    self._authenticate(logins)
+            return self._cookies
+
+    def reauthenticate(self, stale=None):
+        """
+        Replaces cookies the API rejected. If another thread has already
+        re-authenticated since stale was handed out, its cookies are reused.
+
+        Args:
+            stale (dict): The cookies that got the 401.
+
+        Returns:
+            A dict of the new cookies.
+
+        Raises:
+            ArsenalError: The login failed, see authenticate().
+        """
+
+        logins = self._logins
+        with self._lock:
+            if self._cookies is not None and self._cookies is not stale:
+                return self._cookies
+            log.debug('Cookies rejected, re-authenticating.')
+            metrics.inc('reauth_total')
+            return self._authenticate(logins)
+
+    def clear(self):
+        """Drops the cached cookies."""
+
+        with self._lock:
+            self._cookies = None
+            self._error = None
+
+
+cookie_cache = CookieCache()
 
 
 def get_cookie_auth():
     """
-    Gets cookies from cookie file or authenticates if no cookie file
-    is present
+    Gets cookies from the in-memory cache, reading the cookie file or
+    authenticating on first use.
 
     Returns:
-        A dict of all cookies.
+        A dict of all cookies, or None if the cookie file couldn't be read.
+        The request is then sent without cookies and re-authenticates on
+        the 401.
+
+    Raises:
+        AuthenticationError: The login was refused.
+        ArsenalError: The API couldn't be reached to log in.
     """
 
     try:
-        cookies = read_cookie()
-        if not cookies:
-            cookies = authenticate()
-        else:
-            cookies = ast.literal_eval(cookies)
+        return cookie_cache.get()
 
-        return cookies
-
-    except Exception, e:
+    except ArsenalError:
+        raise
+    except Exception as e:
         log.error('Failed: %s' % e)
 
 
@@ -91,6 +315,7 @@ def read_cookie():
     log.debug('Checking for cookie file: %s' % (settings.cookie_file))
     if os.path.isfile(settings.cookie_file):
         log.debug('Cookie file found: %s' % (settings.cookie_file))
+        metrics.inc('cookie_file_reads_total')
         with open(settings.cookie_file, 'r') as contents:
             cookies = contents.read()
         return cookies
@@ -101,7 +326,8 @@ def read_cookie():
 
 def write_cookie(cookies):
     """
-    Writes cookies to cookie file
+    Writes cookies to cookie file. The file is written to a temporary file
+    and renamed into place so readers never see a partial cookie file.
 
     Returns:
         True if successful, False otherwise.
@@ -111,9 +337,16 @@ def write_cookie(cookies):
 
     try:
         cd = dict(cookies)
-        with open(settings.cookie_file, "w") as cf:
-            cf.write(str(cd))
-        os.chmod(settings.cookie_file, 0600)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(settings.cookie_file)),
+                                        prefix='.arsenal_cookie')
+        try:
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as cf:
+                cf.write(str(cd))
+            os.rename(tmp_file, settings.cookie_file)
+        except Exception:
+            os.unlink(tmp_file)
+            raise
 
         return True
     except Exception as e:
@@ -127,51 +360,62 @@ def authenticate():
     response cookies to file for later use.
 
     Returns:
-        A dict of all cookies if successful, None otherwise.
+        A dict of all cookies if successful.
+
+    Raises:
+        AuthenticationError: The login was refused.
+        ArsenalError: The API couldn't be reached.
     """
 
     if settings.user_login == 'read_only':
         log.error('Write access denied for read_only user.')
-        sys.exit(1)
+        raise AuthenticationError('Write access denied for read_only user.')
+
+    log.info('Authenticating login: %s' % (settings.user_login))
+    if settings.user_login == 'kaboom':
+        password = 'password'
+    elif settings.user_login == 'hvm':
+        password = settings.hvm_password
     else:
-        log.info('Authenticating login: %s' % (settings.user_login))
-        if settings.user_login == 'kaboom':
-            password = 'password'
-        elif settings.user_login == 'hvm':
-            password = settings.hvm_password
-        else:
-            password = getpass.getpass('password: ')
+        import getpass
+        password = getpass.getpass('password: ')
+
+    payload = {'form.submitted': True,
+               'api.client': True,
+               'return_url': '/api',
+               'login': settings.user_login,
+               'password': password
+    }
+    login_url = (settings.api_protocol
+                 + '://'
+                 + settings.api_host
+                 + '/login')
 
-        try:
-            payload = {'form.submitted': True,
-                       'api.client': True,
-                       'return_url': '/api',
-                       'login': settings.user_login,
-                       'password': password
-            }
-            r = session.post(settings.api_protocol
-                             + '://'
-                             + settings.api_host
-                             + '/login', data=payload)
+    try:
+        with metrics.timer('auth_seconds'):
+            r = _request('post', login_url, data=payload, timeout=get_timeout())
+    except ArsenalError as e:
+        log.error('Exception: %s' % e)
+        log.error('Authentication failed')
+        raise
 
-            if r.status_code == requests.codes.ok:
+    if r.status_code != 200:
+        log.error('Authentication failed')
+        raise AuthenticationError('Authentication failed. status_code={0}'.format(r.status_code),
+                                  method='POST', url=login_url, attempts=r.attempts,
+                                  elapsed=r.elapsed_total)
 
-                cookies = session.cookies.get_dict()
-                log.debug('Cookies are: %s' %(cookies))
-                try:
-                    write_cookie(cookies)
-                    return cookies
-                except Exception, e:
-                    log.error('Exception: %s' % e)
+    cookies = get_session().cookies.get_dict()
+    log.debug('Cookies are: %s' %(cookies))
+    write_cookie(cookies)
+    return cookies
 
-            else:
-                log.error('Authentication failed')
-                sys.exit(1)
 
-        except Exception, e:
-            log.error('Exception: %s' % e)
-            log.error('Authentication failed')
-            sys.exit(1)
+def _decode(r):
+    """Parses a response body, timing it in metrics."""
+
+    with metrics.timer('json_decode_seconds', endpoint=metrics_endpoint(r.url)):
+        return r.json()
 
 
 def check_response_codes(r):
@@ -182,31 +426,182 @@ def check_response_codes(r):
         r (requests.response): A response object from the requests package.
 
     Returns:
-        Json if successful, http response code otherwise.
+        Json if successful.
+
+    Raises:
+        ApiError: The ApiError subclass for the status, e.g. NotFoundError
+            or ServerError, with the attempts and elapsed time of the
+            request.
     """
 
-    if r.status_code == requests.codes.ok:
+    if r.status_code == 200:
         log.info('Command successful.')
-        return r.json()
-    # FIXME: These are bogus respoonses
-    elif r.status_code == requests.codes.unauthorized:
-        log.info('Unauthorized.')
-        return '<Response 401>'
-    elif r.status_code == requests.codes.forbidden:
-        log.info('Access Forbidden.')
-        return '<Response 403>'
-    elif r.status_code == requests.codes.not_found:
-        log.info('Resource not found')
-        return '<Response 404>'
-    elif r.status_code == requests.codes.conflict:
-        log.info('Resource already exists.')
-        return '<Response 409>'
-    else:
-        log.info('Command failed. status_code={0}'.format(r.status_code))
-        sys.exit(1)
+        return _decode(r)
+
+    e = error_for_status(r.status_code,
+                         method=r.request.method if r.request else None,
+                         url=r.url,
+                         attempts=getattr(r, 'attempts', 1),
+                         elapsed=getattr(r, 'elapsed_total', None))
+    log.info(str(e))
+    raise e
+
 
+rate_limiter = TokenBucket()
+retry_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
 
-def api_submit(request, data=None, method='get'):
+
+def _response_bytes(r):
+    length = r.headers.get('Content-Length')
+    if length is not None:
+        return int(length)
+    return len(r.content)
+
+
+def _send(method, api_url, **kwargs):
+    """
+    Sends a request through the shared session and rate limiter, recording
+    its latency, status and size in metrics.
+    """
+
+    rate_limiter.acquire()
+    if not settings.metrics_enabled:
+        return get_session().request(method, api_url, **kwargs)
+
+    labels = {'method': method.upper(), 'endpoint': metrics_endpoint(api_url)}
+    data = kwargs.get('data')
+    if isinstance(data, (str, bytes)):
+        metrics.inc('http_request_bytes_total', len(data), **labels)
+
+    start = time.time()
+    try:
+        r = get_session().request(method, api_url, **kwargs)
+    except Exception:
+        metrics.inc('http_requests_total', status='error', **labels)
+        raise
+    finally:
+        metrics.observe('http_request_seconds', time.time() - start, **labels)
+
+    metrics.inc('http_requests_total', status=str(r.status_code), **labels)
+    # A streamed body hasn't been read yet, api_stream() counts it.
+    if not kwargs.get('stream'):
+        metrics.inc('http_response_bytes_total', _response_bytes(r), **labels)
+    return r
+
+
+def _bounded_timeout(timeout, remaining):
+    """Caps a requests timeout so an attempt can't run past the deadline."""
+
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+
+def _request(method, api_url, policy=None, **kwargs):
+    """
+    Sends a request, retrying failed attempts according to the retry policy
+    and failing fast while the circuit breaker is open.
+
+    Returns:
+        The final requests.Response. It carries the number of attempts and
+        the total elapsed time as r.attempts and r.elapsed_total.
+
+    Raises:
+        CircuitOpenError: The API is down and the request wasn't sent.
+        ConnectionFailedError: The API couldn't be reached.
+        DeadlineExceededError: The call ran out of time.
+    """
+
+    import requests
+
+    if policy is None:
+        policy = retry_policy
+
+    start = time.time()
+    attempts = 0
+    timeout = kwargs.pop('timeout', None)
+
+    while True:
+        try:
+            circuit_breaker.before_request(api_url)
+        except CircuitOpenError as e:
+            e.method, e.attempts, e.elapsed = method.upper(), attempts, time.time() - start
+            metrics.inc('circuit_open_total')
+            raise
+
+        elapsed = time.time() - start
+        attempt_timeout = timeout
+        if policy.deadline:
+            attempt_timeout = _bounded_timeout(timeout, max(0.001, policy.deadline - elapsed))
+
+        attempts += 1
+        error = None
+        try:
+            r = _send(method, api_url, timeout=attempt_timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+            r = None
+
+        if r is not None and r.status_code not in policy.statuses:
+            circuit_breaker.record_success()
+            r.attempts = attempts
+            r.elapsed_total = time.time() - start
+            return r
+
+        circuit_breaker.record_failure()
+        elapsed = time.time() - start
+        retry_after = r.headers.get('Retry-After') if r is not None else None
+        delay = policy.delay(attempts, retry_after)
+
+        if policy.should_retry(method, attempts, elapsed, delay):
+            log.info('Request failed ({0}), retry {1}/{2} in {3:.1f}s: {4}'.format(
+                error or r.status_code, attempts, policy.retries, delay, api_url))
+            metrics.inc('http_retries_total', method=method.upper(), endpoint=metrics_endpoint(api_url))
+            policy.sleep(delay)
+            continue
+
+        meta = {'method': method.upper(), 'url': api_url, 'attempts': attempts, 'elapsed': elapsed}
+        if policy.deadline and elapsed + delay >= policy.deadline:
+            raise DeadlineExceededError('Request did not succeed within {0}s: {1}'.format(
+                policy.deadline, error or r.status_code), **meta)
+        if error is not None:
+            raise ConnectionFailedError('Unable to reach API: {0}'.format(error), **meta)
+
+        r.attempts = attempts
+        r.elapsed_total = elapsed
+        return r
+
+
+def _to_serializable(o):
+    if isinstance(o, Model):
+        return o.to_dict()
+    return o.__dict__
+
+
+def to_json(data):
+    """
+    Serializes request data, including Node, Ec2, etc. model objects, to
+    json for the API.
+    """
+
+    return json.dumps(data, default=_to_serializable)
+
+
+single_flight = SingleFlight()
+
+
+def _request_key(api_url, params):
+    """The single-flight key of a GET: its url and params."""
+
+    if not params:
+        return (api_url, ())
+    return (api_url, tuple(sorted((k, v) for k, v in params.items() if v is not None)))
+
+
+def api_submit(request, data=None, method='get', cookies=None, timeout=None, policy=None):
     """
     Manages http requests to the API.
 
@@ -222,75 +617,320 @@ def api_submit(request, data=None, method='get'):
         >>> api_submit('/api/nodes', data, 'get_params')
         <{json object}>
         >>> api_submit('/api/invalid', data, 'get_params')
-        <Response 404>
+        None
 
     Args:
         request (str): The uri endpoint to request.
-        data (dict): A dict of paramters to send with the http request.
+        data (dict): A dict of paramters to send with the http request. For
+            'put' and 'delete' this may also be a model, or a json string
+            already serialized with to_json().
         method (str): The http method to use. Valid choices are:
             put
             delete
             get_params
             delete
+        cookies (dict): Auth cookies to use for 'put' or 'delete'. Read
+            from cookie_cache if not passed, which only touches the cookie
+            file on first use.
+        timeout (float or tuple): The timeout for this request, either a
+            single value or a (connect, read) tuple. Defaults to
+            settings.connect_timeout and settings.read_timeout.
+        policy (RetryPolicy): How failed attempts are retried. Defaults to
+            the module retry_policy.
+
+    Concurrent identical GETs (same url and params) share a single request
+    and its parsed json unless settings.single_flight is off. The shared
+    json must not be modified.
 
     Returns:
         check_response_codes() if 'put' or 'delete', json if sccessful
-        'get', None otherwise.
+        'get', None if a 'get' found nothing.
+
+    Raises:
+        ArsenalError: An ArsenalError subclass describing the failure, with
+            the number of attempts and the time spent.
     """
 
     headers = {'content-type': 'application/json'}
 
+    if timeout is None:
+        timeout = get_timeout()
+
     api_url = (settings.api_protocol
                + '://'
                + settings.api_host
                + request)
 
-    if method == 'put':
+    if method in ('put', 'delete'):
 
-        data = json.dumps(data, default=lambda o: o.__dict__)
-        cookies = get_cookie_auth()
+        if not isinstance(data, (str, bytes)):
+            with metrics.timer('serialize_seconds', endpoint=metrics_endpoint(request)):
+                data = to_json(data)
+        if cookies is None:
+            cookies = get_cookie_auth()
 
-        log.debug('Submitting data to API: %s' % api_url)
+        if method == 'put':
+            log.debug('Submitting data to API: %s' % api_url)
+        else:
+            log.debug('Deleting data from API: %s' % api_url)
 
-        r = session.put(api_url, verify=settings.ssl_verify, cookies=cookies, headers=headers, data=data)
+        r = _request(method, api_url, policy, verify=settings.ssl_verify, timeout=timeout, cookies=cookies, headers=headers, data=data)
 
         # re-auth if our cookie is invalid/expired
-        if r.status_code == requests.codes.unauthorized:
-            cookies = authenticate()
-            r = session.put(api_url, verify=settings.ssl_verify, cookies=cookies, headers=headers, data=data)
+        if r.status_code == 401:
+            cookies = cookie_cache.reauthenticate(cookies)
+            r = _request(method, api_url, policy, verify=settings.ssl_verify, timeout=timeout, cookies=cookies, headers=headers, data=data)
 
         return check_response_codes(r)
 
-    elif method == 'delete':
+    if method != 'get_params':
+        data = None
 
-        data = json.dumps(data, default=lambda o: o.__dict__)
-        cookies = get_cookie_auth()
+    def get():
+        r = _request('get', api_url, policy, verify=settings.ssl_verify, timeout=timeout, params=data)
 
-        log.debug('Deleting data from API: %s' % api_url)
+        if r.status_code == 200:
+            return _decode(r)
+        if r.status_code == 404:
+            return None
+        return check_response_codes(r)
 
-        r = session.delete(api_url, verify=settings.ssl_verify, cookies=cookies, headers=headers, data=data)
+    if not settings.single_flight:
+        return get()
+    return single_flight.do(_request_key(api_url, data), get)
 
-        # re-auth if our cookie is invalid/expired
-        if r.status_code == requests.codes.unauthorized:
-            cookies = authenticate()
-            r = session.delete(api_url, verify=settings.ssl_verify, cookies=cookies)
 
-        return check_response_codes(r)
+def api_stream(request, data=None, timeout=None, policy=None, key='results'):
+    """
+    GETs search results from the API and decodes them as they arrive,
+    instead of reading and parsing the whole body at once like api_submit().
 
-    elif method == 'get_params':
-        r = session.get(api_url, verify=settings.ssl_verify, params=data)
-        if r.status_code == requests.codes.ok:
-            return r.json()
+    Usage:
 
-    else:
-        r = session.get(api_url, verify=settings.ssl_verify)
-        if r.status_code == requests.codes.ok:
-            return r.json()
+      >>> results = client.api_stream('/api/nodes', {'node_name': 'web'})
+      >>> for n in results:
+      ...     print n['node_name']
+      >>> results.meta
+      {u'total': 51234}
 
-    return None
+    Args:
+        request (str): The API endpoint, e.g. /api/nodes.
+        data (dict): The request params.
+        timeout: As for api_submit().
+        policy (RetryPolicy): As for api_submit().
+        key (str): The member of the response holding the results.
 
+    Returns:
+        A stream.ResultStream of the results, None if the API found nothing.
+        The connection is released once it has been iterated.
 
-def object_search(object_type, search, exact_get = None):
+    Raises:
+        ArsenalError: As for api_submit().
+    """
+
+    from arsenalclientlib.stream import ResultStream
+
+    if timeout is None:
+        timeout = get_timeout()
+    api_url = settings.api_protocol + '://' + settings.api_host + request
+
+    log.debug('Streaming data from API: %s' % api_url)
+    r = _request('get', api_url, policy, verify=settings.ssl_verify, timeout=timeout,
+                 params=data, stream=True)
+    if r.status_code == 404:
+        r.close()
+        return None
+    if r.status_code != 200:
+        # The body was never read, release the connection before raising.
+        try:
+            return check_response_codes(r)
+        finally:
+            r.close()
+
+    def close():
+        r.close()
+        metrics.inc('http_response_bytes_total', results.bytes, method='GET',
+                    endpoint=metrics_endpoint(api_url))
+
+    results = ResultStream(r.iter_content(65536), key, close)
+    return results
+
+
+def _search_params(search, exact_get=None):
+    """Converts key=value&key=value search terms to a dict of request params."""
+
+    search_terms = list(search.split("&"))
+    data = dict(u.split("=") for u in search_terms)
+    data['exact_get'] = exact_get
+
+    return data
+
+
+def _fetch_page(api_endpoint, data, start, limit):
+    """Fetches a single page of search results."""
+
+    params = dict(data)
+    params['start'] = start
+    params['limit'] = limit
+
+    log.debug('Fetching page: {0} start={1},limit={2}'.format(api_endpoint, start, limit))
+    return api_submit(api_endpoint, params, method='get_params')
+
+
+def _next_start(results, start, page_size):
+    """
+    Works out where the next page of search results starts.
+
+    Returns:
+        The start offset of the next page, None if this was the last one.
+    """
+
+    return _next_page(len(results['results']), results.get('meta'), start, page_size)
+
+
+def _next_page(count, meta, start, page_size):
+    total = None
+    if isinstance(meta, dict):
+        total = meta.get('total')
+
+    # With a reported total, page until it is reached: a server that clamps
+    # limit below page_size returns short pages that aren't the last one.
+    # An empty page ends it either way.
+    if total is not None:
+        if not count or start + count >= int(total):
+            return None
+        return start + count
+
+    # Without one, a short page, or a page larger than we asked for (paging
+    # not supported by the server), means there is nothing left to fetch.
+    if count != page_size:
+        return None
+    return start + count
+
+
+def iter_search(object_type, search, exact_get = None, page_size = None, prefetch = False,
+                model = None, stream = False, fields = None):
+    """
+    Searches the API one page at a time, yielding results as they arrive.
+
+    Usage:
+
+      >>> for n in client.iter_search('nodes', 'node_name=web', page_size=500, prefetch=True):
+      ...     print n['node_name']
+
+    Args:
+        object_type (str): The type of object we are searching for (nodes,
+            node_groups, statuses, etc.)
+        search (str): The key=value search terms, as for object_search().
+        exact_get (str): Whether to search for terms exactly or use wildcard
+            matching.
+        page_size (int): The number of results to request per page. Defaults
+            to settings.search_page_size.
+        prefetch (bool): Fetch the next page in a background thread while the
+            current one is being consumed.
+        model (class): A Model, e.g. Node, to hydrate each result into as it
+            is yielded. Result dicts if None.
+        stream (bool): Decode each page incrementally with api_stream(), so
+            memory use doesn't grow with the page size. Pages are then
+            fetched one after the other, prefetch is ignored.
+        fields (list): Only return these fields, as compact records from
+            model.record_type() instead of dicts. Also a comma separated
+            string. The projection is sent to the API as
+            settings.search_fields_param if set. Can't be combined with
+            model.
+
+    Returns:
+        A generator of results. The generator can be passed straight to
+        set_status(), manage_tag_assignments(), etc.
+    """
+
+    if page_size is None:
+        page_size = settings.search_page_size
+    page_size = int(page_size)
+
+    data = _search_params(search, exact_get)
+    log.debug('Searching for: {0}'.format(data))
+
+    if fields:
+        if model is not None:
+            raise ValueError('fields and model can not be used together.')
+        if hasattr(fields, 'split'):
+            fields = fields.split(',')
+        model = record_type(fields)
+        if settings.search_fields_param:
+            data[settings.search_fields_param] = ','.join(model._fields)
+
+    api_endpoint = '/api/{0}'.format(object_type)
+
+    if stream:
+        start = 0
+        while start is not None:
+            params = dict(data)
+            params['start'] = start
+            params['limit'] = page_size
+            log.debug('Streaming page: {0} start={1},limit={2}'.format(api_endpoint, start, page_size))
+            results = api_stream(api_endpoint, params)
+            if results is None:
+                return
+            for i in results:
+                yield i if model is None else model.from_dict(i)
+            if not results.count:
+                return
+            start = _next_page(results.count, results.meta.get('meta'), start, page_size)
+        return
+
+    # Set when the consumer stops early, so a prefetch that hasn't sent its
+    # request yet doesn't.
+    closed = threading.Event()
+
+    def fetch(start):
+        page = {}
+        def run():
+            if closed.is_set():
+                return
+            try:
+                page['results'] = _fetch_page(api_endpoint, data, start, page_size)
+            except Exception as e:
+                page['error'] = e
+        if prefetch:
+            t = threading.Thread(target=run)
+            t.daemon = True
+            t.start()
+            return t, page
+        run()
+        return None, page
+
+    start = 0
+    pending = fetch(start)
+    try:
+        while pending:
+            t, page = pending
+            if t:
+                t.join()
+            if 'error' in page:
+                raise page['error']
+            results = page.get('results')
+            pending = None
+
+            if not results or not results['results']:
+                return
+
+            r = results['results']
+            start = _next_start(results, start, page_size)
+            for i in r:
+                yield i if model is None else model.from_dict(i)
+                # Prefetch once the consumer asks for more than the first
+                # result, so one that only wanted that doesn't start a fetch.
+                if prefetch and pending is None and start is not None:
+                    pending = fetch(start)
+            if pending is None and start is not None:
+                pending = fetch(start)
+    finally:
+        closed.set()
+
+
+def object_search(object_type, search, exact_get = None, model = None, stream = False,
+                  fields = None):
     """
     Main serach function to query the API.
 
@@ -309,26 +949,240 @@ def object_search(object_type, search, exact_get = None):
             keys are used, string must be quoted.
         exact_get (str): Whether to search for terms exactly or use wildcard
             matching.
-    """
-
-    search_terms = list(search.split("&"))
-    data = dict(u.split("=") for u in search_terms)
-    data['exact_get'] = exact_get
+        model (class): A Model, e.g. Node, to hydrate the results into.
+        stream (bool): Decode the responses incrementally. See iter_search().
+        fields (list): Only return these fields, as compact records, e.g.
+            ('node_id', 'node_name') for set_status(). See iter_search().
 
-    log.debug('Searching for: {0}'.format(data))
+    Returns:
+        A list of all results across every page, None if nothing matched.
+        Use iter_search() to stream large result sets instead.
+    """
 
-    api_endpoint = '/api/{0}'.format(object_type)
-    results = api_submit(api_endpoint, data, method='get_params')
+    r = list(iter_search(object_type, search, exact_get, model=model, stream=stream,
+                         fields=fields))
 
-    # FIXME: The client doesn't need metadata. or does it???
-    if not results['results']:
+    if not r:
         log.info('No results found for search.')
         return None
     else:
-        r = results['results']
         return r
 
 
+lookup_cache = LookupCache()
+
+
+def lookup(key, data):
+    """
+    Looks up near-static reference objects (statuses, tags, node_groups) by
+    name, going to the API only on a lookup_cache miss.
+
+    Usage:
+
+      >>> client.lookup(('statuses', 'inservice'), {'status_name': 'inservice', 'exact_get': True})
+      [{u'status_id': 2, u'status_name': u'inservice', ...}]
+
+    Args:
+        key (tuple): The cache key, (object_type, name[, value]).
+        data (dict): The search params to send to /api/<object_type> on a
+            miss.
+
+    Returns:
+        A list of results, empty if nothing matched. Empty results are not
+        cached.
+    """
+
+    r = lookup_cache.get(key)
+    if r is None:
+        results = api_submit('/api/{0}'.format(key[0]), data, method='get_params')
+        if not results or not results['results']:
+            return []
+        r = results['results']
+        lookup_cache.set(key, r)
+    return r
+
+
+# Whether the batch endpoint of settings.assignment_batch_endpoint exists,
+# by batch endpoint: True once it accepted a batch, False once it is known
+# to be missing. Batch endpoints not in here haven't been probed yet.
+_batch_support = {}
+
+
+def _batch_endpoint(endpoint):
+    """The batch counterpart of an assignment endpoint, None if batching is off."""
+
+    if not settings.assignment_batch_endpoint:
+        return None
+    return settings.assignment_batch_endpoint.format(endpoint[len('/api/'):])
+
+
+def _chunks(items, chunk_size):
+    """Yields lists of up to chunk_size items from any iterable."""
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_assign(endpoint, items, to_data, api_action = 'put', chunk_size = None,
+                concurrency = None, cookies = None, defer = False, bucket = None):
+    """
+    Submits many assignments to an /api/*_assignments endpoint.
+
+    If settings.assignment_batch_endpoint is set, assignments are grouped
+    into chunks and each chunk is sent as a single {'assignments': [...]}
+    payload to the endpoint's batch counterpart. The first chunks are sent
+    one at a time until the batch endpoint is known to exist, the rest
+    concurrently. If the server turns out not to have it, every assignment
+    is sent to the endpoint on its own instead, for the rest of the
+    process. A chunk the batch endpoint rejects with a 404 is retried one
+    assignment at a time to find the ones that failed.
+
+    Usage:
+
+      >>> client.bulk_assign('/api/tag_node_assignments', pairs,
+      ...                    lambda p: {'node_id': p[0]['node_id'], 'tag_id': p[1]['tag_id']})
+      <BulkResult succeeded=6000 failed=0>
+
+    Args:
+        endpoint (str): The assignment endpoint, e.g. /api/tag_node_assignments.
+        items (iterable): The assignments to make.
+        to_data (callable): Returns the request data for a single item.
+        api_action (str): Whether to put or delete.
+        chunk_size (int): The number of assignments per batch request.
+            Defaults to settings.assignment_chunk_size. 1 disables batching.
+        concurrency (int): The number of requests in flight. Defaults to
+            settings.concurrency.
+        cookies (dict): Auth cookies. If not passed they are read from
+            cookie_cache for every request, so the items after a
+            re-authentication use the new cookies.
+        defer (bool): Append the assignments to settings.journal_file
+            instead of sending them. Their responses are None.
+        bucket (TokenBucket): Take a token from it before every request,
+            batched or single, e.g. to cap the rate of a journal replay.
+
+    Returns:
+        A BulkResult of (item, response) and (item, exception).
+    """
+
+    result = BulkResult()
+    if defer:
+        if settings.journal_file:
+            for item in items:
+                _defer(endpoint, to_data(item), api_action)
+                result.add_success(item, None)
+            return result
+        log.warning('No journal_file set, sending assignments now.')
+
+    if chunk_size is None:
+        chunk_size = settings.assignment_chunk_size
+    chunk_size = max(1, int(chunk_size))
+
+    batch_endpoint = _batch_endpoint(endpoint)
+
+    def submit(request, data):
+        if bucket is not None:
+            bucket.acquire()
+        return api_submit(request, data, method=api_action, cookies=cookies)
+
+    def submit_one(item):
+        try:
+            result.add_success(item, submit(endpoint, to_data(item)))
+        except Exception as e:
+            log.error('Failed: {0}'.format(e))
+            result.add_failure(item, e)
+
+    def submit_singly(chunk):
+        """Sends the items of a chunk on their own, returning how many succeeded."""
+
+        before = len(result.succeeded)
+        run_concurrent(submit_one, chunk, concurrency)
+        return len(result.succeeded) - before
+
+    def submit_chunk(chunk):
+        """
+        Sends a chunk to the batch endpoint, which is known to exist. If it
+        rejects the chunk with a client error, e.g. a 404 or a 409 for one
+        of its items, the items are sent on their own so only the bad ones
+        fail.
+        """
+
+        try:
+            r = submit(batch_endpoint, {'assignments': [to_data(item) for item in chunk]})
+        except ApiError as e:
+            if e.retryable:
+                log.error('Failed: {0}'.format(e))
+                for item in chunk:
+                    result.add_failure(item, e)
+                return
+            log.debug('Batch rejected, sending {0} assignment(s) singly: {1}'.format(len(chunk), e))
+            for item in chunk:
+                submit_one(item)
+            return
+        except Exception as e:
+            log.error('Failed: {0}'.format(e))
+            for item in chunk:
+                result.add_failure(item, e)
+            return
+        for item in chunk:
+            result.add_success(item, r)
+
+    # submit_chunk() and submit_one() record the outcome of every item
+    # themselves.
+    if chunk_size == 1 or batch_endpoint is None or _batch_support.get(batch_endpoint) is False:
+        run_concurrent(submit_one, items, concurrency)
+        return result
+
+    chunks = _chunks(items, chunk_size)
+
+    # Probe with one chunk at a time, so a server without the batch
+    # endpoint costs one 404 rather than one per chunk in flight. A 404
+    # can also mean an item wasn't found, so the endpoint only counts as
+    # missing if every item of the chunk then succeeds on its own.
+    while _batch_support.get(batch_endpoint) is None:
+        chunk = next(chunks, None)
+        if chunk is None:
+            return result
+        try:
+            r = submit(batch_endpoint, {'assignments': [to_data(item) for item in chunk]})
+        except MethodNotAllowedError:
+            _batch_support[batch_endpoint] = False
+            submit_singly(chunk)
+        except NotFoundError:
+            if submit_singly(chunk) == len(chunk):
+                _batch_support[batch_endpoint] = False
+        except ApiError as e:
+            if e.retryable:
+                log.error('Failed: {0}'.format(e))
+                for item in chunk:
+                    result.add_failure(item, e)
+                continue
+            # The endpoint is there, it rejected an item, e.g. a 409.
+            _batch_support[batch_endpoint] = True
+            submit_singly(chunk)
+        except Exception as e:
+            log.error('Failed: {0}'.format(e))
+            for item in chunk:
+                result.add_failure(item, e)
+        else:
+            _batch_support[batch_endpoint] = True
+            for item in chunk:
+                result.add_success(item, r)
+
+    if _batch_support[batch_endpoint]:
+        run_concurrent(submit_chunk, chunks, concurrency)
+    else:
+        log.info('No batch endpoint, sending single assignments: {0}'.format(batch_endpoint))
+        run_concurrent(submit_one, (item for chunk in chunks for item in chunk), concurrency)
+
+    return result
+
+
 def get_unique_id(**facts):
     """
     Determines the unique_id of a node.
@@ -339,10 +1193,10 @@ def get_unique_id(**facts):
         if 'ec2_instance_id' in facts:
             unique_id = facts['ec2_instance_id']
             log.debug('unique_id is from ec2_instance_id: {0}'.format(unique_id))
-        elif os.path.isfile('/usr/sbin/dmidecode'):
+        elif os.path.isfile(identity.DMIDECODE):
             unique_id = get_uuid()
             if unique_id:
-                log.debug('unique_id is from dmidecode: {0}'.format(unique_id))
+                log.debug('unique_id is from hardware uuid: {0}'.format(unique_id))
             else:
                 unique_id = facts['macaddress']
                 log.debug('unique_id is from mac address: {0}'.format(unique_id))
@@ -356,26 +1210,12 @@ def get_unique_id(**facts):
 
 
 def get_uuid():
-    """Gets the uuid of a node from dmidecode if available."""
-
-    FNULL = open(os.devnull, 'w')
-    p = subprocess.Popen( ['/usr/sbin/dmidecode', '-s', 'system-uuid'], stdout=subprocess.PIPE, stderr=FNULL )
-    p.wait()
-    uuid = p.stdout.readlines()
-    # FIXME: Need some validation here
-    if uuid:
-        return uuid[0].rstrip()
-    else:
-        # Support older versions of dmidecode
-        p = subprocess.Popen( ['/usr/sbin/dmidecode', '-t', '1'], stdout=subprocess.PIPE )
-        p.wait()
-        dmidecode_out = p.stdout.readlines()
-        xen_match = "\tUUID: "
-        for line in dmidecode_out:
-            if re.match(xen_match, line):
-                return line[7:].rstrip()
+    """
+    Gets the uuid of a node from sysfs or dmidecode if available. Waits for
+    a probe already started by identity.start_probe().
+    """
 
-    return None
+    return identity.hardware_uuid()
 
 
 def get_hardware_profile(facts):
@@ -420,8 +1260,23 @@ def collect_data():
 
     log.debug('Collecting data for node.')
     data = Node()
-    facts = facter()
-    unique_id = get_unique_id(**facts)
+
+    # Probe the hardware uuid while facter runs, unless there is a saved
+    # unique_id we can use instead, or the instance id says this is ec2.
+    if fact_collector.cached('ec2_instance_id'):
+        identity.skip_probe()
+    elif not settings.unique_id_file or not os.path.isfile(settings.unique_id_file):
+        identity.start_probe()
+    facts = facter(REGISTER_FACTS)
+    if 'ec2_instance_id' in facts:
+        identity.skip_probe()
+
+    unique_id = identity.load_unique_id(facts.get('macaddress'))
+    if unique_id:
+        log.debug('unique_id is from {0}: {1}'.format(settings.unique_id_file, unique_id))
+    else:
+        unique_id = get_unique_id(**facts)
+        identity.save_unique_id(unique_id, facts.get('macaddress'))
     data.unique_id = unique_id
 
     # EC2 facts
@@ -465,38 +1320,134 @@ def collect_data():
 
 
 ## NODES
-def register():
+def _defer(request, data, method):
+    """
+    Appends a mutation to settings.journal_file for journal.drain() to
+    replay. Returns False if there is no journal_file.
+    """
+
+    if not settings.journal_file:
+        return False
+    from arsenalclientlib import journal
+    journal.enqueue(request, data, method)
+    return True
+
+
+def register(force=False, data=None, defer=False):
     """Collect all the data about a node and register
-       it with the server"""
+       it with the server.
+
+    If settings.register_state_file is set, the request is skipped when
+    nothing but the volatile fields (settings.register_volatile_fields) has
+    changed since the last successful registration. A full re-register is
+    still sent every settings.register_interval seconds.
 
-    data = collect_data()
+    :arg force: Register even if nothing changed.
+    :arg data: The Node to register, from collect_data() if not passed.
+    :arg defer: Append the registration to settings.journal_file and
+        return without waiting for the API.
 
-    log.debug('data is: {0}'.format(json.dumps(data, default=lambda o: o.__dict__)))
-    api_submit('/api/register', data, method='put')
+    If settings.journal_file is set, a registration that fails because the
+    API can't be reached is journaled for journal.drain() to replay instead
+    of raising, and a successful registration drops the journaled ones of
+    the same unique_id.
 
+    The run is recorded in metrics, which are then exported to
+    settings.metrics_textfile and settings.statsd_host if set.
 
-def set_status(status_name, nodes):
+    Returns the API response, None if the registration was skipped or
+    journaled.
+    """
+
+    start = time.time()
+    result = 'failed'
+    try:
+        if data is None:
+            data = collect_data()
+        with metrics.timer('serialize_seconds', endpoint='/api/register'):
+            body = data.to_dict() if isinstance(data, Model) else data
+            payload = to_json(body)
+
+        log.debug('data is: %s', payload)
+
+        fields = registration.fingerprint(body)
+        state = None if force else registration.load_state()
+        changed = registration.changed_fields(fields, state)
+        if not changed:
+            log.info('Node unchanged since last registration, skipping.')
+            result = 'skipped'
+            return None
+
+        if changed == ['*']:
+            log.info('Registering node.')
+        else:
+            log.info('Registering node, changed fields: {0}'.format(', '.join(changed)))
+
+        if defer:
+            if _defer('/api/register', body, 'put'):
+                log.info('Registration journaled.')
+                result = 'deferred'
+                return None
+            log.warning('No journal_file set, registering now.')
+
+        try:
+            r = api_submit('/api/register', payload, method='put')
+        except ArsenalError as e:
+            from arsenalclientlib.journal import deferrable
+            if not (deferrable(e) and _defer('/api/register', body, 'put')):
+                raise
+            log.warning('Registration journaled, the API is unavailable: {0}'.format(e))
+            result = 'deferred'
+            return None
+        registration.save_state(fields)
+        if settings.journal_file and isinstance(body, dict) and body.get('unique_id'):
+            # Don't let a drain replay an older journaled registration over this one.
+            from arsenalclientlib.journal import get_journal
+            get_journal().supersede('/api/register', {'unique_id': body['unique_id']})
+        result = 'registered'
+        return r
+    finally:
+        metrics.observe('register_seconds', time.time() - start)
+        metrics.inc('register_total', result=result)
+        metrics.flush()
+
+
+def set_status(status_name, nodes, concurrency=None):
     """Set the status of one or more nodes.
 
     :arg status: The name of the status you wish to set the node to.
     :arg nodes: The nodes from the search results to set the status to.
+    :arg concurrency: The number of nodes to update in parallel. Defaults to
+        settings.concurrency.
+
+    Returns a BulkResult with the per-node outcome.
 
     Usage::
 
       >>> client.set_status('inservice', <object_search results>)
-      <Response [200]>
+      <BulkResult succeeded=2 failed=0>
+      >>> client.set_status('maintenance', <object_search results>, concurrency=50)
+      <BulkResult succeeded=5000 failed=0>
     """
 
     data = {'status_name': status_name,
             'exact_get': True,
     }
-    status = api_submit('/api/statuses', data, method='get_params')
+    status = lookup(('statuses', status_name), data)[0]
+
+    data = {'status_id': status['status_id']}
 
-    data = {'status_id': status['results'][0]['status_id']}
+    # The cookies come from cookie_cache on every request rather than being
+    # bound here, so a re-authentication mid-batch is picked up.
+    def update(n):
+        log.info('Setting status node={0},status={1}'.format(n['node_name'], status['status_name']))
+        return api_submit('/api/nodes/{0}'.format(n['node_id']), data, method='put')
 
-    for n in nodes:
-        log.info('Setting status node={0},status={1}'.format(n['node_name'], status['results'][0]['status_name']))
-        api_submit('/api/nodes/{0}'.format(n['node_id']), data, method='put')
+    results = run_concurrent(update, nodes, concurrency)
+    log.info('Set status={0} on {1} node(s), {2} failed.'.format(status['status_name'],
+                                                                len(results.succeeded),
+                                                                len(results.failed)))
+    return results
 
 
 def create_node(unique_id, node_name, status_id):
@@ -556,7 +1507,9 @@ def create_node_group(node_group_name, node_group_owner, node_group_description)
            }
 
     log.info('Creating node_group node_group_name={0},node_group_owner={1},node_group_description={2}'.format(node_group_name, node_group_owner, node_group_description))
-    return api_submit('/api/node_groups', data, method='put')
+    r = api_submit('/api/node_groups', data, method='put')
+    lookup_cache.invalidate('node_groups')
+    return r
 
 
 def delete_node_group(node_group_id):
@@ -572,21 +1525,29 @@ def delete_node_group(node_group_id):
 
     # FIXME: Support name and id or ?
     data = {'node_group_id': node_group_id}
-    return api_submit('/api/node_groups/{0}'.format(node_group_id), data, method='delete')
+    r = api_submit('/api/node_groups/{0}'.format(node_group_id), data, method='delete')
+    lookup_cache.invalidate('node_groups')
+    return r
 
 
 # FIXME: Duplicate code with other manage_* functions
-def manage_node_group_assignments(node_groups, nodes, api_action = 'put'):
+def manage_node_group_assignments(node_groups, nodes, api_action = 'put',
+                                  chunk_size = None, concurrency = None, defer = False):
     """Assign or De-assign node_groups to one or more nodes.
 
     :arg node_groups: The list of node groups to de-assign from the node.
     :arg nodes: The nodes from the search results to assign or de-assign to/from the node_group.
     :arg api_action: Whether to put or delete.
+    :arg chunk_size: The number of assignments sent per batch request. See bulk_assign().
+    :arg concurrency: The number of requests in flight. Defaults to settings.concurrency.
+    :arg defer: Journal the assignments for journal.drain() instead of sending them. See bulk_assign().
+
+    Returns a BulkResult of ((node, node_group), response) pairs.
 
     Usage::
 
       >>> client.manage_node_group_assignments('node_group1,node_group2', <object_search results>, 'put')
-      <Response [200]>
+      <BulkResult succeeded=4 failed=0>
     """
 
     if api_action == 'delete':
@@ -596,43 +1557,58 @@ def manage_node_group_assignments(node_groups, nodes, api_action = 'put'):
         log_a = 'Assigning'
         log_p = 'to'
 
+    # Resolve every group name in one concurrent round.
+    names = node_groups.split(',')
+    found = run_concurrent(lambda ng: lookup(('node_groups', ng), {'node_group_name': ng}),
+                           names, concurrency)
+    resolved = dict(found.succeeded)
+
     node_groups_list = []
-    for ng in node_groups.split(','):
-        data = {'node_group_name': ng}
-        r = api_submit('/api/node_groups', data, method='get_params')
-        if r['results']:
-            for i in r['results']:
-                node_groups_list.append(i)
+    for ng in names:
+        if resolved.get(ng):
+            node_groups_list.extend(resolved[ng])
         else:
             log.info('Not found: node_group={0}'.format(ng))
 
-    if node_groups_list:
-        for n in nodes:
-            for ng in node_groups_list:
-                log.info('{0} node_group={1} {2} node={3}'.format(log_a, ng['node_group_name'], log_p, n['node_name']))
-                data = {'node_id': n['node_id'],
-                        'node_group_id': ng['node_group_id']}
-                return api_submit('/api/node_group_assignments', data, method=api_action)
+    def to_data(pair):
+        n, ng = pair
+        log.info('{0} node_group={1} {2} node={3}'.format(log_a, ng['node_group_name'], log_p, n['node_name']))
+        return {'node_id': n['node_id'],
+                'node_group_id': ng['node_group_id']}
+
+    pairs = ((n, ng) for n in nodes for ng in node_groups_list)
+    results = bulk_assign('/api/node_group_assignments', pairs, to_data, api_action,
+                          chunk_size, concurrency, defer=defer)
+    log.info('{0} {1} node_group assignment(s), {2} failed.'.format(log_a,
+                                                                 len(results.succeeded),
+                                                                 len(results.failed)))
+    return results
 
 
 ## TAGS
 # FIXME: Duplicate code with other manage_* functions
-def manage_tag_assignments(tags, action_object, objects, api_action = 'put'):
+def manage_tag_assignments(tags, action_object, objects, api_action = 'put',
+                           chunk_size = None, concurrency = None, defer = False):
     """Assign or De-assign tags to one or more objects (nodes or node_groups).
 
     :arg tags: The list of key=value tags to assign/de-assign to/from the node or nodegroup. Multiple tags separated by comma(,).
     :arg action_object: The type of object you are tagging. Currently supported types are node and node_group.
     :arg objects: The nodes or node_groups search results to assign or de-assign the tags to/from.
     :arg api_action: Whether to put or delete.
+    :arg chunk_size: The number of assignments sent per batch request. See bulk_assign().
+    :arg concurrency: The number of requests in flight. Defaults to settings.concurrency.
+    :arg defer: Journal the assignments for journal.drain() instead of sending them. See bulk_assign().
+
+    Returns a BulkResult of ((object, tag), response) pairs.
 
     Usage::
 
       >>> client.manage_tag_assignments('mytag=value1', 'node', <object_search results>)
-      <Response [200]>
+      <BulkResult succeeded=2 failed=0>
       >>> client.manage_tag_assignments('mytag=value1,another_tag=value2', 'node_group', <object_search results>)
-      <Response [200]>
+      <BulkResult succeeded=4 failed=0>
       >>> client.manage_tag_assignments('mytag=value1', 'node', <object_search results>, 'delete')
-      <Response [200]>
+      <BulkResult succeeded=2 failed=0>
     """
 
     o_id = action_object + '_id'
@@ -652,20 +1628,24 @@ def manage_tag_assignments(tags, action_object, objects, api_action = 'put'):
                 'tag_value': lst[1],
                 'exact_get': True,
         }
-        r = api_submit('/api/tags', data, method='get_params')
-        if r['results']:
-            my_tags.append(r['results'][0])
+        r = lookup(('tags', lst[0], lst[1]), data)
+        if r:
+            my_tags.append(r[0])
         else:
             log.info('No existing tag found, creating...')
             r = api_submit('/api/tags', data, method='put')
+            lookup_cache.invalidate('tags')
             my_tags.append(r)
 
-    for o in objects:
-        for t in my_tags:
-            log.info('{0} tag {1}={2} {3} {4}={5}'.format(log_a, t['tag_name'], t['tag_value'], log_p, o_name, o[o_name]))
-            data = {o_id: o[o_id],
-                    'tag_id': t['tag_id']}
-            api_submit('/api/tag_{0}_assignments'.format(action_object), data, method=api_action)
+    def to_data(pair):
+        o, t = pair
+        log.info('{0} tag {1}={2} {3} {4}={5}'.format(log_a, t['tag_name'], t['tag_value'], log_p, o_name, o[o_name]))
+        return {o_id: o[o_id],
+                'tag_id': t['tag_id']}
+
+    pairs = ((o, t) for o in objects for t in my_tags)
+    return bulk_assign('/api/tag_{0}_assignments'.format(action_object), pairs, to_data,
+                       api_action, chunk_size, concurrency, defer=defer)
 
 
 def create_tag(tag_name, tag_value):
@@ -685,7 +1665,9 @@ def create_tag(tag_name, tag_value):
            }
 
     log.info('Creating tag tag_name={0},tag_value={1}'.format(tag_name, tag_value))
-    return api_submit('/api/tags', data, method='put')
+    r = api_submit('/api/tags', data, method='put')
+    lookup_cache.invalidate('tags')
+    return r
 
 
 def delete_tag(tag_id):
@@ -700,22 +1682,183 @@ def delete_tag(tag_id):
     """
 
     data = {'tag_id': tag_id}
-    return api_submit('/api/tags/{0}'.format(tag_id), data, method='delete')
+    r = api_submit('/api/tags/{0}'.format(tag_id), data, method='delete')
+    lookup_cache.invalidate('tags')
+    return r
 
 
 ## HYPERVISOR_ASSIGNMENTS
+# The fields of a hypervisor find_hypervisors() fetches and caches.
+HYPERVISOR_FIELDS = ('node_id', 'node_name', 'unique_id')
+
+
+def find_hypervisors(unique_ids, chunk_size = None):
+    """
+    Resolves hypervisor unique_ids to their nodes with one batched search
+    per chunk of unique_ids instead of one search each. Hypervisors found
+    are kept in the lookup_cache, so later calls reuse them.
+
+    Args:
+        unique_ids (iterable): The unique_ids of the hypervisors.
+        chunk_size (int): The number of unique_ids per search. Defaults to
+            settings.assignment_chunk_size.
+
+    Returns:
+        A dict of unique_id to node, as records of HYPERVISOR_FIELDS.
+        unique_ids that weren't found are left out.
+    """
+
+    if chunk_size is None:
+        chunk_size = settings.assignment_chunk_size
+    chunk_size = max(1, int(chunk_size))
+
+    # The cache may be saved as json, so it holds dicts, not records.
+    record = record_type(HYPERVISOR_FIELDS)
+    found = {}
+    missing = []
+    for unique_id in set(unique_ids):
+        r = lookup_cache.get(('hypervisors', unique_id))
+        if r and isinstance(r[0], dict):
+            found[unique_id] = record.from_dict(r[0])
+        else:
+            missing.append(unique_id)
+
+    for chunk in _chunks(sorted(missing), chunk_size):
+        fetched = []
+        for n in iter_search('nodes', 'unique_id={0}'.format(','.join(chunk)), True,
+                             fields=HYPERVISOR_FIELDS):
+            found[n['unique_id']] = n
+            fetched.append((('hypervisors', n['unique_id']), [n.to_dict()]))
+        lookup_cache.set_many(fetched)
+
+    return found
+
+
+def _current_hypervisors(node_ids, chunk_size):
+    """
+    Returns a dict of node_id to the node_ids of the hypervisors the node is
+    assigned to now, fetched with one batched search per chunk. Search
+    results passed in may be stale.
+    """
+
+    current = {}
+    for chunk in _chunks(node_ids, chunk_size):
+        for n in iter_search('nodes', 'node_id={0}'.format(','.join(str(i) for i in chunk)), True,
+                             fields=('node_id', 'hypervisor')):
+            current[n['node_id']] = set(h['node_id'] for h in n.get('hypervisor') or [])
+    return current
+
+
+def manage_hypervisor_mapping(mapping, chunk_size = None, concurrency = None):
+    """Assign VMs to hypervisors in bulk, e.g. after an evacuation.
+
+    :arg mapping: A dict of hypervisor unique_id to the nodes from the search results that should be assigned to it.
+    :arg chunk_size: The number of lookups per search and assignments per batch request. See bulk_assign().
+    :arg concurrency: The number of requests in flight. Defaults to settings.concurrency.
+
+    Every hypervisor is resolved with find_hypervisors(). Each node is
+    compared with the hypervisors it is currently assigned to and only the
+    difference is sent: the assignment to its hypervisor in the mapping if
+    it is missing, and the removal of any other hypervisor it is assigned
+    to. Nodes already where they should be cost no requests. Nodes mapped
+    to more than one hypervisor are skipped.
+
+    Returns a BulkResult of ((api_action, hypervisor, node), response) pairs.
+
+    Usage::
+
+      >>> client.manage_hypervisor_mapping({'00:11:22:33:44:55': <object_search results>,
+      ...                                   '00:11:22:33:44:66': <object_search results>})
+      <BulkResult succeeded=57 failed=0>
+    """
+
+    if chunk_size is None:
+        chunk_size = settings.assignment_chunk_size
+    chunk_size = max(1, int(chunk_size))
+
+    hypervisors = find_hypervisors(mapping.keys(), chunk_size)
+    for unique_id in mapping:
+        if unique_id not in hypervisors:
+            log.info('No hypervisor found: unique_id={0}'.format(unique_id))
+
+    nodes = {}
+    conflicts = set()
+    for unique_id in mapping:
+        if unique_id in hypervisors:
+            for n in mapping[unique_id] or []:
+                if n['node_id'] in nodes:
+                    conflicts.add(n['node_id'])
+                nodes[n['node_id']] = n
+    for node_id in conflicts:
+        log.error('Skipping node={0}, it is mapped to more than one hypervisor.'.format(nodes.pop(node_id)['node_name']))
+
+    current = _current_hypervisors(sorted(nodes), chunk_size)
+    by_id = dict((h['node_id'], h) for h in hypervisors.values())
+
+    puts = []
+    deletes = []
+    unchanged = 0
+    for unique_id, members in mapping.items():
+        hypervisor = hypervisors.get(unique_id)
+        if hypervisor is None:
+            continue
+        for n in members or []:
+            if n['node_id'] in conflicts:
+                continue
+            assigned = current.get(n['node_id'], set())
+            stale = assigned - set([hypervisor['node_id']])
+            if hypervisor['node_id'] not in assigned:
+                puts.append(('put', hypervisor, n))
+            elif not stale:
+                unchanged += 1
+            for parent_id in stale:
+                parent = by_id.get(parent_id, {'node_id': parent_id, 'node_name': str(parent_id)})
+                deletes.append(('delete', parent, n))
+
+    log.info('Hypervisor mapping: {0} assignment(s) to add, {1} to remove, {2} node(s) unchanged.'.format(
+        len(puts), len(deletes), unchanged))
+
+    def to_data(change):
+        api_action, hypervisor, n = change
+        log.info('{0} hypervisor={1} {2} node={3}'.format('Removing' if api_action == 'delete' else 'Assigning',
+                                                          hypervisor['node_name'],
+                                                          'from' if api_action == 'delete' else 'to',
+                                                          n['node_name']))
+        return {'parent_node_id': hypervisor['node_id'],
+                'child_node_id': n['node_id']}
+
+    results = BulkResult()
+    # Remove stale assignments first so no node is briefly on two
+    # hypervisors.
+    if deletes:
+        results.extend(bulk_assign('/api/hypervisor_vm_assignments', deletes, to_data, 'delete',
+                                   chunk_size, concurrency))
+    if puts:
+        results.extend(bulk_assign('/api/hypervisor_vm_assignments', puts, to_data, 'put',
+                                   chunk_size, concurrency))
+    return results
+
+
 # FIXME: Duplicate code with other manage_* functions
-def manage_hypervisor_assignments(hypervisor, nodes, api_action = 'put'):
+def manage_hypervisor_assignments(hypervisor, nodes, api_action = 'put',
+                                  chunk_size = None, concurrency = None, defer = False):
     """Assign or De-assign a hypervisor to one or more nodes.
 
     :arg hypervisor: The unique_id of the hypervisor you wish to assign.
     :arg nodes: The nodes from the search results to assign or de-assign to/from the hypervisor.
     :arg api_action: Whether to put or delete.
+    :arg chunk_size: The number of assignments sent per batch request. See bulk_assign().
+    :arg concurrency: The number of requests in flight. Defaults to settings.concurrency.
+    :arg defer: Journal the assignments for journal.drain() instead of sending them. See bulk_assign().
+
+    Returns a BulkResult of (node, response) pairs, None if the hypervisor
+    wasn't found. Use manage_hypervisor_mapping() to move many nodes
+    between hypervisors.
 
     Usage::
 
       >>> client.manage_hypervisor_assignments('00:11:22:33:44:55', <object_search results>, 'put')
-      <Response [200]>
+      <BulkResult succeeded=2 failed=0>
     """
 
     if api_action == 'delete':
@@ -725,20 +1868,19 @@ def manage_hypervisor_assignments(hypervisor, nodes, api_action = 'put'):
         log_a = 'Assigning'
         log_p = 'to'
 
-    data = {'unique_id': hypervisor,
-            'exact_get': True,
-    }
-    r = api_submit('/api/nodes', data, method='get_params')
-    if r['results']:
-        hypervisor = r['results'][0]
-
-        for n in nodes:
-            log.info('{0} hypervisor={1} {2} node={3}'.format(log_a, hypervisor['node_name'], log_p, n['node_name']))
-            data = {'parent_node_id': hypervisor['node_id'],
-                    'child_node_id': n['node_id']}
-            api_submit('/api/hypervisor_vm_assignments', data, method=api_action)
-    else:
+    found = find_hypervisors([hypervisor])
+    if hypervisor not in found:
         log.info('No hypervisor found: unique_id={0}'.format(hypervisor))
+        return None
+    hypervisor = found[hypervisor]
+
+    def to_data(n):
+        log.info('{0} hypervisor={1} {2} node={3}'.format(log_a, hypervisor['node_name'], log_p, n['node_name']))
+        return {'parent_node_id': hypervisor['node_id'],
+                'child_node_id': n['node_id']}
+
+    return bulk_assign('/api/hypervisor_vm_assignments', nodes, to_data, api_action,
+                       chunk_size, concurrency, defer=defer)
 
 
 ## MAIN_SETTINGS
@@ -750,10 +1892,34 @@ def check_root():
         sys.exit(1)
 
 
+# Settings where None means no limit, set with none or 0 in the conf file.
+_OPTIONAL_SETTINGS = ('connect_timeout', 'read_timeout')
+
+
+def _coerce_setting(name, value):
+    """Coerce a string from the conf file to the type of the setting's default."""
+
+    default = getattr(settings, name, None)
+    if name in _OPTIONAL_SETTINGS:
+        if value.lower() == 'none' or float(value) == 0:
+            return None
+        return float(value)
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    elif isinstance(default, (int, float)):
+        return type(default)(value)
+    return value
+
+
 def configSettings(conf, secret_conf = None):
     """Read in all our configuration settings from the main .ini and
        from the secrets.ini, if specified."""
 
+    try:
+        import ConfigParser
+    except ImportError:
+        import configparser as ConfigParser
+
     log_lines = []
     cp = ConfigParser.ConfigParser()
     cp.read(conf)
@@ -761,10 +1927,14 @@ def configSettings(conf, secret_conf = None):
         for k,v in cp.items(s):
             if v:
                 log_lines.append('Assigning setting: {0}={1}'.format(k, v))
-                setattr(settings, k, v)
+                setattr(settings, k, _coerce_setting(k, v))
 
     if secret_conf:
-        scp = ConfigParser.SafeConfigParser()
+        # SafeConfigParser became ConfigParser in py3, and is gone in 3.12.
+        if sys.version_info[0] < 3:
+            scp = ConfigParser.SafeConfigParser()
+        else:
+            scp = ConfigParser.ConfigParser()
         scp.read(secret_conf)
         for s in scp._sections.keys():
             for k,v in scp.items(s):
@@ -779,9 +1949,61 @@ def configSettings(conf, secret_conf = None):
     return log_lines
 
 
+def configure(conf=None, secret_conf=None, args=None):
+    """
+    Applies the conf files and args to settings without touching logging.
+    A lighter entry point than main() for scripts that only need settings,
+    e.g. a single search from cron.
+
+    Usage::
+
+      >>> client.configure('/path/to/my/arsenal.ini')
+      >>> results = client.object_search('nodes', 'node_name=myserver.mycompany.com', True)
+
+    Args:
+        conf (Optional[str]): The path to the conf file. None uses the
+            settings as they are.
+        secret_conf (Optional[str]): The path to the secret_conf file
+        args (Optional[obj]): Overrides settings like it does for main().
+
+    Returns:
+        A list of lines describing the settings that were assigned.
+    """
+
+    log_lines = []
+    if conf or secret_conf:
+        log_lines = configSettings(conf, secret_conf)
+
+    for z in [a for a in dir(args) if not a.startswith('__') and not callable(getattr(args,a))]:
+        if getattr(args, z):
+            log_lines.append('Assigning arg: {0}={1}'.format(z, getattr(args, z)))
+            setattr(settings, z, getattr(args, z))
+
+    if hasattr(settings, 'user_login'):
+        if settings.user_login == 'kaboom':
+            check_root()
+            # FIXME: Will need os checking here
+            settings.cookie_file = '/root/.arsenal_kaboom_cookie'
+    
+        if settings.user_login == 'hvm':
+            check_root()
+            # FIXME: Will need os checking here
+            settings.cookie_file = '/root/.arsenal_hvm_cookie'
+    else:
+        setattr(settings, 'user_login', 'read_only')
+
+    # Drop the session so it is built on first use with the pool settings
+    # that are now known.
+    global session
+    session = None
+
+    return log_lines
+
+
 def main(conf, secret_conf = None, args = None):
     """
-    The arsenal client library.
+    The arsenal client library. Configures settings like configure() and
+    sets up logging.
 
     Usage::
 
@@ -799,12 +2021,7 @@ def main(conf, secret_conf = None, args = None):
             in as part of the args object.
     """
 
-    log_lines = configSettings(conf, secret_conf)
-
-    for z in [a for a in dir(args) if not a.startswith('__') and not callable(getattr(args,a))]:
-        if getattr(args, z):
-            log_lines.append('Assigning arg: {0}={1}'.format(z, getattr(args, z)))
-            setattr(settings, z, getattr(args, z))
+    log_lines = configure(conf, secret_conf, args)
 
     # FIXME: Should we write to the log file at INFO even when console is ERROR?
     # FIXME: Should we write to a log at all for regular users? Perhaps only if they ask for it i.e another option?
@@ -850,17 +2067,3 @@ def main(conf, secret_conf = None, args = None):
 
     log.info('Using server: %s'
              % settings.api_host)
-
-    if hasattr(settings, 'user_login'):
-        if settings.user_login == 'kaboom':
-            check_root()
-            # FIXME: Will need os checking here
-            settings.cookie_file = '/root/.arsenal_kaboom_cookie'
-    
-        if settings.user_login == 'hvm':
-            check_root()
-            # FIXME: Will need os checking here
-            settings.cookie_file = '/root/.arsenal_hvm_cookie'
-    else:
-        setattr(settings, 'user_login', 'read_only')
-
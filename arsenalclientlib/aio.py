@@ -0,0 +1,575 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+asyncio version of the client API. Requires python 3.6+ and aiohttp.
+
+Cookies come from the same in-memory cookie cache as the sync client and
+request bodies are serialized with the same to_json(), so the two can be
+used side by side after main() has been called.
+
+The manage_* coroutines send one request per assignment. Unlike the sync
+client's bulk_assign() they don't batch assignments, and there is no async
+manage_hypervisor_mapping(). Hypervisors are resolved through the same
+lookup cache entries as find_hypervisors() though.
+
+Usage::
+
+  >>> import asyncio
+  >>> import arsenalclientlib as client
+  >>> from arsenalclientlib.aio import AsyncClient
+  >>> client.main('/path/to/my/arsenal.ini')
+  >>> async def drain(rack):
+  ...     async with AsyncClient(concurrency=200) as aclient:
+  ...         nodes = await aclient.object_search('nodes', 'node_name=' + rack)
+  ...         return await aclient.set_status('maintenance', nodes)
+  >>> asyncio.get_event_loop().run_until_complete(drain('rack12'))
+  <BulkResult succeeded=1200 failed=0>
+"""
+import asyncio
+import logging
+import time
+import ssl
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.bulk import BulkResult
+from arsenalclientlib.metrics import metrics, endpoint
+from arsenalclientlib.exceptions import (CircuitOpenError, ConnectionFailedError,
+    DeadlineExceededError)
+
+log = logging.getLogger(__name__)
+
+
+class _Request(object):
+
+    def __init__(self, method):
+        self.method = method
+
+
+class _Response(object):
+    """Just enough of a requests response for check_response_codes()."""
+
+    def __init__(self, status_code, body, method=None, url=None, attempts=1, elapsed=None):
+        self.status_code = status_code
+        self._body = body
+        self.request = _Request(method)
+        self.url = url
+        self.attempts = attempts
+        self.elapsed_total = elapsed
+
+    def json(self):
+        return self._body
+
+
+def _params(data):
+    """aiohttp only accepts str query params, drop None like requests does."""
+
+    params = {}
+    for k, v in (data or {}).items():
+        if v is not None:
+            params[k] = str(v)
+    return params
+
+
+class AsyncSingleFlight(object):
+    """
+    Collapses concurrent identical coroutine calls into one. See
+    arsenalclientlib.cache.SingleFlight.
+
+    Attributes:
+        hits (int): Calls that shared another caller's result.
+        misses (int): Calls that were actually made.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def do(self, key, func):
+        """Awaits func(), shared with any concurrent caller using key."""
+
+        future = self._calls.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = self._calls[key] = asyncio.ensure_future(func())
+        future.add_done_callback(lambda f: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+
+class AsyncClient(object):
+    """
+    An asyncio client for the API. All requests share one aiohttp session
+    and at most concurrency of them are in flight at once.
+
+    Args:
+        concurrency (int): The maximum number of requests in flight.
+            Defaults to settings.concurrency.
+    """
+
+    def __init__(self, concurrency=None):
+        if aiohttp is None:
+            raise ImportError('arsenalclientlib.aio requires aiohttp.')
+
+        if concurrency is None:
+            concurrency = settings.concurrency
+        self.concurrency = int(concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = None
+        self._prefetches = set()
+        self.single_flight = AsyncSingleFlight()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        # Page prefetches of searches that were abandoned would otherwise
+        # fail on the closed session.
+        for task in list(self._prefetches):
+            task.cancel()
+        if self._prefetches:
+            await asyncio.wait(self._prefetches)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _ssl(self):
+        verify = settings.ssl_verify
+        if verify is False:
+            return False
+        if isinstance(verify, str):
+            return ssl.create_default_context(cafile=verify)
+        return None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=max(int(settings.pool_maxsize), self.concurrency),
+                                             force_close=not settings.keep_alive,
+                                             ssl=self._ssl())
+            timeout = aiohttp.ClientTimeout(sock_connect=settings.connect_timeout,
+                                            sock_read=settings.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def get_cookie_auth(self):
+        """Gets cookies from the cookie cache shared with the sync client."""
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, client.get_cookie_auth)
+
+    async def _reauthenticate(self, cookies):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, client.cookie_cache.reauthenticate, cookies)
+
+    async def _request(self, method, api_url, policy=None, **kwargs):
+        """
+        Sends a request with the same retry policy and circuit breaker as
+        the sync client. See arsenalclientlib._request().
+
+        Returns:
+            A _Response.
+        """
+
+        if policy is None:
+            policy = client.retry_policy
+        breaker = client.circuit_breaker
+
+        start = time.time()
+        attempts = 0
+
+        while True:
+            try:
+                breaker.before_request(api_url)
+            except CircuitOpenError as e:
+                e.method, e.attempts, e.elapsed = method.upper(), attempts, time.time() - start
+                raise
+
+            elapsed = time.time() - start
+            if policy.deadline:
+                remaining = max(0.001, policy.deadline - elapsed)
+                kwargs['timeout'] = aiohttp.ClientTimeout(total=remaining,
+                                                          sock_connect=settings.connect_timeout,
+                                                          sock_read=settings.read_timeout)
+
+            attempts += 1
+            error = None
+            status = None
+            body = None
+            retry_after = None
+            # The token bucket is shared with the sync client, wait for it
+            # without blocking the loop.
+            wait = client.rate_limiter.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            sent = time.time()
+            try:
+                # Only the attempt holds a concurrency slot, not the backoff.
+                async with self._semaphore:
+                    async with self._get_session().request(method, api_url, **kwargs) as r:
+                        status = r.status
+                        retry_after = r.headers.get('Retry-After')
+                        if status == 200:
+                            body = await r.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            labels = {'method': method.upper(), 'endpoint': endpoint(api_url)}
+            metrics.observe('http_request_seconds', time.time() - sent, **labels)
+            metrics.inc('http_requests_total', status=str(status or 'error'), **labels)
+
+            elapsed = time.time() - start
+            if error is None and status not in policy.statuses:
+                breaker.record_success()
+                return _Response(status, body, method.upper(), api_url, attempts, elapsed)
+
+            breaker.record_failure()
+            delay = policy.delay(attempts, retry_after)
+
+            if policy.should_retry(method, attempts, elapsed, delay):
+                log.info('Request failed ({0}), retry {1}/{2} in {3:.1f}s: {4}'.format(
+                    error or status, attempts, policy.retries, delay, api_url))
+                metrics.inc('http_retries_total', **labels)
+                await asyncio.sleep(delay)
+                continue
+
+            meta = {'method': method.upper(), 'url': api_url, 'attempts': attempts, 'elapsed': elapsed}
+            if policy.deadline and elapsed + delay >= policy.deadline:
+                raise DeadlineExceededError('Request did not succeed within {0}s: {1}'.format(
+                    policy.deadline, error or status), **meta)
+            if error is not None:
+                raise ConnectionFailedError('Unable to reach API: {0}'.format(error), **meta)
+
+            return _Response(status, body, method.upper(), api_url, attempts, elapsed)
+
+    async def api_submit(self, request, data=None, method='get', cookies=None, policy=None):
+        """
+        Manages http requests to the API. See arsenalclientlib.api_submit().
+        Concurrent identical GETs share one request, counted in
+        self.single_flight.
+
+        Returns:
+            check_response_codes() if 'put' or 'delete', json if sccessful
+            'get', None if a 'get' found nothing.
+
+        Raises:
+            ArsenalError: An ArsenalError subclass describing the failure.
+        """
+
+        headers = {'content-type': 'application/json'}
+
+        api_url = (settings.api_protocol
+                   + '://'
+                   + settings.api_host
+                   + request)
+
+        if method in ('put', 'delete'):
+
+            body = data if isinstance(data, (str, bytes)) else client.to_json(data)
+            if cookies is None:
+                cookies = await self.get_cookie_auth()
+
+            log.debug('Submitting {0} to API: {1}'.format(method, api_url))
+
+            r = await self._request(method, api_url, policy, cookies=cookies,
+                                    headers=headers, data=body)
+
+            # re-auth if our cookie is invalid/expired
+            if r.status_code == 401:
+                cookies = await self._reauthenticate(cookies)
+                r = await self._request(method, api_url, policy, cookies=cookies,
+                                        headers=headers, data=body)
+
+            return client.check_response_codes(r)
+
+        params = _params(data) if method == 'get_params' else None
+
+        async def get():
+            r = await self._request('get', api_url, policy, params=params)
+
+            if r.status_code == 200:
+                return r.json()
+            if r.status_code == 404:
+                return None
+            return client.check_response_codes(r)
+
+        if not settings.single_flight:
+            return await get()
+        return await self.single_flight.do(client._request_key(api_url, params), get)
+
+    async def lookup(self, key, data):
+        """
+        Looks up reference objects by name through the lookup cache shared
+        with the sync client. See arsenalclientlib.lookup().
+
+        Returns:
+            A list of results, empty if nothing matched.
+        """
+
+        r = client.lookup_cache.get(key)
+        if r is None:
+            results = await self.api_submit('/api/{0}'.format(key[0]), data, method='get_params')
+            if not results or not results['results']:
+                return []
+            r = results['results']
+            client.lookup_cache.set(key, r)
+        return r
+
+    async def run(self, func, items):
+        """
+        Awaits func(item) for every item concurrently. The number of requests
+        in flight is bounded by the client's concurrency.
+
+        Returns:
+            A BulkResult.
+        """
+
+        result = BulkResult()
+
+        async def one(item):
+            try:
+                result.add_success(item, await func(item))
+            except Exception as e:
+                log.error('Failed: {0}'.format(e))
+                result.add_failure(item, e)
+
+        await asyncio.gather(*[one(i) for i in items])
+        return result
+
+    async def iter_search(self, object_type, search, exact_get=None, page_size=None, model=None):
+        """
+        Searches the API one page at a time, fetching the next page while the
+        current one is consumed. See arsenalclientlib.iter_search().
+
+        Usage::
+
+          >>> async for n in aclient.iter_search('nodes', 'node_name=web'):
+          ...     print(n['node_name'])
+        """
+
+        if page_size is None:
+            page_size = settings.search_page_size
+        page_size = int(page_size)
+
+        data = client._search_params(search, exact_get)
+        log.debug('Searching for: {0}'.format(data))
+
+        api_endpoint = '/api/{0}'.format(object_type)
+
+        def fetch(start):
+            params = dict(data)
+            params['start'] = start
+            params['limit'] = page_size
+            task = asyncio.ensure_future(self.api_submit(api_endpoint, params, method='get_params'))
+            self._prefetches.add(task)
+            task.add_done_callback(self._prefetches.discard)
+            return task
+
+        start = 0
+        pending = fetch(start)
+        try:
+            while pending:
+                results = await pending
+                pending = None
+
+                if not results or not results['results']:
+                    return
+
+                r = results['results']
+                start = client._next_start(results, start, page_size)
+                if start is not None:
+                    pending = fetch(start)
+
+                for i in r:
+                    yield i if model is None else model.from_dict(i)
+        finally:
+            # The consumer stopped early or raised: don't leave the next
+            # page's request running, nor its exception unretrieved.
+            if pending is not None:
+                pending.cancel()
+                await asyncio.wait([pending])
+                if not pending.cancelled():
+                    pending.exception()
+
+    async def object_search(self, object_type, search, exact_get=None, model=None):
+        """
+        Main serach function to query the API. See
+        arsenalclientlib.object_search().
+
+        Returns:
+            A list of all results across every page, None if nothing matched.
+        """
+
+        r = [i async for i in self.iter_search(object_type, search, exact_get, model=model)]
+
+        if not r:
+            log.info('No results found for search.')
+            return None
+        else:
+            return r
+
+    async def set_status(self, status_name, nodes):
+        """
+        Set the status of one or more nodes. See arsenalclientlib.set_status().
+
+        Returns:
+            A BulkResult with the per-node outcome.
+        """
+
+        data = {'status_name': status_name,
+                'exact_get': True,
+        }
+        status = (await self.lookup(('statuses', status_name), data))[0]
+
+        data = {'status_id': status['status_id']}
+
+        async def update(n):
+            log.info('Setting status node={0},status={1}'.format(n['node_name'], status['status_name']))
+            return await self.api_submit('/api/nodes/{0}'.format(n['node_id']), data, method='put')
+
+        return await self.run(update, nodes)
+
+    async def manage_node_group_assignments(self, node_groups, nodes, api_action='put'):
+        """
+        Assign or De-assign node_groups to one or more nodes. See
+        arsenalclientlib.manage_node_group_assignments().
+
+        Returns:
+            A BulkResult with the outcome of every node, node_group pair.
+        """
+
+        if api_action == 'delete':
+            log_a = 'Removing'
+            log_p = 'from'
+        else:
+            log_a = 'Assigning'
+            log_p = 'to'
+
+        names = node_groups.split(',')
+        found = await asyncio.gather(*[self.lookup(('node_groups', ng),
+                                                   {'node_group_name': ng}) for ng in names])
+        node_groups_list = []
+        for ng, r in zip(names, found):
+            if r:
+                node_groups_list.extend(r)
+            else:
+                log.info('Not found: node_group={0}'.format(ng))
+
+        async def assign(pair):
+            n, ng = pair
+            log.info('{0} node_group={1} {2} node={3}'.format(log_a, ng['node_group_name'], log_p, n['node_name']))
+            data = {'node_id': n['node_id'],
+                    'node_group_id': ng['node_group_id']}
+            return await self.api_submit('/api/node_group_assignments', data, method=api_action)
+
+        return await self.run(assign, [(n, ng) for n in nodes for ng in node_groups_list])
+
+    async def manage_tag_assignments(self, tags, action_object, objects, api_action='put'):
+        """
+        Assign or De-assign tags to one or more objects (nodes or node_groups).
+        See arsenalclientlib.manage_tag_assignments().
+
+        Returns:
+            A BulkResult with the outcome of every object, tag pair.
+        """
+
+        o_id = action_object + '_id'
+        o_name = action_object + '_name'
+        if api_action == 'delete':
+            log_a = 'Removing'
+            log_p = 'from'
+        else:
+            log_a = 'Assigning'
+            log_p = 'to'
+
+        async def get_tag(t):
+            lst = t.split('=')
+            data = {'tag_name': lst[0],
+                    'tag_value': lst[1],
+                    'exact_get': True,
+            }
+            r = await self.lookup(('tags', lst[0], lst[1]), data)
+            if r:
+                return r[0]
+            log.info('No existing tag found, creating...')
+            r = await self.api_submit('/api/tags', data, method='put')
+            client.lookup_cache.invalidate('tags')
+            return r
+
+        my_tags = await asyncio.gather(*[get_tag(t) for t in tags.split(',')])
+
+        async def assign(pair):
+            o, t = pair
+            log.info('{0} tag {1}={2} {3} {4}={5}'.format(log_a, t['tag_name'], t['tag_value'], log_p, o_name, o[o_name]))
+            data = {o_id: o[o_id],
+                    'tag_id': t['tag_id']}
+            return await self.api_submit('/api/tag_{0}_assignments'.format(action_object), data,
+                                         method=api_action)
+
+        return await self.run(assign, [(o, t) for o in objects for t in my_tags])
+
+    async def manage_hypervisor_assignments(self, hypervisor, nodes, api_action='put'):
+        """
+        Assign or De-assign a hypervisor to one or more nodes. See
+        arsenalclientlib.manage_hypervisor_assignments().
+
+        Returns:
+            A BulkResult with the per-node outcome, None if the hypervisor
+            was not found.
+        """
+
+        if api_action == 'delete':
+            log_a = 'Removing'
+            log_p = 'from'
+        else:
+            log_a = 'Assigning'
+            log_p = 'to'
+
+        # Shares the cache entries of the sync find_hypervisors().
+        key = ('hypervisors', hypervisor)
+        r = client.lookup_cache.get(key)
+        if r and isinstance(r[0], dict):
+            found = r[0]
+        else:
+            data = {'unique_id': hypervisor,
+                    'exact_get': True,
+            }
+            r = await self.api_submit('/api/nodes', data, method='get_params')
+            if not r or not r['results']:
+                log.info('No hypervisor found: unique_id={0}'.format(hypervisor))
+                return None
+            found = dict((f, r['results'][0].get(f)) for f in client.HYPERVISOR_FIELDS)
+            client.lookup_cache.set(key, [found])
+
+        hypervisor = found
+
+        async def assign(n):
+            log.info('{0} hypervisor={1} {2} node={3}'.format(log_a, hypervisor['node_name'], log_p, n['node_name']))
+            data = {'parent_node_id': hypervisor['node_id'],
+                    'child_node_id': n['node_id']}
+            return await self.api_submit('/api/hypervisor_vm_assignments', data,
+                                         method=api_action)
+
+        return await self.run(assign, nodes)
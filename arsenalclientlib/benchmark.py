@@ -0,0 +1,430 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Benchmarks the client's workflows against a local stub server and compares
+them with a stored baseline, so changes that make the client slower, send
+more requests or use more memory are caught before a release.
+
+Usage::
+
+  >>> from arsenalclientlib import benchmark
+  >>> results = benchmark.run(nodes=2000, latency=0.002)
+  >>> benchmark.compare(results, benchmark.load_baseline('benchmarks/baseline.json'))
+  []
+
+From the command line, exiting 1 on a regression::
+
+  $ python -m arsenalclientlib.benchmark --baseline benchmarks/baseline.json
+  $ python -m arsenalclientlib.benchmark --baseline benchmarks/baseline.json --save
+
+Check that importing the package stays within IMPORT_BUDGET and doesn't
+load any of LAZY_MODULES::
+
+  $ python -m arsenalclientlib.benchmark --startup
+"""
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.bulk import run_concurrent
+from arsenalclientlib.metrics import metrics
+from arsenalclientlib.node import Node
+from arsenalclientlib.stub_server import StubServer
+
+log = logging.getLogger(__name__)
+
+WORKFLOWS = ('register', 'search', 'set_status', 'tag_assignments',
+             'node_group_assignments', 'hypervisor_assignments', 'hypervisor_mapping')
+
+# Which direction is worse for each measurement. Requests are compared
+# exactly, the rest with the tolerance.
+HIGHER_IS_BETTER = ('ops_per_sec',)
+LOWER_IS_BETTER = ('p50', 'p99', 'memory_kb')
+EXACT = ('requests',)
+PERCENTILES = ('p50', 'p99')
+
+# Latency percentiles of workflows sending fewer requests than this are
+# too noisy to compare.
+MIN_SAMPLES = 100
+
+# Seconds importing arsenalclientlib may add to interpreter startup. Cron
+# and shell invocations across the fleet pay it on every run.
+IMPORT_BUDGET = 0.05
+
+# Modules importing arsenalclientlib must not load. They are imported by the
+# functions that need them.
+LAZY_MODULES = ('requests', 'urllib3', 'subprocess', 'getpass', 'ast', 'ConfigParser',
+                'configparser', 'sqlite3', 'asyncio', 'aiohttp')
+
+_STARTUP_SCRIPT = """
+import sys
+import arsenalclientlib
+print(','.join(m for m in {0!r} if m in sys.modules))
+"""
+
+
+def percentile(values, pct):
+    """The pct percentile of values by nearest rank, 0.0 if there are none."""
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class _Latencies(object):
+    """A metrics hook that keeps every http request latency."""
+
+    def __init__(self):
+        self.values = []
+
+    def __call__(self, kind, name, value, labels):
+        if name == 'http_request_seconds':
+            self.values.append(value)
+
+
+def _memory_start():
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        return None
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+def _memory_stop(start):
+    """Peak memory in KB since _memory_start()."""
+
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak // 1024
+    if resource is not None:
+        # Only grows, so this is the growth of the process high water mark.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start
+    return 0
+
+
+def _workflows(nodes, hypervisors):
+    """Returns (name, func) pairs. func() returns the number of operations."""
+
+    def register():
+        def one(i):
+            node = Node(unique_id='bench-{0:06d}'.format(i), node_name='bench{0:06d}.example.com'.format(i))
+            return client.api_submit('/api/register', node, method='put')
+        run_concurrent(one, range(nodes))
+        return nodes
+
+    def search():
+        return len(client.object_search('nodes', 'node_name=node'))
+
+    def set_status():
+        found = client.object_search('nodes', 'node_name=node')
+        return len(client.set_status('maintenance', found).succeeded)
+
+    def tag_assignments():
+        found = client.object_search('nodes', 'node_name=node')
+        return len(client.manage_tag_assignments('bench=1', 'node', found).succeeded)
+
+    def node_group_assignments():
+        found = client.object_search('nodes', 'node_name=node')
+        return len(client.manage_node_group_assignments('group000', found).succeeded)
+
+    def hypervisor_assignments():
+        found = client.object_search('nodes', 'node_name=node')
+        vms = [n for n in found if n['unique_id'] != hypervisors[0]]
+        client.manage_hypervisor_assignments(hypervisors[0], vms)
+        return len(vms)
+
+    def hypervisor_mapping():
+        # Spreads the VMs over every hypervisor, moving most of them off the
+        # one hypervisor_assignments() put them on.
+        found = client.object_search('nodes', 'node_name=node')
+        vms = [n for n in found if n['unique_id'] not in hypervisors]
+        mapping = dict((h, vms[i::len(hypervisors)]) for i, h in enumerate(hypervisors))
+        client.manage_hypervisor_mapping(mapping)
+        return len(vms)
+
+    return [('register', register),
+            ('search', search),
+            ('set_status', set_status),
+            ('tag_assignments', tag_assignments),
+            ('node_group_assignments', node_group_assignments),
+            ('hypervisor_assignments', hypervisor_assignments),
+            ('hypervisor_mapping', hypervisor_mapping),
+    ]
+
+
+def run(nodes=1000, latency=0.0, concurrency=10, workflows=None):
+    """
+    Runs each workflow once against a fresh stub server with a fleet of
+    nodes.
+
+    Args:
+        nodes (int): The fleet size.
+        latency (float): Seconds the stub adds to every request.
+        concurrency (int): settings.concurrency for the run.
+        workflows (list): The names of the workflows to run. Defaults to
+            all of WORKFLOWS.
+
+    Returns:
+        A dict of workflow name to a dict with the number of operations,
+        seconds, ops_per_sec, requests sent, p50 and p99 request latency in
+        seconds and peak memory_kb.
+    """
+
+    saved = dict((k, getattr(settings, k, None)) for k in
+                 ('api_protocol', 'api_host', 'ssl_verify', 'user_login', 'cookie_file',
+                  'concurrency', 'metrics_enabled', 'metrics_textfile', 'statsd_host',
+                  'assignment_batch_endpoint'))
+    saved_session = client.session
+    server = StubServer(latency=latency).start()
+    server.populate(nodes)
+    hypervisors = [server.objects['nodes'][i]['unique_id'] for i in range(1, min(nodes, 10) + 1)]
+    latencies = _Latencies()
+    results = {}
+    try:
+        server.configure()
+        settings.user_login = 'kaboom'
+        fd, settings.cookie_file = tempfile.mkstemp(prefix='arsenal_benchmark')
+        os.close(fd)
+        settings.concurrency = concurrency
+        settings.metrics_enabled = True
+        settings.metrics_textfile = None
+        settings.statsd_host = None
+        settings.assignment_batch_endpoint = StubServer.BATCH_ENDPOINT
+        client.session = client.build_session()
+        client.cookie_cache.clear()
+        client.lookup_cache.invalidate()
+        metrics.add_hook(latencies)
+
+        for name, func in _workflows(nodes, hypervisors):
+            if workflows and name not in workflows:
+                continue
+            del latencies.values[:]
+            sent = len(server.requests)
+            start = time.time()
+            ops = func()
+            seconds = time.time() - start
+            requests = len(server.requests) - sent
+            p50 = percentile(latencies.values, 50)
+            p99 = percentile(latencies.values, 99)
+
+            # Memory tracing slows everything down, so memory is measured
+            # on a second run. Every workflow is idempotent.
+            mem = _memory_start()
+            try:
+                func()
+            finally:
+                memory_kb = _memory_stop(mem)
+            results[name] = {'ops': ops,
+                             'seconds': round(seconds, 4),
+                             'ops_per_sec': round(ops / seconds, 1) if seconds else 0.0,
+                             'requests': requests,
+                             'p50': round(p50, 5),
+                             'p99': round(p99, 5),
+                             'memory_kb': memory_kb,
+            }
+        return results
+    finally:
+        metrics.remove_hook(latencies)
+        client.session.close()
+        server.stop()
+        if os.path.isfile(settings.cookie_file):
+            os.unlink(settings.cookie_file)
+        for k, v in saved.items():
+            setattr(settings, k, v)
+        client.session = saved_session
+        client.cookie_cache.clear()
+        client.lookup_cache.invalidate()
+
+
+def _run_python(code):
+    import subprocess
+
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (root, env.get('PYTHONPATH')) if p)
+    start = time.time()
+    p = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, env=env,
+                         universal_newlines=True)
+    output = p.communicate()[0]
+    return time.time() - start, output.strip()
+
+
+def startup(runs=5):
+    """
+    Measures how long importing arsenalclientlib takes in a fresh
+    interpreter, over a bare interpreter's startup, and which of
+    LAZY_MODULES it loads.
+
+    Args:
+        runs (int): The number of interpreters to time. The median is used.
+
+    Returns:
+        A dict with import_seconds, the IMPORT_BUDGET, the list of lazy
+        modules loaded and ok, True if the import is within budget and
+        loaded none.
+    """
+
+    bare = []
+    imported = []
+    loaded = []
+    for i in range(runs):
+        bare.append(_run_python('pass')[0])
+        seconds, output = _run_python(_STARTUP_SCRIPT.format(LAZY_MODULES))
+        imported.append(seconds)
+        loaded = [m for m in output.split(',') if m]
+
+    import_seconds = max(0.0, percentile(imported, 50) - percentile(bare, 50))
+    return {'import_seconds': round(import_seconds, 4),
+            'budget': IMPORT_BUDGET,
+            'loaded': loaded,
+            'ok': import_seconds <= IMPORT_BUDGET and not loaded,
+    }
+
+
+def load_baseline(path):
+    """Returns the baseline stored at path, None if there is none."""
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError):
+        return None
+
+
+def save_baseline(path, results, **params):
+    """Stores results, and the params they were run with, as the baseline."""
+
+    data = {'params': params, 'results': results}
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_file = tempfile.mkstemp(dir=directory, prefix='.arsenal_baseline')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.chmod(tmp_file, 0o644)
+    os.rename(tmp_file, path)
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compares results with a baseline.
+
+    Timings and memory regress when they are more than tolerance worse
+    than the baseline, the number of requests when it grows at all.
+    Latency percentiles are only compared for workflows sending at least
+    MIN_SAMPLES requests.
+
+    Returns:
+        A list of (workflow, measurement, baseline value, value) for every
+        regression. Empty if there are none.
+    """
+
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = (baseline or {}).get('results', {}).get(name)
+        if not base:
+            continue
+        for k in HIGHER_IS_BETTER:
+            if k in base and result[k] < base[k] * (1 - tolerance):
+                regressions.append((name, k, base[k], result[k]))
+        for k in LOWER_IS_BETTER:
+            if k in PERCENTILES and base.get('requests', 0) < MIN_SAMPLES:
+                continue
+            if k in base and result[k] > base[k] * (1 + tolerance):
+                regressions.append((name, k, base[k], result[k]))
+        for k in EXACT:
+            if k in base and result[k] > base[k]:
+                regressions.append((name, k, base[k], result[k]))
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark client workflows against a local stub server.')
+    parser.add_argument('--nodes', type=int, default=None, help='Fleet size. Defaults to the baseline\'s.')
+    parser.add_argument('--latency', type=float, default=None, help='Seconds the stub adds to every request. Defaults to the baseline\'s.')
+    parser.add_argument('--concurrency', type=int, default=None, help='Requests in flight. Defaults to the baseline\'s.')
+    parser.add_argument('--workflow', action='append', choices=WORKFLOWS, help='Only run this workflow. May be repeated.')
+    parser.add_argument('--baseline', default=None, help='Baseline json file to compare with.')
+    parser.add_argument('--save', action='store_true', help='Store the results as the baseline instead of comparing.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before a timing counts as a regression.')
+    parser.add_argument('--startup', action='store_true', help='Only check import time and lazy imports.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.startup:
+        result = startup()
+        print('import: {0:.1f} ms (budget {1:.1f} ms)'.format(result['import_seconds'] * 1000,
+                                                             result['budget'] * 1000))
+        if result['loaded']:
+            print('loaded at import: {0}'.format(', '.join(result['loaded'])))
+        if not result['ok']:
+            sys.exit(1)
+        return
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    params = (baseline or {}).get('params', {})
+    nodes = args.nodes or params.get('nodes', 1000)
+    latency = args.latency if args.latency is not None else params.get('latency', 0.0)
+    concurrency = args.concurrency or params.get('concurrency', 10)
+
+    results = run(nodes, latency, concurrency, args.workflow)
+    print('{0:>24} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>10}'.format(
+        'workflow', 'ops', 'ops/s', 'requests', 'p50 ms', 'p99 ms', 'memory KB'))
+    for name in WORKFLOWS:
+        if name in results:
+            r = results[name]
+            print('{0:>24} {1:>8} {2:>10} {3:>9} {4:>9.2f} {5:>9.2f} {6:>10}'.format(
+                name, r['ops'], r['ops_per_sec'], r['requests'], r['p50'] * 1000, r['p99'] * 1000,
+                r['memory_kb']))
+
+    if args.save:
+        if not args.baseline:
+            parser.error('--save needs --baseline')
+        save_baseline(args.baseline, results, nodes=nodes, latency=latency, concurrency=concurrency)
+        print('Saved baseline to {0}'.format(args.baseline))
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, k, base, value in regressions:
+        print('REGRESSION {0} {1}: {2} -> {3}'.format(name, k, base, value))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
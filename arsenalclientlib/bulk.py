@@ -0,0 +1,141 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+import threading
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+import arsenalclientlib.settings as settings
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BulkResult(object):
+    """
+    The per-item outcome of a bulk operation.
+
+    Attributes:
+        succeeded (list): (item, result) tuples for every item that succeeded.
+        failed (list): (item, exception) tuples for every item that failed.
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def add_success(self, item, result):
+        with self._lock:
+            self.succeeded.append((item, result))
+
+    def add_failure(self, item, error):
+        with self._lock:
+            self.failed.append((item, error))
+
+    def extend(self, other):
+        """Adds the outcomes of another BulkResult."""
+
+        with self._lock:
+            self.succeeded.extend(other.succeeded)
+            self.failed.extend(other.failed)
+
+    @property
+    def total(self):
+        return len(self.succeeded) + len(self.failed)
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __repr__(self):
+        return '<BulkResult succeeded={0} failed={1}>'.format(len(self.succeeded),
+                                                              len(self.failed))
+
+
+def _call(func, item, result):
+    try:
+        result.add_success(item, func(item))
+    except Exception as e:
+        log.error('Failed: {0}'.format(e))
+        result.add_failure(item, e)
+
+
+def run_concurrent(func, items, concurrency=None):
+    """
+    Calls func(item) for every item using a bounded pool of worker threads.
+
+    items may be any iterable, including a generator. It is consumed lazily,
+    so workers start on the first items before the rest have been produced.
+
+    Usage:
+
+        >>> run_concurrent(lambda n: api_submit('/api/nodes/{0}'.format(n['node_id'])), nodes, 20)
+        <BulkResult succeeded=20 failed=0>
+
+    Args:
+        func (callable): Called once per item. A return value counts as
+            success, an exception as failure.
+        items (iterable): The items to process.
+        concurrency (int): The maximum number of items processed at once.
+            Defaults to settings.concurrency.
+
+    Returns:
+        A BulkResult.
+    """
+
+    if concurrency is None:
+        concurrency = settings.concurrency
+    concurrency = max(1, int(concurrency))
+
+    result = BulkResult()
+
+    if concurrency == 1:
+        for item in items:
+            _call(func, item, result)
+        return result
+
+    # Bound the queue so a large generator is not drained into memory ahead
+    # of the workers.
+    work = Queue.Queue(concurrency * 2)
+
+    def worker():
+        while True:
+            item = work.get()
+            if item is _STOP:
+                return
+            _call(func, item, result)
+
+    threads = []
+    for i in range(concurrency):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    try:
+        for item in items:
+            work.put(item)
+    finally:
+        for t in threads:
+            work.put(_STOP)
+        for t in threads:
+            t.join()
+
+    return result
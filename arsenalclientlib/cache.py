@@ -0,0 +1,239 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import arsenalclientlib.settings as settings
+
+log = logging.getLogger(__name__)
+
+
+class LookupCache(object):
+    """
+    A thread-safe TTL + LRU cache for name -> object lookups of near-static
+    reference objects (tags, statuses, node_groups).
+
+    Keys are tuples starting with the object type, e.g. ('statuses',
+    'inservice') or ('tags', 'mytag', 'value1'). If settings.lookup_cache_file
+    is set the cache is loaded from and saved to that file so lookups carry
+    over between runs.
+
+    Args:
+        ttl (int): Seconds an entry stays valid. Defaults to
+            settings.lookup_cache_ttl.
+        max_size (int): Maximum number of entries kept. The least recently
+            used entries are evicted first. Defaults to
+            settings.lookup_cache_size.
+        cache_file (str): The file to persist the cache to. Defaults to
+            settings.lookup_cache_file.
+    """
+
+    def __init__(self, ttl=None, max_size=None, cache_file=None):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._cache_file = cache_file
+        self._entries = OrderedDict()
+        self._loaded_from = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return settings.lookup_cache_ttl
+        return self._ttl
+
+    @property
+    def max_size(self):
+        if self._max_size is None:
+            return settings.lookup_cache_size
+        return self._max_size
+
+    @property
+    def cache_file(self):
+        if self._cache_file is None:
+            return settings.lookup_cache_file
+        return self._cache_file
+
+    def get(self, key):
+        """
+        Returns the cached value for key, None if it is missing or expired.
+        """
+
+        with self._lock:
+            self._load()
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            # Re-insert to mark as most recently used.
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Caches value for key."""
+
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """
+        Caches a batch of (key, value) pairs, saving the cache file once
+        rather than once per entry.
+        """
+
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            self._load()
+            expires = time.time() + float(self.ttl)
+            for key, value in items:
+                self._entries.pop(key, None)
+                self._entries[key] = (expires, value)
+            while len(self._entries) > int(self.max_size):
+                self._entries.popitem(last=False)
+            self._save()
+
+    def invalidate(self, object_type=None, key=None):
+        """
+        Drops cached entries.
+
+        Args:
+            object_type (str): Drop every entry for this object type.
+            key (tuple): Drop only this entry.
+
+        With no arguments the whole cache is cleared.
+        """
+
+        with self._lock:
+            self._load()
+            if key is not None:
+                self._entries.pop(key, None)
+            elif object_type is not None:
+                for k in list(self._entries.keys()):
+                    if k[0] == object_type:
+                        del self._entries[k]
+            else:
+                self._entries.clear()
+            self._save()
+
+    def _load(self):
+        """Loads the cache file once per cache_file setting. Lock must be held."""
+
+        cache_file = self.cache_file
+        if not cache_file or cache_file == self._loaded_from:
+            return
+        self._loaded_from = cache_file
+
+        try:
+            with open(cache_file) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            log.debug('Unable to load lookup cache {0}: {1}'.format(cache_file, e))
+            return
+
+        now = time.time()
+        for key, expires, value in entries:
+            if expires >= now:
+                self._entries[tuple(key)] = (expires, value)
+        log.debug('Loaded {0} entries from lookup cache: {1}'.format(len(self._entries), cache_file))
+
+    def _save(self):
+        """Writes the cache file atomically, if one is set. Lock must be held."""
+
+        cache_file = self.cache_file
+        if not cache_file:
+            return
+
+        entries = []
+        for key, (expires, value) in self._entries.items():
+            entries.append([list(key), expires, value])
+
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)),
+                                            prefix='.arsenal_lookup')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            log.error('Unable to write lookup cache {0}: {1}'.format(cache_file, e))
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent identical calls into one. While a call for a key is
+    in flight, other callers with the same key wait for it and get its
+    result, or its exception, instead of making their own. Nothing is kept
+    once the call returns.
+
+    Attributes:
+        hits (int): Calls that shared another caller's result.
+        misses (int): Calls that were actually made.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def do(self, key, func):
+        """
+        Returns func(), shared with any concurrent caller using key. The
+        result is the same object for every caller, so it must not be
+        modified.
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
@@ -13,7 +13,19 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-class Ec2(object):
+from arsenalclientlib.model import Model, compiled
+
+
+@compiled
+class Ec2(Model):
+    __slots__ = ('ec2_instance_id',
+                 'ec2_ami_id',
+                 'ec2_hostname',
+                 'ec2_public_hostname',
+                 'ec2_instance_type',
+                 'ec2_security_groups',
+                 'ec2_placement_availability_zone')
+
     def __init__(self,
                  ec2_instance_id = None,
                  ec2_ami_id = None,
@@ -0,0 +1,130 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+
+class ArsenalError(Exception):
+    """
+    Base class for errors raised by the client library.
+
+    Attributes:
+        method (str): The http method of the failed request.
+        url (str): The url of the failed request.
+        attempts (int): How many times the request was tried.
+        elapsed (float): Seconds spent on the request, including retries.
+    """
+
+    def __init__(self, message, method=None, url=None, attempts=None, elapsed=None):
+        super(ArsenalError, self).__init__(message)
+        self.method = method
+        self.url = url
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+
+class ApiError(ArsenalError):
+    """
+    The API answered with a status the client can't handle.
+
+    Attributes:
+        status_code (int): The http status code of the response.
+    """
+
+    def __init__(self, status_code, message=None, **kwargs):
+        if message is None:
+            message = 'Command failed. status_code={0}'.format(status_code)
+        super(ApiError, self).__init__(message, **kwargs)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        """Whether the request may succeed if it is tried again."""
+
+        return self.status_code == 429 or self.status_code >= 500
+
+
+class UnauthorizedError(ApiError):
+    """401, the cookies were rejected even after re-authenticating."""
+
+
+class ForbiddenError(ApiError):
+    """403, the user may not make this request."""
+
+
+class NotFoundError(ApiError):
+    """404, the resource doesn't exist."""
+
+
+class MethodNotAllowedError(ApiError):
+    """405, the endpoint doesn't support the method."""
+
+
+class ConflictError(ApiError):
+    """409, the resource already exists."""
+
+
+class RateLimitedError(ApiError):
+    """429, the API asked us to slow down."""
+
+
+class ServerError(ApiError):
+    """5xx, the API failed to handle the request."""
+
+
+class AuthenticationError(ArsenalError):
+    """Logging in to the API failed."""
+
+
+class ConnectionFailedError(ArsenalError):
+    """The API couldn't be reached or didn't answer in time."""
+
+
+class DeadlineExceededError(ArsenalError):
+    """The request didn't succeed before its deadline."""
+
+
+class CircuitOpenError(ArsenalError):
+    """The API is failing and requests are being refused without trying."""
+
+
+_STATUS_ERRORS = {
+    401: (UnauthorizedError, 'Unauthorized.'),
+    403: (ForbiddenError, 'Access Forbidden.'),
+    404: (NotFoundError, 'Resource not found'),
+    405: (MethodNotAllowedError, 'Method not allowed.'),
+    409: (ConflictError, 'Resource already exists.'),
+    429: (RateLimitedError, 'Too many requests.'),
+}
+
+
+def error_for_status(status_code, **kwargs):
+    """
+    Builds the exception for an unsuccessful http status.
+
+    Args:
+        status_code (int): The http status code.
+        kwargs: method, url, attempts and elapsed metadata.
+
+    Returns:
+        An ApiError subclass instance.
+    """
+
+    if status_code in _STATUS_ERRORS:
+        cls, message = _STATUS_ERRORS[status_code]
+    elif status_code >= 500:
+        cls, message = ServerError, 'Command failed. status_code={0}'.format(status_code)
+    else:
+        cls, message = ApiError, None
+    return cls(status_code, message, **kwargs)
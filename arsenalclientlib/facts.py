@@ -0,0 +1,272 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+import arsenalclientlib.settings as settings
+from arsenalclientlib.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# need this for custom facts - can add additional paths if needed
+FACTERLIB = '/var/lib/puppet/lib/facter'
+
+
+def _normalize(value):
+    """
+    Converts json scalars to the strings the text output would have given,
+    so callers comparing e.g. facts['is_virtual'] == 'true' keep working.
+    Structured facts are left as they are.
+    """
+
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def _parse_text(output):
+    """Parses the k => v text output of facter."""
+
+    return dict(k.split(' => ', 1) for k in
+                [s.strip() for s in output.splitlines() if ' => ' in s])
+
+
+def uptime():
+    """
+    Computes the uptime fact from /proc/uptime the same way facter formats
+    it, so it is always current without running facter.
+
+    Returns:
+        The uptime string, None if /proc/uptime isn't available.
+    """
+
+    try:
+        with open('/proc/uptime') as f:
+            seconds = int(float(f.read().split()[0]))
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+    days = seconds // 86400
+    if days == 0:
+        return '{0}:{1:02d} hours'.format(seconds // 3600, (seconds % 3600) // 60)
+    elif days == 1:
+        return '1 day'
+    return '{0} days'.format(days)
+
+
+def parse_fact_ttls(fact_ttls):
+    """
+    Parses per-fact TTL overrides given as a dict or as a
+    'fact=seconds,fact=seconds' string from the conf file.
+    """
+
+    if not fact_ttls:
+        return {}
+    if isinstance(fact_ttls, dict):
+        return fact_ttls
+
+    ttls = {}
+    for item in fact_ttls.split(','):
+        k, v = item.split('=')
+        ttls[k.strip()] = float(v)
+    return ttls
+
+
+class FactCollector(object):
+    """
+    Collects facts from facter, caching them on disk so repeated runs only
+    call facter for facts whose TTL has expired.
+
+    facter is run in json mode so multi-line and structured facts survive,
+    falling back to parsing the k => v text output for facter versions
+    without --json.
+
+    Args:
+        cache_file (str): Where to cache facts. Defaults to
+            settings.facter_cache_file. No caching if not set.
+        ttl (int): Seconds a cached fact stays valid. Defaults to
+            settings.facter_cache_ttl.
+        fact_ttls (dict): Per-fact TTL overrides. Defaults to
+            settings.facter_fact_ttls.
+    """
+
+    def __init__(self, cache_file=None, ttl=None, fact_ttls=None):
+        self._cache_file = cache_file
+        self._ttl = ttl
+        self._fact_ttls = fact_ttls
+        self._lock = threading.Lock()
+        self.runs = 0
+
+    @property
+    def cache_file(self):
+        if self._cache_file is None:
+            return settings.facter_cache_file
+        return self._cache_file
+
+    def ttl(self, name):
+        """Returns the TTL in seconds for a fact."""
+
+        fact_ttls = self._fact_ttls
+        if fact_ttls is None:
+            fact_ttls = settings.facter_fact_ttls
+        fact_ttls = parse_fact_ttls(fact_ttls)
+        if name in fact_ttls:
+            return float(fact_ttls[name])
+        if self._ttl is None:
+            return float(settings.facter_cache_ttl)
+        return float(self._ttl)
+
+    def run(self, names=None):
+        """
+        Runs facter.
+
+        Args:
+            names (list): Only ask facter for these facts. All facts if None.
+
+        Returns:
+            A dict of facts.
+        """
+
+        import subprocess
+
+        env = dict(os.environ)
+        env['FACTERLIB'] = FACTERLIB
+        names = list(names or [])
+        self.runs += 1
+
+        log.debug('Running facter for: {0}'.format(', '.join(names) or 'all facts'))
+        with metrics.timer('facter_seconds'):
+            p = subprocess.Popen(['facter', '--json'] + names, stdout=subprocess.PIPE,
+                                 stderr=open(os.devnull, 'w'), env=env, universal_newlines=True)
+            output = p.communicate()[0]
+        if p.returncode == 0:
+            try:
+                facts = json.loads(output)
+                result = {}
+                for k, v in facts.items():
+                    if v is not None:
+                        result[k] = _normalize(v)
+                return result
+            except ValueError:
+                pass
+
+        log.debug('facter --json not supported, falling back to text output.')
+        # Asking for a single fact in text mode prints a bare value, so always
+        # collect everything.
+        with metrics.timer('facter_seconds'):
+            p = subprocess.Popen(['facter'], stdout=subprocess.PIPE, env=env,
+                                 universal_newlines=True)
+            output = p.communicate()[0]
+        return _parse_text(output)
+
+    def collect(self, names=None):
+        """
+        Returns facts, from the cache where they are still fresh.
+
+        Args:
+            names (list): The facts to collect. With no names every fact is
+                collected from a fresh facter run.
+
+        Returns:
+            A dict of facts. Facts facter doesn't know about are left out.
+        """
+
+        if not names:
+            facts = self.run()
+            with self._lock:
+                cache = self._load()
+                now = time.time()
+                for k, v in facts.items():
+                    cache[k] = [v, now]
+                self._save(cache)
+            return facts
+
+        with self._lock:
+            cache = self._load()
+            now = time.time()
+            stale = [n for n in names
+                     if n not in cache or cache[n][1] + self.ttl(n) < now]
+
+            if stale:
+                facts = self.run(stale)
+                for k, v in facts.items():
+                    cache[k] = [v, now]
+                # Remember facts this host doesn't have, so they don't keep
+                # triggering facter runs.
+                for n in stale:
+                    if n not in facts:
+                        cache[n] = [None, now]
+                self._save(cache)
+
+        result = {}
+        for n in names:
+            if n == 'uptime' and not stale:
+                value = uptime() or cache[n][0]
+            else:
+                value = cache[n][0]
+            if value is not None:
+                result[n] = value
+        return result
+
+    def cached(self, name):
+        """Returns a fact from the cache without running facter, None if it isn't fresh."""
+
+        with self._lock:
+            entry = self._load().get(name)
+        if entry is None or entry[1] + self.ttl(name) < time.time():
+            return None
+        return entry[0]
+
+    def clear(self):
+        """Removes the cache file."""
+
+        with self._lock:
+            if self.cache_file and os.path.isfile(self.cache_file):
+                os.unlink(self.cache_file)
+
+    def _load(self):
+        """Loads the cache file. Lock must be held."""
+
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, cache):
+        """Writes the cache file atomically. Lock must be held."""
+
+        cache_file = self.cache_file
+        if not cache_file:
+            return
+
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)),
+                                            prefix='.arsenal_facts')
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            log.error('Unable to write facter cache {0}: {1}'.format(cache_file, e))
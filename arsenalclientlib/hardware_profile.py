@@ -13,7 +13,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-class HardwareProfile(object):
+from arsenalclientlib.model import Model, compiled
+
+
+@compiled
+class HardwareProfile(Model):
+    __slots__ = ('manufacturer',
+                 'model')
+
     def __init__(self,
                  manufacturer = 'Unknown',
                  model = 'Unknown'):
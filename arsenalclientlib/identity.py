@@ -0,0 +1,207 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import re
+import json
+import logging
+import tempfile
+import threading
+
+import arsenalclientlib.settings as settings
+from arsenalclientlib.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+DMIDECODE = '/usr/sbin/dmidecode'
+PRODUCT_UUID = '/sys/class/dmi/id/product_uuid'
+
+UUID_RE = re.compile(r'^[0-9A-Fa-f]{8}-(?:[0-9A-Fa-f]{4}-){3}[0-9A-Fa-f]{12}$')
+
+_lock = threading.Lock()
+_probe = None
+_uuid = []
+_skip = threading.Event()
+
+
+def _valid(uuid):
+    """Returns the uuid if it looks like one, None otherwise."""
+
+    if uuid and UUID_RE.match(uuid.strip()):
+        return uuid.strip()
+    return None
+
+
+def read_product_uuid():
+    """
+    Reads the system uuid the kernel exposes in sysfs, no subprocess needed.
+    The kernel prints it in lower case, dmidecode in upper case. It is upper
+    cased so unique_ids don't change for nodes registered via dmidecode.
+
+    Returns:
+        The uuid, None if it isn't available or readable.
+    """
+
+    try:
+        with open(PRODUCT_UUID) as f:
+            uuid = _valid(f.read())
+    except (IOError, OSError):
+        return None
+
+    if uuid:
+        return uuid.upper()
+    return None
+
+
+def dmidecode_uuid():
+    """
+    Gets the uuid from dmidecode. Both the system-uuid keyword and the
+    full type 1 dump (for older versions of dmidecode) are run at the
+    same time rather than one after the other.
+
+    Returns:
+        The uuid, None if dmidecode isn't available or has none.
+    """
+
+    if not os.path.isfile(DMIDECODE):
+        return None
+
+    import subprocess
+
+    devnull = open(os.devnull, 'w')
+    try:
+        with metrics.timer('dmidecode_seconds'):
+            keyword = subprocess.Popen([DMIDECODE, '-s', 'system-uuid'], stdout=subprocess.PIPE,
+                                       stderr=devnull, universal_newlines=True)
+            dump = subprocess.Popen([DMIDECODE, '-t', '1'], stdout=subprocess.PIPE,
+                                    stderr=devnull, universal_newlines=True)
+            uuid_out = keyword.communicate()[0]
+            dmidecode_out = dump.communicate()[0]
+    finally:
+        devnull.close()
+
+    for line in uuid_out.splitlines():
+        uuid = _valid(line)
+        if uuid:
+            return uuid
+
+    # Support older versions of dmidecode
+    for line in dmidecode_out.splitlines():
+        if re.match("\tUUID: ", line):
+            return _valid(line[7:])
+
+    return None
+
+
+def probe_uuid():
+    """
+    Gets the hardware uuid from sysfs, falling back to dmidecode. Returns
+    None without probing further once skip_probe() was called.
+    """
+
+    if _skip.is_set():
+        return None
+    uuid = read_product_uuid()
+    if uuid:
+        log.debug('uuid is from {0}: {1}'.format(PRODUCT_UUID, uuid))
+        return uuid
+    if _skip.is_set():
+        return None
+    return dmidecode_uuid()
+
+
+def start_probe():
+    """
+    Starts probing the hardware uuid in a background thread, so it can run
+    while facter is collecting facts. hardware_uuid() picks up the result.
+    """
+
+    global _probe
+
+    with _lock:
+        if _probe is not None or _uuid or _skip.is_set():
+            return
+
+        def run():
+            _uuid.append(probe_uuid())
+
+        _probe = threading.Thread(target=run)
+        _probe.daemon = True
+        _probe.start()
+
+
+def skip_probe():
+    """
+    Stops probing for the hardware uuid because the unique_id is already
+    known, e.g. from ec2_instance_id. A probe that hasn't started, or hasn't
+    reached dmidecode yet, doesn't run it.
+    """
+
+    _skip.set()
+
+
+def hardware_uuid():
+    """
+    Returns the hardware uuid, waiting for a probe started by start_probe()
+    or probing now. The result is kept for the life of the process. None
+    after skip_probe() if the probe hadn't found it.
+    """
+
+    start_probe()
+    if _probe is None:
+        return _uuid[0] if _uuid else None
+    _probe.join()
+    return _uuid[0]
+
+
+def load_unique_id(macaddress):
+    """
+    Reads the unique_id saved by save_unique_id(). It is only trusted if the
+    host's mac address still matches, so images cloned with the file in
+    place don't all register as the same node.
+
+    Returns:
+        The unique_id, None if there is none saved or it doesn't match.
+    """
+
+    if not settings.unique_id_file:
+        return None
+
+    try:
+        with open(settings.unique_id_file) as f:
+            saved = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if saved.get('macaddress') != macaddress:
+        log.debug('Saved unique_id is for a different mac address, ignoring it.')
+        return None
+    return saved.get('unique_id')
+
+
+def save_unique_id(unique_id, macaddress):
+    """Saves the resolved unique_id so later runs skip probing."""
+
+    if not settings.unique_id_file:
+        return
+
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(settings.unique_id_file)),
+                                        prefix='.arsenal_unique_id')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'unique_id': unique_id, 'macaddress': macaddress}, f)
+        os.rename(tmp_file, settings.unique_id_file)
+    except (IOError, OSError) as e:
+        log.error('Unable to write unique_id file {0}: {1}'.format(settings.unique_id_file, e))
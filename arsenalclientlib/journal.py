@@ -0,0 +1,462 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+A durable on-disk queue of pending API mutations, so registrations and
+assignments made while the API is unreachable aren't lost.
+
+Mutations are appended to settings.journal_file as json lines and fsynced in
+batches. drain() replays them: pending registrations of the same unique_id
+collapse into the latest, as do repeated changes to the same assignment,
+assignments are sent in batches and the replay is rate limited to
+settings.journal_drain_rate requests per second. What the API accepted is
+removed from the journal, as are registrations a later direct register()
+superseded. What it rejected for good, e.g. a login without
+write access, is moved to journal_file.rejected with the error. The rest
+stays for the next drain.
+
+Usage::
+
+  >>> client.register(defer=True)
+  >>> from arsenalclientlib import journal
+  >>> journal.drain()
+  <BulkResult succeeded=1 failed=0>
+
+Or keep a worker draining in the background::
+
+  >>> worker = journal.DrainWorker().start()
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+import arsenalclientlib.registration as registration
+from arsenalclientlib.bulk import BulkResult, run_concurrent
+from arsenalclientlib.exceptions import (ApiError, ConnectionFailedError, DeadlineExceededError,
+    CircuitOpenError)
+from arsenalclientlib.metrics import metrics
+from arsenalclientlib.ratelimit import TokenBucket
+
+log = logging.getLogger(__name__)
+
+REGISTER = '/api/register'
+
+
+def deferrable(e):
+    """
+    Whether a request that failed with e may succeed later: connection
+    errors, timeouts, an open circuit, 429 and 5xx. Anything else, auth
+    failures included, will fail the same way on every replay.
+    """
+
+    if isinstance(e, ApiError):
+        return e.retryable
+    return isinstance(e, (ConnectionFailedError, DeadlineExceededError, CircuitOpenError))
+
+
+def record_key(record):
+    """
+    The key records coalesce on: the unique_id for registrations, otherwise
+    the request and its data, so the latest put or delete of an assignment
+    wins.
+    """
+
+    data = record['data']
+    if record['request'] == REGISTER and isinstance(data, dict) and data.get('unique_id'):
+        return 'register:{0}'.format(data['unique_id'])
+    return '{0}:{1}'.format(record['request'], json.dumps(data, sort_keys=True))
+
+
+def _registered_since(record):
+    """
+    Whether the saved registration state is newer than a journaled
+    registration of the same unique_id, which replaying would undo.
+    """
+
+    state = registration.load_state()
+    if not state or state.get('registered_at', 0) < record['ts']:
+        return False
+    data = record['data']
+    return isinstance(data, dict) and state.get('fields', {}).get('unique_id') == data.get('unique_id')
+
+
+def coalesce(records):
+    """Keeps the latest record for every key, in the order they were last appended."""
+
+    latest = {}
+    for i, record in enumerate(records):
+        latest[record_key(record)] = i
+    return [records[i] for i in sorted(latest.values())]
+
+
+@contextmanager
+def _flock(path, blocking=True):
+    """
+    Holds an exclusive lock on path across processes. Yields False if
+    blocking is False and another process holds it.
+    """
+
+    if fcntl is None:
+        yield True
+        return
+    f = open(path, 'a')
+    try:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except (IOError, OSError):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        f.close()
+
+
+class Journal(object):
+    """
+    An append-only journal of API mutations in a file, safe to share
+    between threads and processes.
+
+    Args:
+        path (str): The journal file. Defaults to settings.journal_file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.journal_file
+        self._file = None
+        self._unsynced = 0
+        self._synced_at = time.time()
+        self._lock = threading.Lock()
+        atexit.register(self.sync)
+
+    def _lock_file(self, name='lock', blocking=True):
+        return _flock('{0}.{1}'.format(self.path, name), blocking)
+
+    def _open(self):
+        # drain() replaces the file, so reopen if it isn't the one we have.
+        try:
+            current = os.stat(self.path).st_ino
+        except OSError:
+            current = None
+        if self._file is not None and os.fstat(self._file.fileno()).st_ino != current:
+            self._sync()
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._file = open(self.path, 'a')
+            os.chmod(self.path, 0o600)
+        return self._file
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def append(self, request, data, method='put'):
+        """
+        Appends a mutation and returns without waiting for the API. The
+        file is fsynced every settings.journal_fsync_batch appends or
+        settings.journal_fsync_interval seconds, and at exit.
+
+        Args:
+            request (str): The API endpoint, e.g. /api/register.
+            data (dict): The request data. Models are converted with
+                to_dict().
+            method (str): put or delete.
+        """
+
+        self._write({'ts': time.time(),
+                     'request': request,
+                     'method': method,
+                     'data': data,
+        })
+        metrics.inc('journal_appended_total', endpoint=request)
+
+    def supersede(self, request, data):
+        """
+        Drops the pending records data replaces, e.g. once the registration
+        of a unique_id succeeded directly, so drain() doesn't replay the
+        older payload over it. A marker record is appended that coalesces
+        them away.
+
+        Returns:
+            True if there were records to drop.
+        """
+
+        record = {'ts': time.time(),
+                  'request': request,
+                  'method': 'put',
+                  'data': data,
+                  'superseded': True,
+        }
+        key = record_key(record)
+        self.sync()
+        with self._lock_file():
+            records, size = self._read()
+        if not any(record_key(r) == key and not r.get('superseded') for r in records):
+            return False
+        self._write(record)
+        return True
+
+    def _write(self, record):
+        line = json.dumps(record, default=client._to_serializable) + '\n'
+
+        with self._lock:
+            with self._lock_file():
+                f = self._open()
+                f.write(line)
+                f.flush()
+            self._unsynced += 1
+            if (self._unsynced >= int(settings.journal_fsync_batch)
+                    or time.time() - self._synced_at >= float(settings.journal_fsync_interval)):
+                self._sync()
+
+    def sync(self):
+        """fsyncs appends that haven't been yet."""
+
+        with self._lock:
+            self._sync()
+
+    def _read(self, path=None):
+        """Returns the records in the journal, or path, and the byte size read."""
+
+        try:
+            with open(path or self.path, 'rb') as f:
+                contents = f.read()
+        except (IOError, OSError):
+            return [], 0
+
+        records = []
+        for line in contents.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn write from a crash mid-append.
+                log.warning('Skipping unreadable journal line: {0}'.format(line[:100]))
+        return records, len(contents)
+
+    def pending(self):
+        """Returns the records waiting to be replayed, coalesced."""
+
+        self.sync()
+        with self._lock_file():
+            records, size = self._read()
+        return [r for r in coalesce(records) if not r.get('superseded')]
+
+    def _replay(self, records, concurrency):
+        """Sends records, returning a BulkResult of (record, response)."""
+
+        bucket = TokenBucket(rate=settings.journal_drain_rate, burst=1)
+        result = BulkResult()
+
+        def send(record):
+            if record['request'] == REGISTER and _registered_since(record):
+                log.info('Skipping journaled registration, the node registered since.')
+                return None
+            bucket.acquire()
+            r = client.api_submit(record['request'], record['data'], method=record['method'])
+            if record['request'] == REGISTER:
+                registration.save_state(registration.fingerprint(record['data']))
+            return r
+
+        assignments = {}
+        singles = []
+        for record in records:
+            if record['request'].endswith('_assignments'):
+                assignments.setdefault((record['request'], record['method']), []).append(record)
+            else:
+                singles.append(record)
+
+        if singles:
+            result.extend(run_concurrent(send, singles, concurrency))
+
+        # bulk_assign() takes a token per request it sends, batched or not.
+        for (request, method), group in sorted(assignments.items()):
+            result.extend(client.bulk_assign(request, group, lambda record: record['data'], method,
+                                             concurrency=concurrency, bucket=bucket))
+
+        return result
+
+    def drain(self, concurrency=None):
+        """
+        Replays the journal. Records the API accepted are removed. Records
+        that failed with a deferrable() error stay for the next drain, the
+        other failures are moved to the rejected file. Only one process
+        drains a journal at a time, others return an empty result.
+
+        Args:
+            concurrency (int): The number of requests in flight. Defaults
+                to settings.concurrency.
+
+        Returns:
+            A BulkResult of (record, response) and (record, exception).
+        """
+
+        with self._lock_file('drain', blocking=False) as locked:
+            if not locked:
+                log.debug('Journal {0} is being drained elsewhere.'.format(self.path))
+                return BulkResult()
+
+            self.sync()
+            with self._lock_file():
+                records, size = self._read()
+            if not records:
+                return BulkResult()
+
+            pending = [r for r in coalesce(records) if not r.get('superseded')]
+            log.info('Replaying {0} journaled request(s), {1} coalesced away.'.format(
+                len(pending), len(records) - len(pending)))
+            result = self._replay(pending, concurrency)
+
+            keep = []
+            rejected = []
+            for record, e in result.failed:
+                if deferrable(e):
+                    keep.append(record)
+                else:
+                    log.error('Rejecting journaled {0} {1}: {2}'.format(record['method'], record['request'], e))
+                    rejected.append(dict(record, error=str(e)))
+            metrics.inc('journal_replayed_total', len(result.succeeded), result='ok')
+            metrics.inc('journal_replayed_total', len(rejected), result='dropped')
+            metrics.inc('journal_replayed_total', len(keep), result='kept')
+
+            if rejected:
+                self._reject(rejected)
+            self._compact(keep, size)
+            return result
+
+    @property
+    def rejected_path(self):
+        """The file records the API rejected for good are moved to."""
+
+        return '{0}.rejected'.format(self.path)
+
+    def rejected(self):
+        """Returns the rejected records, each with the error it failed with."""
+
+        with self._lock_file():
+            return self._read(self.rejected_path)[0]
+
+    def _reject(self, records):
+        """Appends records to the rejected file, before they leave the journal."""
+
+        with self._lock_file():
+            with open(self.rejected_path, 'a') as f:
+                os.chmod(self.rejected_path, 0o600)
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _compact(self, keep, size):
+        """Rewrites the journal with keep and whatever was appended past size."""
+
+        with self._lock_file():
+            with open(self.path, 'rb') as f:
+                f.seek(size)
+                appended = f.read()
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                            prefix='.arsenal_journal')
+            with os.fdopen(fd, 'wb') as f:
+                for record in sorted(keep, key=lambda r: r['ts']):
+                    f.write((json.dumps(record) + '\n').encode('utf-8'))
+                f.write(appended)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_file, 0o600)
+            os.rename(tmp_file, self.path)
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(path=None):
+    """Returns the Journal for path, settings.journal_file by default."""
+
+    path = path or settings.journal_file
+    if not path:
+        raise ValueError('No journal_file set.')
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = Journal(path)
+        return _journals[path]
+
+
+def enqueue(request, data, method='put'):
+    """Appends a mutation to the default journal. See Journal.append()."""
+
+    get_journal().append(request, data, method)
+
+
+def drain(concurrency=None):
+    """Drains the default journal. See Journal.drain()."""
+
+    return get_journal().drain(concurrency)
+
+
+class DrainWorker(object):
+    """
+    Drains a journal every interval seconds in a background thread.
+
+    Args:
+        journal (Journal): Defaults to get_journal().
+        interval (float): Defaults to settings.journal_drain_interval.
+    """
+
+    def __init__(self, journal=None, interval=None):
+        self.journal = journal or get_journal()
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.journal.drain()
+            except Exception as e:
+                log.error('Journal drain failed: {0}'.format(e))
+            self._stop.wait(float(self.interval or settings.journal_drain_interval))
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
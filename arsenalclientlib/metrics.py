@@ -0,0 +1,320 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Counters and latency histograms for the client's hot paths, with export to
+a Prometheus textfile or statsd.
+
+Usage::
+
+  >>> from arsenalclientlib.metrics import metrics
+  >>> client.register()
+  >>> print(metrics.prometheus())
+  # TYPE arsenal_http_request_seconds histogram
+  arsenal_http_request_seconds_bucket{endpoint="/api/register",method="PUT",le="0.005"} 0
+  ...
+  >>> metrics.write_prometheus('/var/lib/node_exporter/arsenal.prom')
+  >>> metrics.add_hook(StatsdHook('localhost', 8125))
+"""
+import os
+import re
+import time
+import socket
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import arsenalclientlib.settings as settings
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+
+def endpoint(url):
+    """
+    The endpoint of a url for use as a label, with ids replaced so every
+    node doesn't get its own series, e.g. /api/nodes/:id.
+    """
+
+    path = url.split('://', 1)[-1]
+    path = '/' + path.split('/', 1)[1] if '/' in path else '/'
+    path = path.split('?', 1)[0]
+    return re.sub(r'/\d+(?=/|$)', '/:id', path)
+
+
+def _labels(labels):
+    # Values are kept as strings so a label that is sometimes an int, e.g.
+    # status, still sorts against the same label as a str.
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram(object):
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """
+    A thread-safe registry of counters and histograms, keyed by name and
+    labels. Nothing is recorded while settings.metrics_enabled is False.
+
+    Hooks are called with (kind, name, value, labels) for every counter
+    increment and observation, e.g. to forward them to statsd as they
+    happen.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _call_hooks(self, kind, name, value, labels):
+        for hook in self._hooks:
+            try:
+                hook(kind, name, value, labels)
+            except Exception as e:
+                log.debug('Metrics hook failed: {0}'.format(e))
+
+    def inc(self, name, value=1, **labels):
+        """Adds value to a counter."""
+
+        if not settings.metrics_enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self._hooks:
+            self._call_hooks(COUNTER, name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """Records a value, usually seconds, in a histogram."""
+
+        if not settings.metrics_enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram(self.buckets)
+            h.observe(value)
+        if self._hooks:
+            self._call_hooks(HISTOGRAM, name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes how long the with block took."""
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def get(self, name, **labels):
+        """Returns a counter value or a Histogram, None if there is none."""
+
+        key = (name, _labels(labels))
+        if key in self.counters:
+            return self.counters[key]
+        return self.histograms.get(key)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def prometheus(self, prefix='arsenal_'):
+        """Returns the metrics in the Prometheus text exposition format."""
+
+        def fmt(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in labels) + '}'
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, (list(h.counts), h.sum, h.count)) for k, h in self.histograms.items())
+
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE {0}{1} counter'.format(prefix, name))
+            lines.append('{0}{1}{2} {3}'.format(prefix, name, fmt(labels), value))
+
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE {0}{1} histogram'.format(prefix, name))
+            for bound, n in zip(self.buckets, counts):
+                lines.append('{0}{1}_bucket{2} {3}'.format(prefix, name, fmt(labels, [('le', repr(bound))]), n))
+            lines.append('{0}{1}_bucket{2} {3}'.format(prefix, name, fmt(labels, [('le', '+Inf')]), count))
+            lines.append('{0}{1}_sum{2} {3!r}'.format(prefix, name, fmt(labels), total))
+            lines.append('{0}{1}_count{2} {3}'.format(prefix, name, fmt(labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=None):
+        """
+        Writes prometheus() to a file for the node_exporter textfile
+        collector. The file is replaced atomically so the collector never
+        reads a partial file.
+
+        Args:
+            path (str): Defaults to settings.metrics_textfile.
+        """
+
+        path = path or settings.metrics_textfile
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                            prefix='.arsenal_metrics')
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.prometheus())
+            os.chmod(tmp_file, 0o644)
+            os.rename(tmp_file, path)
+        except (IOError, OSError) as e:
+            log.error('Unable to write metrics file {0}: {1}'.format(path, e))
+
+    def statsd(self, prefix='arsenal'):
+        """
+        Returns the metrics as statsd lines. Counters are sent as counts,
+        histograms as gauges of their count, sum and mean. Counts are the
+        totals since the last reset(), so a long running process sending
+        them repeatedly should reset() after each send or use StatsdHook.
+        """
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((k, (h.sum, h.count)) for k, h in self.histograms.items())
+
+        lines = []
+        for (name, labels), value in counters:
+            lines.append('{0}:{1}|c'.format(statsd_name(prefix, name, labels), value))
+        for (name, labels), (total, count) in histograms:
+            base = statsd_name(prefix, name, labels)
+            lines.append('{0}.count:{1}|g'.format(base, count))
+            lines.append('{0}.sum:{1}|g'.format(base, total))
+            if count:
+                lines.append('{0}.mean:{1}|g'.format(base, total / count))
+        return lines
+
+    def send_statsd(self, host=None, port=None, prefix='arsenal'):
+        """
+        Sends statsd() to a statsd server over udp.
+
+        Args:
+            host (str): Defaults to settings.statsd_host.
+            port (int): Defaults to settings.statsd_port.
+        """
+
+        host = host or settings.statsd_host
+        port = int(port or settings.statsd_port)
+        _send_udp(host, port, self.statsd(prefix))
+
+    def flush(self):
+        """
+        Exports to the configured destinations: settings.metrics_textfile
+        and settings.statsd_host. Does nothing if neither is set.
+        """
+
+        if settings.metrics_textfile:
+            self.write_prometheus()
+        if settings.statsd_host:
+            self.send_statsd()
+
+
+def statsd_name(prefix, name, labels):
+    """prefix.name.label_value... with characters statsd can't take replaced."""
+
+    parts = [prefix, name] + [str(v) for k, v in labels]
+    return '.'.join(re.sub(r'[^A-Za-z0-9_\-]+', '_', p).strip('_') or '_' for p in parts if p)
+
+
+def _send_udp(host, port, lines):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # Keep datagrams small enough not to be fragmented.
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > 1400:
+                sock.sendto('\n'.join(packet).encode('utf-8'), (host, port))
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            sock.sendto('\n'.join(packet).encode('utf-8'), (host, port))
+    except (IOError, OSError, socket.error) as e:
+        log.error('Unable to send metrics to statsd {0}:{1}: {2}'.format(host, port, e))
+    finally:
+        sock.close()
+
+
+class StatsdHook(object):
+    """
+    A Metrics hook that forwards every increment and observation to statsd
+    as it happens, observations as timers in milliseconds.
+
+    Usage::
+
+      >>> metrics.add_hook(StatsdHook('localhost', 8125))
+    """
+
+    def __init__(self, host=None, port=None, prefix='arsenal'):
+        self.host = host or settings.statsd_host
+        self.port = int(port or settings.statsd_port)
+        self.prefix = prefix
+
+    def __call__(self, kind, name, value, labels):
+        stat = statsd_name(self.prefix, name, _labels(labels))
+        if kind == HISTOGRAM:
+            line = '{0}:{1:.3f}|ms'.format(stat, value * 1000)
+        else:
+            line = '{0}:{1}|c'.format(stat, value)
+        _send_udp(self.host, self.port, [line])
+
+
+metrics = Metrics()
@@ -0,0 +1,178 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import re
+from operator import attrgetter
+from collections import namedtuple
+
+FIELD_NAME = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+
+
+def compiled(cls):
+    """
+    Class decorator that precomputes what to_dict() and from_dict() need
+    from the model's __slots__, so neither has to inspect the class per
+    call.
+    """
+
+    cls._fields = tuple(cls.__slots__)
+    cls._field_set = frozenset(cls._fields)
+    cls._getter = staticmethod(attrgetter(*cls._fields))
+    return cls
+
+
+class Model(object):
+    """
+    Base class for the API models. Models use __slots__ instead of a
+    __dict__, and are converted to and from plain dicts with to_dict() and
+    from_dict().
+
+    Fields the model doesn't declare, e.g. node_id in search results, are
+    kept by from_dict() and readable as attributes or items, so a hydrated
+    model can be passed anywhere a result dict is expected.
+
+    Subclasses list their fields in __slots__, name the fields holding other
+    models in _nested and are decorated with @compiled.
+    """
+
+    __slots__ = ('_extra',)
+
+    _fields = ()
+    _field_set = frozenset()
+    _getter = None
+    _nested = {}
+
+    def __new__(cls, *args, **kwargs):
+        self = object.__new__(cls)
+        self._extra = None
+        return self
+
+    def to_dict(self):
+        """Returns the model as a dict, nested models included."""
+
+        d = dict(zip(self._fields, self._getter(self)))
+        for name in self._nested:
+            v = d[name]
+            if isinstance(v, Model):
+                d[name] = v.to_dict()
+        if self._extra:
+            d.update(self._extra)
+        return d
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds a model from a dict, e.g. an API search result. Nested dicts
+        are hydrated into their models.
+        """
+
+        self = cls()
+        fields = cls._field_set
+        nested = cls._nested
+        for k, v in data.items():
+            if k in fields:
+                if k in nested and isinstance(v, dict):
+                    v = nested[k].from_dict(v)
+                setattr(self, k, v)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[k] = v
+        return self
+
+    def __getattr__(self, name):
+        # Only called for names that aren't slots.
+        if name != '_extra' and self._extra and name in self._extra:
+            return self._extra[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(type(self).__name__, self.to_dict())
+
+
+_record_types = {}
+
+
+def record_type(fields):
+    """
+    Returns the compact record class for a projection: a namedtuple of
+    fields whose items can also be read by name, like a result dict, so
+    records can be passed to set_status(), manage_tag_assignments(), etc.
+    Classes are cached per tuple of fields.
+
+    Usage::
+
+      >>> Record = record_type(('node_id', 'node_name'))
+      >>> r = Record(12, 'web0012.example.com')
+      >>> r.node_name, r['node_id']
+      ('web0012.example.com', 12)
+    """
+
+    fields = tuple(fields)
+    cls = _record_types.get(fields)
+    if cls is not None:
+        return cls
+
+    for f in fields:
+        if not FIELD_NAME.match(f):
+            raise ValueError('Invalid field name for a record: {0!r}'.format(f))
+    base = namedtuple('Record', fields)
+    # Names are looked up by position, not getattr(): that would return the
+    # tuple and Record methods (count, index, get...) for names that aren't
+    # fields, and the methods shadow fields with the same name.
+    positions = dict((f, i) for i, f in enumerate(fields))
+
+    class Record(base):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, (int, slice)):
+                return base.__getitem__(self, key)
+            try:
+                return base.__getitem__(self, positions[key])
+            except (KeyError, TypeError):
+                raise KeyError(key)
+
+        def get(self, key, default=None):
+            try:
+                return self[key]
+            except KeyError:
+                return default
+
+        def to_dict(self):
+            return dict(zip(self._fields, self))
+
+        @classmethod
+        def from_dict(cls, data):
+            """Projects a result dict onto the record, missing fields are None."""
+
+            return cls._make([data.get(f) for f in cls._fields])
+
+    _record_types[fields] = Record
+    return Record
@@ -13,7 +13,28 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-class Node(object):
+from arsenalclientlib.model import Model, compiled
+from arsenalclientlib.hardware_profile import HardwareProfile
+from arsenalclientlib.operating_system import OperatingSystem
+from arsenalclientlib.ec2 import Ec2
+
+
+@compiled
+class Node(Model):
+    __slots__ = ('register',
+                 'unique_id',
+                 'node_name',
+                 'puppet_version',
+                 'facter_version',
+                 'hardware_profile',
+                 'operating_system',
+                 'uptime',
+                 'ec2',
+                 'network')
+    _nested = {'hardware_profile': HardwareProfile,
+               'operating_system': OperatingSystem,
+               'ec2': Ec2}
+
     def __init__(self,
                  register = False,
                  unique_id = None,
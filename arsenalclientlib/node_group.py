@@ -13,7 +13,15 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-class NodeGroup(object):
+from arsenalclientlib.model import Model, compiled
+
+
+@compiled
+class NodeGroup(Model):
+    __slots__ = ('node_group_name',
+                 'node_group_owner',
+                 'description')
+
     def __init__(self,
                  node_group_name = None,
                  node_group_owner = None,
@@ -13,7 +13,16 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-class OperatingSystem(object):
+from arsenalclientlib.model import Model, compiled
+
+
+@compiled
+class OperatingSystem(Model):
+    __slots__ = ('variant',
+                 'version_number',
+                 'architecture',
+                 'description')
+
     def __init__(self,
                  variant = 'Unknown',
                  version_number = 'Unknown',
@@ -0,0 +1,93 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+import threading
+
+import arsenalclientlib.settings as settings
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket rate limiter. Tokens are added at rate per
+    second up to burst, and every request takes one.
+
+    Args:
+        rate (float): Requests per second. Defaults to settings.rate_limit.
+            0 disables rate limiting.
+        burst (int): The number of requests that can be made at once after
+            an idle period. Defaults to settings.rate_limit_burst.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = None
+        self._updated = None
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        if self._rate is None:
+            return float(settings.rate_limit or 0)
+        return float(self._rate)
+
+    @property
+    def burst(self):
+        if self._burst is None:
+            return float(settings.rate_limit_burst)
+        return float(self._burst)
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self):
+        """
+        Takes a token without waiting for it, for callers that sleep their
+        own way, e.g. asyncio.sleep().
+
+        Returns:
+            The number of seconds to wait before using the token.
+        """
+
+        rate = self.rate
+        if rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.time()
+            if self._tokens is None:
+                self._tokens = self.burst
+            else:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+
+            # Take the token now, going negative reserves our place in line
+            # for callers that arrive while we sleep.
+            self._tokens -= 1
+            wait = 0.0
+            if self._tokens < 0:
+                wait = -self._tokens / rate
+        return wait
@@ -0,0 +1,320 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Declarative reconciliation of node statuses, tags and node_groups. Given the
+state nodes should be in, the current state is fetched in bulk, compared
+locally and only the changes are sent.
+
+Usage::
+
+  >>> from arsenalclientlib import reconcile
+  >>> desired = {'web0012.example.com': {'status': 'inservice',
+  ...                                    'tags': {'role': 'web'},
+  ...                                    'node_groups': ['web']}}
+  >>> plan = reconcile.reconcile(desired, dry_run=True)
+  >>> for line in plan.describe():
+  ...     print(line)
+  put tag role=web on web0012.example.com
+  >>> reconcile.reconcile(desired)
+  <BulkResult succeeded=1 failed=0>
+
+Fields left out of a node's desired state aren't managed. A tag name is
+managed as a whole: other values of a desired tag name are removed. With
+prune=True, tags and node_groups that aren't desired are removed as well.
+"""
+import logging
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.bulk import BulkResult, run_concurrent
+
+log = logging.getLogger(__name__)
+
+STATUS = 'status'
+TAG = 'tag'
+NODE_GROUP = 'node_group'
+
+# kind: (assignment endpoint, id field, how to name the object in logs)
+ASSIGNMENTS = {
+    TAG: ('/api/tag_node_assignments', 'tag_id',
+          lambda t: '{0}={1}'.format(t['tag_name'], t['tag_value'])),
+    NODE_GROUP: ('/api/node_group_assignments', 'node_group_id',
+                 lambda ng: ng['node_group_name']),
+}
+
+
+def _parse_tags(tags):
+    """Desired tags as a dict, from a dict or 'name=value,name=value'."""
+
+    if isinstance(tags, dict):
+        return dict((k, str(v)) for k, v in tags.items())
+    return dict(t.split('=', 1) for t in tags.split(',') if t)
+
+
+def _status_name(node):
+    status = node.get('status')
+    if isinstance(status, dict):
+        return status.get('status_name')
+    return node.get('status_name')
+
+
+class Plan(object):
+    """
+    The changes needed to reach a desired state.
+
+    Attributes:
+        changes (list): (api_action, kind, node, target) tuples. api_action
+            is put or delete, kind is one of STATUS, TAG or NODE_GROUP and
+            target the status, tag or node_group. Tags that don't exist yet
+            have a tag_id of None until the plan is applied.
+        missing (list): Desired node_names that weren't found.
+        unchanged (int): The number of nodes already in their desired state.
+    """
+
+    def __init__(self):
+        self.changes = []
+        self.missing = []
+        self.unchanged = 0
+
+    def add(self, api_action, kind, node, target):
+        self.changes.append((api_action, kind, node, target))
+
+    def describe(self):
+        """Yields a line per change, e.g. for a dry run."""
+
+        for api_action, kind, node, target in self.changes:
+            if kind == STATUS:
+                name = target['status_name']
+            else:
+                name = ASSIGNMENTS[kind][2](target)
+            yield '{0} {1} {2} on {3}'.format(api_action, kind, name, node['node_name'])
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __repr__(self):
+        return '<Plan changes={0} unchanged={1} missing={2}>'.format(len(self.changes),
+                                                                     self.unchanged,
+                                                                     len(self.missing))
+
+
+def fetch(node_names, chunk_size=None):
+    """
+    Fetches the current state of nodes with one node_name=a,b,c search per
+    chunk.
+
+    Returns:
+        A dict of node_name to search result.
+    """
+
+    if chunk_size is None:
+        chunk_size = settings.assignment_chunk_size
+    chunk_size = max(1, int(chunk_size))
+
+    current = {}
+    for chunk in client._chunks(sorted(node_names), chunk_size):
+        for n in client.iter_search('nodes', 'node_name={0}'.format(','.join(chunk)), True):
+            current[n['node_name']] = n
+    return current
+
+
+def _resolver(dry_run):
+    """
+    Returns functions resolving status, tag and node_group names to objects
+    through the lookup cache. Tags that don't exist are created, or only
+    stubbed with a tag_id of None on a dry run. Either way they are
+    remembered, since the lookup cache doesn't keep misses.
+    """
+
+    tags = {}
+
+    def status(name):
+        r = client.lookup(('statuses', name), {'status_name': name, 'exact_get': True})
+        return r[0] if r else None
+
+    def tag(name, value):
+        if (name, value) in tags:
+            return tags[(name, value)]
+        r = client.lookup(('tags', name, value), {'tag_name': name, 'tag_value': value, 'exact_get': True})
+        if r:
+            return r[0]
+        if dry_run:
+            t = {'tag_id': None, 'tag_name': name, 'tag_value': value}
+        else:
+            log.info('No existing tag found, creating tag {0}={1}'.format(name, value))
+            t = client.api_submit('/api/tags', {'tag_name': name, 'tag_value': value}, method='put')
+            client.lookup_cache.invalidate('tags')
+        tags[(name, value)] = t
+        return t
+
+    def node_group(name):
+        r = client.lookup(('node_groups', name), {'node_group_name': name, 'exact_get': True})
+        return r[0] if r else None
+
+    return status, tag, node_group
+
+
+def plan(desired, prune=False, dry_run=False, chunk_size=None):
+    """
+    Compares the desired state of nodes with their current state.
+
+    Args:
+        desired (dict): node_name to a dict with any of status (a status
+            name), tags (a dict of tag name to value, or 'name=value,...')
+            and node_groups (a list of node_group names).
+        prune (bool): Also remove tags and node_groups that aren't desired,
+            from nodes that list tags or node_groups.
+        dry_run (bool): Don't create missing tags.
+        chunk_size (int): The number of nodes fetched per search.
+
+    Returns:
+        A Plan.
+    """
+
+    status_for, tag_for, node_group_for = _resolver(dry_run)
+    current = fetch(desired.keys(), chunk_size)
+    result = Plan()
+
+    for node_name in sorted(desired):
+        want = desired[node_name]
+        node = current.get(node_name)
+        if node is None:
+            log.info('Not found: node={0}'.format(node_name))
+            result.missing.append(node_name)
+            continue
+
+        before = len(result.changes)
+
+        if want.get('status') and want['status'] != _status_name(node):
+            status = status_for(want['status'])
+            if status is None:
+                log.error('Not found: status={0}'.format(want['status']))
+            else:
+                result.add('put', STATUS, node, status)
+
+        if 'tags' in want:
+            tags = _parse_tags(want['tags'] or {})
+            have = node.get('tags') or []
+            for t in have:
+                if t['tag_name'] in tags:
+                    stale = str(t['tag_value']) != tags[t['tag_name']]
+                else:
+                    stale = prune
+                if stale:
+                    result.add('delete', TAG, node, t)
+            present = set((t['tag_name'], str(t['tag_value'])) for t in have)
+            for name in sorted(tags):
+                if (name, tags[name]) not in present:
+                    result.add('put', TAG, node, tag_for(name, tags[name]))
+
+        if 'node_groups' in want:
+            groups = set(want['node_groups'] or [])
+            have = node.get('node_groups') or []
+            for ng in have:
+                if prune and ng['node_group_name'] not in groups:
+                    result.add('delete', NODE_GROUP, node, ng)
+            present = set(ng['node_group_name'] for ng in have)
+            for name in sorted(groups - present):
+                ng = node_group_for(name)
+                if ng is None:
+                    log.error('Not found: node_group={0}'.format(name))
+                else:
+                    result.add('put', NODE_GROUP, node, ng)
+
+        if len(result.changes) == before:
+            result.unchanged += 1
+
+    log.info('Reconcile: {0} change(s), {1} node(s) unchanged, {2} not found.'.format(
+        len(result.changes), result.unchanged, len(result.missing)))
+    return result
+
+
+def apply(plan, chunk_size=None, concurrency=None):
+    """
+    Applies a Plan. Status updates and the assignments of each kind are
+    submitted concurrently, removals before additions so a tag changing
+    value is never on a node twice.
+
+    Returns:
+        A BulkResult of (change, response) pairs.
+    """
+
+    result = BulkResult()
+    if not plan.changes:
+        return result
+
+    # Tags planned on a dry run don't exist yet.
+    _, tag_for, _ = _resolver(False)
+    changes = []
+    for api_action, kind, node, target in plan.changes:
+        if kind == TAG and target.get('tag_id') is None:
+            target = tag_for(target['tag_name'], target['tag_value'])
+        changes.append((api_action, kind, node, target))
+
+    def update_status(change):
+        api_action, kind, node, status = change
+        log.info('Setting status node={0},status={1}'.format(node['node_name'], status['status_name']))
+        return client.api_submit('/api/nodes/{0}'.format(node['node_id']),
+                                 {'status_id': status['status_id']}, method='put')
+
+    statuses = [c for c in changes if c[1] == STATUS]
+    if statuses:
+        result.extend(run_concurrent(update_status, statuses, concurrency))
+
+    for api_action in ('delete', 'put'):
+        for kind in (TAG, NODE_GROUP):
+            endpoint, id_field, name = ASSIGNMENTS[kind]
+            items = [c for c in changes if c[0] == api_action and c[1] == kind]
+            if not items:
+                continue
+
+            def to_data(change, id_field=id_field, name=name):
+                api_action, kind, node, target = change
+                log.info('{0} {1} {2} on node={3}'.format(api_action, kind, name(target), node['node_name']))
+                return {'node_id': node['node_id'], id_field: target[id_field]}
+
+            result.extend(client.bulk_assign(endpoint, items, to_data, api_action,
+                                             chunk_size, concurrency))
+
+    log.info('Applied {0} change(s), {1} failed.'.format(len(result.succeeded), len(result.failed)))
+    return result
+
+
+def reconcile(desired, dry_run=False, prune=False, chunk_size=None, concurrency=None):
+    """
+    Brings nodes to their desired status, tags and node_groups, sending
+    only the changes. See plan() for the format of desired.
+
+    Args:
+        desired (dict): node_name to desired state.
+        dry_run (bool): Only plan, don't change anything.
+        prune (bool): Also remove tags and node_groups that aren't desired.
+        chunk_size (int): Nodes per search and assignments per batch
+            request.
+        concurrency (int): The number of requests in flight. Defaults to
+            settings.concurrency.
+
+    Returns:
+        The Plan on a dry run, otherwise a BulkResult of (change, response)
+        pairs.
+    """
+
+    p = plan(desired, prune, dry_run, chunk_size)
+    if dry_run:
+        for line in p.describe():
+            log.info('Dry run: {0}'.format(line))
+        return p
+    return apply(p, chunk_size, concurrency)
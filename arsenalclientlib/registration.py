@@ -0,0 +1,124 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import json
+import time
+import logging
+import tempfile
+
+import arsenalclientlib.settings as settings
+
+log = logging.getLogger(__name__)
+
+
+def flatten(data, prefix=''):
+    """
+    Flattens a nested register payload into a dict of dotted field names,
+    e.g. {'hardware_profile.model': 'Xen Guest', ...}.
+    """
+
+    fields = {}
+    for k, v in data.items():
+        name = prefix + k
+        if isinstance(v, dict):
+            fields.update(flatten(v, name + '.'))
+        else:
+            fields[name] = v
+    return fields
+
+
+def volatile_fields():
+    """Returns the fields left out of the fingerprint."""
+
+    volatile = settings.register_volatile_fields or ''
+    if isinstance(volatile, (list, tuple, set)):
+        return set(volatile)
+    return set(f.strip() for f in volatile.split(',') if f.strip())
+
+
+def fingerprint(payload):
+    """
+    Builds the fingerprint of a register payload: its flattened fields
+    without the volatile ones.
+
+    Args:
+        payload (dict): The register payload, e.g. Node.to_dict().
+    """
+
+    volatile = volatile_fields()
+    fields = flatten(payload)
+    for name in list(fields.keys()):
+        if name in volatile or name.split('.')[0] in volatile:
+            del fields[name]
+    return fields
+
+
+def load_state():
+    """
+    Reads the fingerprint of the last successful registration.
+
+    Returns:
+        A dict with registered_at and fields, None if there is none.
+    """
+
+    if not settings.register_state_file:
+        return None
+    try:
+        with open(settings.register_state_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_state(fields):
+    """Saves the fingerprint of a successful registration."""
+
+    if not settings.register_state_file:
+        return
+
+    state = {'registered_at': time.time(), 'fields': fields}
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(settings.register_state_file)),
+                                        prefix='.arsenal_register')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_file, settings.register_state_file)
+    except (IOError, OSError) as e:
+        log.error('Unable to write register state {0}: {1}'.format(settings.register_state_file, e))
+
+
+def changed_fields(fields, state):
+    """
+    Compares a fingerprint against the last registered one.
+
+    Returns:
+        A sorted list of the field names that were added, removed or
+        changed. ['*'] if there is no previous registration or the full
+        re-register interval has passed.
+    """
+
+    if not state:
+        return ['*']
+
+    if time.time() - state.get('registered_at', 0) >= float(settings.register_interval):
+        return ['*']
+
+    old = state.get('fields', {})
+    changed = []
+    for name in set(fields) | set(old):
+        if fields.get(name) != old.get(name):
+            changed.append(name)
+    return sorted(changed)
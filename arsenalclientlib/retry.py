@@ -0,0 +1,187 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+import random
+import logging
+import threading
+
+import arsenalclientlib.settings as settings
+from arsenalclientlib.exceptions import CircuitOpenError
+
+log = logging.getLogger(__name__)
+
+# Methods that are safe to send again if we don't know whether the first
+# attempt was applied.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed request is tried again.
+
+    Only idempotent methods are retried. Delays grow exponentially from
+    backoff up to backoff_max with random jitter, honouring Retry-After on
+    429s. No attempt is started past the per-call deadline.
+
+    Args:
+        retries (int): The maximum number of retries. Defaults to
+            settings.retries.
+        backoff (float): The first delay in seconds. Defaults to
+            settings.retry_backoff.
+        backoff_max (float): The longest delay in seconds. Defaults to
+            settings.retry_backoff_max.
+        deadline (float): Seconds after which a call is given up on,
+            including retries. 0 for none. Defaults to
+            settings.request_deadline.
+        methods (tuple): The methods that may be retried.
+        statuses (tuple): The http statuses that are retried.
+        sleep (callable): Used to wait between attempts.
+    """
+
+    def __init__(self, retries=None, backoff=None, backoff_max=None, deadline=None,
+                 methods=IDEMPOTENT_METHODS, statuses=RETRY_STATUSES, sleep=time.sleep):
+        self._retries = retries
+        self._backoff = backoff
+        self._backoff_max = backoff_max
+        self._deadline = deadline
+        self.methods = methods
+        self.statuses = statuses
+        self.sleep = sleep
+
+    @property
+    def retries(self):
+        if self._retries is None:
+            return int(settings.retries)
+        return int(self._retries)
+
+    @property
+    def deadline(self):
+        if self._deadline is None:
+            return float(settings.request_deadline or 0)
+        return float(self._deadline or 0)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Seconds to wait before retry number attempt (starting at 1).
+
+        Args:
+            retry_after (str): The Retry-After header of the response, if
+                any.
+        """
+
+        backoff = float(settings.retry_backoff if self._backoff is None else self._backoff)
+        backoff_max = float(settings.retry_backoff_max if self._backoff_max is None else self._backoff_max)
+
+        if retry_after:
+            try:
+                return min(backoff_max, float(retry_after))
+            except ValueError:
+                pass
+
+        delay = min(backoff_max, backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def should_retry(self, method, attempts, elapsed, delay):
+        """
+        Whether to make another attempt.
+
+        Args:
+            method (str): The http method.
+            attempts (int): Attempts made so far.
+            elapsed (float): Seconds spent so far.
+            delay (float): The wait before the next attempt.
+        """
+
+        if method.upper() not in self.methods:
+            return False
+        if attempts > self.retries:
+            return False
+        deadline = self.deadline
+        if deadline and elapsed + delay >= deadline:
+            return False
+        return True
+
+
+class CircuitBreaker(object):
+    """
+    Fails fast while the API is down. After threshold consecutive failed
+    attempts the circuit opens and requests raise CircuitOpenError without
+    being sent. After reset_timeout seconds one trial request is let
+    through; success closes the circuit, failure opens it again.
+
+    Args:
+        threshold (int): Consecutive failures that open the circuit.
+            Defaults to settings.circuit_breaker_threshold. 0 disables it.
+        reset_timeout (float): Seconds the circuit stays open. Defaults to
+            settings.circuit_breaker_reset.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=None, reset_timeout=None):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def threshold(self):
+        if self._threshold is None:
+            return int(settings.circuit_breaker_threshold or 0)
+        return int(self._threshold)
+
+    @property
+    def reset_timeout(self):
+        if self._reset_timeout is None:
+            return float(settings.circuit_breaker_reset)
+        return float(self._reset_timeout)
+
+    def before_request(self, url=None):
+        """Raises CircuitOpenError if the request must not be sent."""
+
+        if not self.threshold:
+            return
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                log.info('Circuit half-open, sending a trial request.')
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenError('API unavailable, circuit is open.', url=url, attempts=0, elapsed=0.0)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info('Circuit closed.')
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold and (self.state == self.HALF_OPEN or self.failures >= self.threshold):
+                if self.state != self.OPEN:
+                    log.error('API failing, opening circuit for {0}s.'.format(self.reset_timeout))
+                self.state = self.OPEN
+                self._opened_at = time.time()
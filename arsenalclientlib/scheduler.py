@@ -0,0 +1,195 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Spreads fleet-wide registrations out so that every host registering from
+cron at the same minute doesn't hit the API at once.
+
+Usage::
+
+  >>> from arsenalclientlib import scheduler
+  >>> scheduler.scheduled_register()
+
+Simulate a fleet against a local stub server and report the peak request
+rate the API would see::
+
+  $ python -m arsenalclientlib.scheduler --hosts 5000 --window 300
+"""
+import os
+import time
+import hashlib
+import logging
+import tempfile
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.bulk import run_concurrent
+from arsenalclientlib.node import Node
+from arsenalclientlib.retry import RetryPolicy
+
+log = logging.getLogger(__name__)
+
+
+def jitter_delay(unique_id, window=None):
+    """
+    A delay in [0, window) seconds derived from the unique_id, so each host
+    always registers at the same point in the window and the fleet is
+    spread evenly across it.
+
+    Args:
+        unique_id (str): The unique_id of the node.
+        window (float): The window in seconds. Defaults to
+            settings.register_window.
+    """
+
+    if window is None:
+        window = settings.register_window
+    window = float(window)
+    if window <= 0:
+        return 0.0
+
+    digest = hashlib.md5(unique_id.encode('utf-8')).hexdigest()
+    return (int(digest[:8], 16) / float(0x100000000)) * window
+
+
+def scheduled_register(window=None, force=False):
+    """
+    Registers the node from cron: waits for the node's jitter delay within
+    the window, then registers. Requests the API is too busy for are
+    retried by api_submit's retry policy.
+
+    Args:
+        window (float): The window in seconds. Defaults to
+            settings.register_window.
+        force (bool): Register even if nothing changed.
+
+    Returns:
+        The register() response, None if the registration was skipped.
+    """
+
+    data = client.collect_data()
+    delay = jitter_delay(data.unique_id, window)
+    log.info('Registering in {0:.1f}s.'.format(delay))
+    time.sleep(delay)
+
+    return client.register(force, data)
+
+
+def simulate(hosts, window=None, time_scale=0.01, capacity=None, latency=0.0,
+             retries=None, concurrency=200):
+    """
+    Replays a fleet of virtual hosts registering against a local stub server.
+
+    Each virtual host waits for its jitter delay and registers with the
+    same retry policy as scheduled_register(), without the circuit breaker
+    since every real host would have its own. Time is compressed by time_scale
+    so a 5 minute window replays in seconds.
+
+    Args:
+        hosts (int): The number of virtual hosts.
+        window (float): The jitter window in simulated seconds. Defaults
+            to settings.register_window. 0 has every host register at once.
+        time_scale (float): Real seconds per simulated second.
+        capacity (float): Requests per simulated second the stub serves
+            before answering 503. None for no limit.
+        latency (float): Seconds the stub adds to every request.
+        retries (int): The maximum number of retries per host. Defaults to
+            settings.retries.
+        concurrency (int): The number of virtual hosts in flight at once.
+
+    Returns:
+        A dict with the number of hosts, requests, throttled requests and
+        failed hosts, the peak request rate per simulated second and the
+        simulated duration. If the duration is well past the window the
+        run was limited by the simulator itself, use a larger time_scale.
+    """
+
+    # Only the simulation needs the stub, keep it off the registration path.
+    from arsenalclientlib.stub_server import StubServer
+
+    saved = dict((k, getattr(settings, k, None)) for k in
+                 ('api_protocol', 'api_host', 'ssl_verify', 'user_login', 'cookie_file',
+                  'concurrency', 'circuit_breaker_threshold'))
+    saved_session = client.session
+    if capacity:
+        capacity = capacity / time_scale
+    server = StubServer(latency=latency, capacity=capacity).start()
+    try:
+        server.configure()
+        settings.user_login = 'kaboom'
+        fd, settings.cookie_file = tempfile.mkstemp(prefix='arsenal_simulate')
+        os.close(fd)
+        settings.concurrency = concurrency
+        settings.circuit_breaker_threshold = 0
+        client.session = client.build_session()
+
+        schedule = []
+        for i in range(hosts):
+            unique_id = 'sim-{0:06d}'.format(i)
+            schedule.append((jitter_delay(unique_id, window) * time_scale, unique_id))
+        schedule.sort()
+
+        policy = RetryPolicy(retries=retries, deadline=0, sleep=lambda d: time.sleep(d * time_scale))
+        start = time.time()
+
+        def host(item):
+            offset, unique_id = item
+            wait = start + offset - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            node = Node(unique_id=unique_id, node_name='{0}.example.com'.format(unique_id))
+            return client.api_submit('/api/register', node, method='put', policy=policy)
+
+        result = run_concurrent(host, schedule, concurrency)
+        duration = time.time() - start
+
+        return {'hosts': hosts,
+                'requests': len(server.requests),
+                'throttled': len([r for r in server.requests if r[3] == server.throttle_status]),
+                'failed': len(result.failed),
+                'peak_rate': server.peak_rate(time_scale=time_scale),
+                'duration': duration / time_scale,
+        }
+    finally:
+        # Close keep-alive connections first so the stub's handler threads
+        # exit.
+        client.session.close()
+        server.stop()
+        if os.path.isfile(settings.cookie_file):
+            os.unlink(settings.cookie_file)
+        for k, v in saved.items():
+            setattr(settings, k, v)
+        client.session = saved_session
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simulate fleet-wide registration against a local stub server.')
+    parser.add_argument('--hosts', type=int, default=1000, help='Number of virtual hosts.')
+    parser.add_argument('--window', type=float, default=None, help='Jitter window in seconds.')
+    parser.add_argument('--time-scale', type=float, default=0.01, help='Real seconds per simulated second.')
+    parser.add_argument('--capacity', type=float, default=None, help='Requests per second the stub serves before answering 503.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stub adds to every request.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = simulate(args.hosts, args.window, args.time_scale, args.capacity, args.latency)
+    for k in ('hosts', 'requests', 'throttled', 'failed', 'peak_rate', 'duration'):
+        print('{0:>10}: {1}'.format(k, result[k]))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,3 +13,117 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+
+# Defaults for tunables. Anything set in the conf file or passed in via args
+# overrides these; values read from the conf file are coerced to the type of
+# the default.
+
+# Number of worker threads used for bulk operations.
+concurrency = 10
+
+# Number of results requested per page by iter_search() and object_search().
+search_page_size = 1000
+
+# Connection pooling for the shared requests session. pool_maxsize is raised
+# to concurrency if it is smaller.
+pool_connections = 10
+pool_maxsize = 10
+keep_alive = True
+# Number of times to retry failed connections.
+max_retries = 0
+
+# Request timeouts in seconds. None, none or 0 in the conf file, waits
+# forever.
+connect_timeout = 10.0
+read_timeout = 300.0
+
+# Name -> object lookup cache for tags, statuses and node_groups. Entries
+# expire after lookup_cache_ttl seconds. Set lookup_cache_file to keep the
+# cache between runs.
+lookup_cache_ttl = 300
+lookup_cache_size = 1000
+lookup_cache_file = None
+
+# Number of assignments sent per batch request by bulk_assign(). 1 disables
+# batching.
+assignment_chunk_size = 100
+# The batch counterpart of the /api/*_assignments endpoints, taking
+# {'assignments': [...]}, if the server has one. {0} is the endpoint name,
+# e.g. /api/bulk/{0} for /api/bulk/tag_node_assignments. None sends every
+# assignment on its own.
+assignment_batch_endpoint = None
+
+# Concurrent identical GETs share one in-flight request.
+single_flight = True
+
+# Local SQLite inventory snapshot used by snapshot.Snapshot. Types refreshed
+# less than snapshot_max_age seconds ago are not fetched again.
+snapshot_file = None
+snapshot_max_age = 3600
+# The search param Snapshot.sync() sends to only get objects updated since
+# the newest 'updated' timestamp it has seen. None if the API doesn't have
+# one, sync() then relies on ETag/Last-Modified validators per page.
+sync_since_param = None
+
+# The search param that asks the API to return only some fields, if the api
+# has one. object_search(fields=...) projects the results either way.
+search_fields_param = None
+
+# Cache facter output in facter_cache_file so register() only runs facter for
+# facts older than facter_cache_ttl seconds. facter_fact_ttls overrides the
+# TTL for individual facts, e.g. 'ec2_public_hostname=300'.
+facter_cache_file = None
+facter_cache_ttl = 86400
+facter_fact_ttls = None
+
+# Save the resolved unique_id here so later register() runs skip probing.
+unique_id_file = None
+
+# Delta registration. If register_state_file is set, register() only submits
+# when a field other than register_volatile_fields changed, or when
+# register_interval seconds have passed since the last full registration.
+register_state_file = None
+register_volatile_fields = 'uptime'
+register_interval = 86400
+
+# Client side rate limit in requests per second, shared by every request the
+# process makes. 0 disables it.
+rate_limit = 0.0
+rate_limit_burst = 10
+
+# scheduler.scheduled_register() spreads registrations over register_window
+# seconds.
+register_window = 300
+
+# Idempotent requests that fail with a connection error, 429 or 5xx are
+# retried up to retries times, backing off exponentially from retry_backoff
+# up to retry_backoff_max seconds. request_deadline caps the total seconds
+# spent on one call, 0 for no cap.
+retries = 3
+retry_backoff = 1.0
+retry_backoff_max = 60.0
+request_deadline = 0.0
+
+# Request, auth, facter and dmidecode timings are collected in
+# arsenalclientlib.metrics. register() exports them to metrics_textfile
+# (Prometheus textfile format) and to statsd_host:statsd_port if set.
+metrics_enabled = True
+metrics_textfile = None
+statsd_host = None
+statsd_port = 8125
+
+# After circuit_breaker_threshold consecutive failures requests fail fast
+# for circuit_breaker_reset seconds. 0 disables the circuit breaker.
+circuit_breaker_threshold = 5
+circuit_breaker_reset = 30.0
+
+# Registrations that can't reach the API, and deferred mutations, are
+# appended to journal_file and replayed by journal.drain(). Appends are
+# fsynced every journal_fsync_batch records or journal_fsync_interval
+# seconds. Replays are capped at journal_drain_rate requests per second, 0
+# for no cap, and DrainWorker drains every journal_drain_interval seconds.
+journal_file = None
+journal_fsync_batch = 100
+journal_fsync_interval = 1.0
+journal_drain_rate = 10.0
+journal_drain_interval = 60.0
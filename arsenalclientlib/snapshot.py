@@ -0,0 +1,560 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+A local SQLite snapshot of the inventory, so repeated searches over the same
+fleet don't each go to the API.
+
+Usage::
+
+  >>> from arsenalclientlib.snapshot import Snapshot
+  >>> snap = Snapshot('/var/tmp/arsenal.db')
+  >>> snap.refresh()
+  <BulkResult succeeded=4 failed=0>
+  >>> snap.query('nodes', 'node_name=web&status=inservice')
+  [{u'node_id': 12, u'node_name': u'web0012.example.com', ...}]
+
+Later runs can sync() instead, which only transfers what changed::
+
+  >>> snap.sync()
+  <BulkResult succeeded=4 failed=0>
+
+A path of ':memory:' keeps the snapshot in memory for the life of the
+Snapshot.
+"""
+import json
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.bulk import run_concurrent
+from arsenalclientlib.registration import flatten
+
+log = logging.getLogger(__name__)
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+# object_type: (id field, ((column, paths into a result), ...), search that
+# matches every object). The first path that resolves is used.
+TYPES = {
+    'nodes': ('node_id',
+              (('node_name', ('node_name',)),
+               ('unique_id', ('unique_id',)),
+               ('status_name', ('status.status_name', 'status_name'))),
+              'node_name='),
+    'node_groups': ('node_group_id',
+                    (('node_group_name', ('node_group_name',)),),
+                    'node_group_name='),
+    'tags': ('tag_id',
+             (('tag_name', ('tag_name',)),
+              ('tag_value', ('tag_value',))),
+             'tag_name='),
+    'statuses': ('status_id',
+                 (('status_name', ('status_name',)),),
+                 'status_name='),
+}
+
+# Search keys that are other names for an indexed column.
+ALIASES = {
+    'nodes': {'status': 'status_name'},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (node_id INTEGER PRIMARY KEY, node_name TEXT,
+    unique_id TEXT, status_name TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS nodes_node_name ON nodes (node_name);
+CREATE INDEX IF NOT EXISTS nodes_unique_id ON nodes (unique_id);
+CREATE INDEX IF NOT EXISTS nodes_status_name ON nodes (status_name);
+
+CREATE TABLE IF NOT EXISTS node_groups (node_group_id INTEGER PRIMARY KEY,
+    node_group_name TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS node_groups_node_group_name ON node_groups (node_group_name);
+
+CREATE TABLE IF NOT EXISTS tags (tag_id INTEGER PRIMARY KEY, tag_name TEXT,
+    tag_value TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS tags_tag_name_value ON tags (tag_name, tag_value);
+
+CREATE TABLE IF NOT EXISTS statuses (status_id INTEGER PRIMARY KEY,
+    status_name TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS statuses_status_name ON statuses (status_name);
+
+CREATE TABLE IF NOT EXISTS node_tags (node_id INTEGER, tag_name TEXT, tag_value TEXT);
+CREATE INDEX IF NOT EXISTS node_tags_node_id ON node_tags (node_id);
+CREATE INDEX IF NOT EXISTS node_tags_tag_name_value ON node_tags (tag_name, tag_value);
+
+CREATE TABLE IF NOT EXISTS node_node_groups (node_id INTEGER, node_group_name TEXT);
+CREATE INDEX IF NOT EXISTS node_node_groups_node_id ON node_node_groups (node_id);
+CREATE INDEX IF NOT EXISTS node_node_groups_name ON node_node_groups (node_group_name);
+
+CREATE TABLE IF NOT EXISTS refreshed (object_type TEXT PRIMARY KEY, refreshed_at REAL);
+
+CREATE TABLE IF NOT EXISTS pages (object_type TEXT, page_start INTEGER, page_limit INTEGER,
+    etag TEXT, last_modified TEXT, ids TEXT, size INTEGER, next_start INTEGER,
+    PRIMARY KEY (object_type, page_start));
+
+CREATE TABLE IF NOT EXISTS cursors (object_type TEXT PRIMARY KEY, cursor TEXT);
+"""
+
+# The field of a result holding when it last changed.
+UPDATED_FIELD = 'updated'
+
+STAT_KEYS = ('added', 'updated', 'removed', 'requests', 'bytes', 'not_modified',
+             'full_requests', 'full_bytes', 'saved_requests', 'saved_bytes')
+
+
+def _resolve(result, paths):
+    """Returns the value of the first dotted path found in result."""
+
+    for path in paths:
+        v = result
+        for part in path.split('.'):
+            if not isinstance(v, dict) or part not in v:
+                v = None
+                break
+            v = v[part]
+        if v is not None:
+            return v
+    return None
+
+
+def _like(value):
+    """A LIKE pattern matching value anywhere, with wildcards escaped."""
+
+    value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + value + '%'
+
+
+class Snapshot(object):
+    """
+    Keeps nodes, node_groups, tags and statuses in a local SQLite file,
+    indexed on node_name, unique_id, status and tag name/value.
+
+    Args:
+        path (str): The SQLite file. Defaults to settings.snapshot_file.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.RLock()
+        self._schema_created = False
+        self._memory = None
+
+    @property
+    def path(self):
+        path = self._path or settings.snapshot_file
+        if not path:
+            raise ValueError('No snapshot file, set snapshot_file.')
+        return path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._schema_created:
+            conn.executescript(SCHEMA)
+            self._schema_created = True
+        return conn
+
+    @contextmanager
+    def _connection(self, write=False):
+        """
+        Yields a connection in a transaction. A file snapshot opens a
+        connection per call, a ':memory:' snapshot shares one under the lock.
+        Writers are serialized either way.
+        """
+
+        memory = self.path == ':memory:'
+        locked = memory or write
+        if locked:
+            self._lock.acquire()
+        try:
+            if memory:
+                if self._memory is None:
+                    self._memory = sqlite3.connect(':memory:', check_same_thread=False)
+                    self._memory.executescript(SCHEMA)
+                conn = self._memory
+            else:
+                conn = self._connect()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                if not memory:
+                    conn.close()
+        finally:
+            if locked:
+                self._lock.release()
+
+    def refreshed_at(self, object_type):
+        """Returns when object_type was last refreshed, None if never."""
+
+        with self._connection() as conn:
+            row = conn.execute('SELECT refreshed_at FROM refreshed WHERE object_type = ?',
+                               (object_type,)).fetchone()
+        return row[0] if row else None
+
+    def refresh(self, object_types=None, max_age=None, concurrency=None):
+        """
+        Pulls objects from the API into the snapshot. Every type is paged
+        through in its own thread.
+
+        The refresh is incremental: types refreshed less than max_age
+        seconds ago are skipped, and only rows that were added, changed or
+        removed since the last refresh are written.
+
+        Args:
+            object_types (list): The types to refresh. Defaults to all of
+                them.
+            max_age (float): Skip types refreshed more recently than this.
+                Defaults to settings.snapshot_max_age. 0 refreshes
+                everything.
+            concurrency (int): The number of types fetched at once.
+
+        Returns:
+            A BulkResult of (object_type, {'added': n, 'updated': n,
+            'removed': n}) and (object_type, exception).
+        """
+
+        if object_types is None:
+            object_types = sorted(TYPES)
+        if max_age is None:
+            max_age = settings.snapshot_max_age
+        max_age = float(max_age or 0)
+
+        stale = []
+        now = time.time()
+        for object_type in object_types:
+            refreshed_at = self.refreshed_at(object_type)
+            if max_age and refreshed_at and now - refreshed_at < max_age:
+                log.debug('Snapshot of {0} is fresh, skipping.'.format(object_type))
+                continue
+            stale.append(object_type)
+
+        result = run_concurrent(self._refresh_type, stale, concurrency)
+        for object_type, counts in result.succeeded:
+            log.info('Snapshot of {0}: {1[added]} added, {1[updated]} updated, '
+                     '{1[removed]} removed.'.format(object_type, counts))
+        return result
+
+    def _refresh_type(self, object_type):
+        id_field, columns, search = TYPES[object_type]
+
+        fetched = {}
+        for r in client.iter_search(object_type, search, prefetch=True):
+            fetched[r[id_field]] = r
+
+        with self._connection(write=True) as conn:
+            return self._apply(conn, object_type, fetched)
+
+    def _apply(self, conn, object_type, fetched, seen=None, prune=True):
+        """
+        Writes the difference between fetched and the stored rows.
+
+        Args:
+            fetched (dict): Results by id.
+            seen (set): The ids that still exist. Defaults to the fetched
+                ones.
+            prune (bool): Remove stored rows that weren't seen.
+        """
+
+        id_field, columns, search = TYPES[object_type]
+
+        stored = dict(conn.execute('SELECT {0}, data FROM {1}'.format(id_field, object_type)))
+
+        if seen is None:
+            seen = fetched
+        removed = []
+        if prune:
+            removed = [(k,) for k in stored if k not in seen]
+        rows = []
+        added = 0
+        for k, r in fetched.items():
+            data = json.dumps(r, sort_keys=True)
+            if stored.get(k) == data:
+                continue
+            if k not in stored:
+                added += 1
+            rows.append([k] + [_resolve(r, paths) for column, paths in columns] + [data])
+
+        names = [id_field] + [column for column, paths in columns] + ['data']
+        conn.executemany('DELETE FROM {0} WHERE {1} = ?'.format(object_type, id_field), removed)
+        conn.executemany('INSERT OR REPLACE INTO {0} ({1}) VALUES ({2})'.format(
+            object_type, ', '.join(names), ', '.join('?' for n in names)), rows)
+
+        if object_type == 'nodes':
+            changed = removed + [(row[0],) for row in rows]
+            conn.executemany('DELETE FROM node_tags WHERE node_id = ?', changed)
+            conn.executemany('DELETE FROM node_node_groups WHERE node_id = ?', changed)
+            tags = []
+            node_groups = []
+            for row in rows:
+                r = fetched[row[0]]
+                for t in r.get('tags') or []:
+                    tags.append((row[0], t.get('tag_name'), t.get('tag_value')))
+                for ng in r.get('node_groups') or []:
+                    node_groups.append((row[0], ng.get('node_group_name')))
+            conn.executemany('INSERT INTO node_tags VALUES (?, ?, ?)', tags)
+            conn.executemany('INSERT INTO node_node_groups VALUES (?, ?)', node_groups)
+
+        conn.execute('INSERT OR REPLACE INTO refreshed VALUES (?, ?)', (object_type, time.time()))
+
+        updated = [r[UPDATED_FIELD] for r in fetched.values() if r.get(UPDATED_FIELD)]
+        row = conn.execute('SELECT cursor FROM cursors WHERE object_type = ?', (object_type,)).fetchone()
+        if row and row[0]:
+            updated.append(row[0])
+        if updated:
+            conn.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (object_type, max(updated)))
+
+        return {'added': added, 'updated': len(rows) - added, 'removed': len(removed)}
+
+    def sync(self, object_types=None, concurrency=None):
+        """
+        Brings the snapshot up to date fetching as little as possible, and
+        reports what that saved compared with a full refresh.
+
+        Every page of a type is requested with the If-None-Match and
+        If-Modified-Since validators from the last time it was fetched, so
+        unchanged pages come back as an empty 304. If
+        settings.sync_since_param is set, the API is instead asked only for
+        objects updated after the newest 'updated' timestamp seen; removed
+        objects are then picked up by the next refresh().
+
+        Returns:
+            A BulkResult of (object_type, stats) and (object_type,
+            exception). stats has the added, updated and removed counts,
+            the requests and bytes the sync took, the pages that were
+            not_modified, the full_requests and full_bytes a full refresh
+            would have taken and the saved_requests and saved_bytes.
+        """
+
+        if object_types is None:
+            object_types = sorted(TYPES)
+
+        result = run_concurrent(self._sync_type, object_types, concurrency)
+
+        total = dict((k, 0) for k in STAT_KEYS)
+        for object_type, stats in result.succeeded:
+            log.info('Synced {0}: {1[added]} added, {1[updated]} updated, {1[removed]} removed '
+                     'in {1[requests]} requests, {1[bytes]} bytes.'.format(object_type, stats))
+            for k in STAT_KEYS:
+                total[k] += stats[k]
+        log.info('Sync saved {0[saved_requests]} of {0[full_requests]} requests and '
+                 '{0[saved_bytes]} of {0[full_bytes]} bytes.'.format(total))
+        return result
+
+    def _get(self, object_type, params, start, page_size, headers=None):
+        """Fetches a page, leaving 304s to the caller."""
+
+        params = dict(params)
+        params['start'] = start
+        params['limit'] = page_size
+
+        api_url = (settings.api_protocol
+                   + '://'
+                   + settings.api_host
+                   + '/api/{0}'.format(object_type))
+
+        r = client._request('get', api_url, verify=settings.ssl_verify, timeout=client.get_timeout(),
+                            params=params, headers=headers)
+        if r.status_code not in (200, 304):
+            client.check_response_codes(r)
+        return r
+
+    def _sync_type(self, object_type):
+        id_field, columns, search = TYPES[object_type]
+        page_size = int(settings.search_page_size)
+        params = client._search_params(search)
+
+        with self._connection() as conn:
+            pages = {}
+            for row in conn.execute('SELECT page_start, etag, last_modified, ids, size, next_start '
+                                    'FROM pages WHERE object_type = ? AND page_limit = ?',
+                                    (object_type, page_size)):
+                pages[row[0]] = row
+            row = conn.execute('SELECT cursor FROM cursors WHERE object_type = ?', (object_type,)).fetchone()
+        cursor = row[0] if row else None
+
+        stats = {'requests': 0, 'bytes': 0, 'not_modified': 0, 'full_requests': 0, 'full_bytes': 0}
+        fetched = {}
+        new_pages = []
+        seen = set()
+        since_param = settings.sync_since_param
+
+        if since_param and cursor:
+            params[since_param] = cursor
+            start = 0
+            while start is not None:
+                r = self._get(object_type, params, start, page_size)
+                stats['requests'] += 1
+                stats['bytes'] += len(r.content)
+                results = r.json()
+                for i in results['results']:
+                    fetched[i[id_field]] = i
+                if results['results']:
+                    start = client._next_start(results, start, page_size)
+                else:
+                    start = None
+        else:
+            start = 0
+            while start is not None:
+                old = pages.get(start)
+                headers = {}
+                if old and old[1]:
+                    headers['If-None-Match'] = old[1]
+                if old and old[2]:
+                    headers['If-Modified-Since'] = old[2]
+
+                r = self._get(object_type, params, start, page_size, headers)
+                stats['requests'] += 1
+                stats['bytes'] += len(r.content)
+
+                if r.status_code == 304:
+                    stats['not_modified'] += 1
+                    page_start, etag, last_modified, ids, size, next_start = old
+                    ids = json.loads(ids)
+                else:
+                    results = r.json()
+                    ids = []
+                    for i in results['results']:
+                        fetched[i[id_field]] = i
+                        ids.append(i[id_field])
+                    etag = r.headers.get('ETag')
+                    last_modified = r.headers.get('Last-Modified')
+                    size = len(r.content)
+                    next_start = None
+                    if ids:
+                        next_start = client._next_start(results, start, page_size)
+
+                seen.update(ids)
+                stats['full_requests'] += 1
+                stats['full_bytes'] += size
+                new_pages.append((object_type, start, page_size, etag, last_modified,
+                                  json.dumps(ids), size, next_start))
+                start = next_start
+
+        with self._connection(write=True) as conn:
+            if since_param and cursor:
+                stats.update(self._apply(conn, object_type, fetched, prune=False))
+                # Estimate the full refresh from what is stored.
+                count, size = conn.execute('SELECT COUNT(*), SUM(LENGTH(data)) FROM {0}'.format(
+                    object_type)).fetchone()
+                stats['full_requests'] = max(1, -(-count // page_size))
+                stats['full_bytes'] = size or 0
+            else:
+                stats.update(self._apply(conn, object_type, fetched, seen))
+                conn.execute('DELETE FROM pages WHERE object_type = ?', (object_type,))
+                conn.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)', new_pages)
+
+        stats['saved_requests'] = stats['full_requests'] - stats['requests']
+        stats['saved_bytes'] = stats['full_bytes'] - stats['bytes']
+        return stats
+
+    def query(self, object_type, search, exact_get=None, model=None):
+        """
+        Searches the snapshot with the same key=value&key=value terms as
+        object_search(). Comma separated values match any of them. Without
+        exact_get values match as case-insensitive substrings.
+
+        Indexed fields (node_name, unique_id, status, tag_name, tag_value,
+        node_group_name, ...) are searched in SQLite, any other field of the
+        stored results, e.g. hardware_profile.model, is matched afterwards.
+
+        Usage:
+
+          >>> snap.query('nodes', 'tag_name=env&tag_value=prod', True)
+
+        Args:
+            model (class): A Model, e.g. Node, to hydrate the results into.
+
+        Returns:
+            A list of results, None if nothing matched.
+        """
+
+        id_field, columns, search_all = TYPES[object_type]
+        indexed = [column for column, paths in columns]
+        aliases = ALIASES.get(object_type, {})
+
+        terms = client._search_params(search)
+        del terms['exact_get']
+
+        where = []
+        params = []
+        others = {}
+        joins = {'node_tags': [], 'node_node_groups': []}
+
+        def match(column, values):
+            if exact_get:
+                params.extend(values)
+                return '{0} IN ({1})'.format(column, ', '.join('?' for v in values))
+            params.extend(_like(v) for v in values)
+            return '(' + ' OR '.join("{0} LIKE ? ESCAPE '\\'".format(column) for v in values) + ')'
+
+        for key, value in terms.items():
+            values = value.split(',')
+            key = aliases.get(key, key)
+            if key in indexed or key == id_field:
+                where.append(match(key, values))
+            elif object_type == 'nodes' and key in ('tag_name', 'tag_value'):
+                joins['node_tags'].append((key, values))
+            elif object_type == 'nodes' and key == 'node_group_name':
+                joins['node_node_groups'].append((key, values))
+            else:
+                others[key] = values
+
+        for table, conditions in joins.items():
+            if conditions:
+                clauses = [match(key, values) for key, values in conditions]
+                where.append('node_id IN (SELECT node_id FROM {0} WHERE {1})'.format(
+                    table, ' AND '.join(clauses)))
+
+        sql = 'SELECT data FROM {0}'.format(object_type)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY {0}'.format(id_field)
+
+        with self._connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        results = []
+        for (data,) in rows:
+            r = json.loads(data)
+            if others and not self._matches(r, others, exact_get):
+                continue
+            results.append(r if model is None else model.from_dict(r))
+
+        if not results:
+            log.info('No results found for search.')
+            return None
+        return results
+
+    def _matches(self, result, terms, exact_get):
+        """Matches the terms that aren't indexed against a stored result."""
+
+        fields = flatten(result)
+        for key, values in terms.items():
+            if key not in fields or fields[key] is None:
+                return False
+            v = text_type(fields[key])
+            if exact_get:
+                if v not in values:
+                    return False
+            elif not any(x.lower() in v.lower() for x in values):
+                return False
+        return True
@@ -0,0 +1,158 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Incremental decoding of json search responses, so a page of tens of
+thousands of results is never held in memory as text or as one parsed
+document.
+
+Usage::
+
+  >>> r = session.get(url, stream=True)
+  >>> results = ResultStream(r.iter_content(65536), close=r.close)
+  >>> for node in results:
+  ...     print(node['node_name'])
+  >>> results.meta
+  {u'total': 51234}
+"""
+import re
+import json
+import codecs
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters a json number may go on with.
+NUMBER_TAIL = re.compile(r'[0-9eE+\-.]*')
+
+
+class ResultStream(object):
+    """
+    Iterates the items of the array under key in a json object as they are
+    read from chunks, one at a time. Every other member of the object is
+    decoded whole into meta, which is complete once iteration has finished.
+
+    Args:
+        chunks (iterable): The body as byte strings, e.g. r.iter_content().
+        key (str): The member holding the array to stream.
+        close (callable): Called when iteration finishes or is abandoned,
+            e.g. to release the connection.
+
+    Attributes:
+        meta (dict): The members other than key.
+        count (int): The number of items yielded so far.
+        bytes (int): The number of bytes read so far.
+    """
+
+    def __init__(self, chunks, key='results', close=None):
+        self.meta = {}
+        self.count = 0
+        self.bytes = 0
+        self.key = key
+        self._chunks = iter(chunks)
+        self._close = close
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Reads the next chunk, dropping what has been consumed. Returns False
+        at the end of the body.
+        """
+
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            self._buf = self._buf[self._pos:] + self._text.decode(b'', True)
+            self._pos = 0
+            return False
+        self.bytes += len(chunk)
+        self._buf = self._buf[self._pos:] + self._text.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Returns the next non-whitespace character, '' at the end of the body."""
+
+        while True:
+            self._pos = WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError('Expected one of {0!r} at byte {1}, got {2!r}'.format(
+                chars, self.bytes - len(self._buf) + self._pos, c))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        """Decodes the next json value, reading more of the body as needed."""
+
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut off by the end of what has been read decodes as a
+            # shorter number, or fails on what is left of it, e.g. 12|3 or
+            # 2.|5. Read on until something other than the number follows.
+            if (self._buf[self._pos] in '-0123456789'
+                    and NUMBER_TAIL.match(self._buf, end).end() == len(self._buf)
+                    and self._fill()):
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        try:
+            self._expect('{')
+            if self._peek() == '}':
+                return
+            while True:
+                name = self._value()
+                self._expect(':')
+                if name == self.key and self._peek() == '[':
+                    self._pos += 1
+                    if self._peek() == ']':
+                        self._pos += 1
+                    else:
+                        while True:
+                            item = self._value()
+                            self.count += 1
+                            yield item
+                            if self._expect(',]') == ']':
+                                break
+                else:
+                    self.meta[name] = self._value()
+                if self._expect(',}') == '}':
+                    break
+        finally:
+            self.close()
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
@@ -0,0 +1,479 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+A local stand-in for the Arsenal API, for simulations and benchmarks. It is
+not a faithful implementation of the server, only enough of it to exercise
+the client.
+
+Usage::
+
+  >>> from arsenalclientlib.stub_server import StubServer
+  >>> server = StubServer(latency=0.01, capacity=200).start()
+  >>> server.configure()   # point settings at the stub
+  >>> client.register()
+  >>> server.peak_rate()
+  12.0
+  >>> server.stop()
+
+populate() adds a fleet of nodes and the search, status and assignment
+endpoints over it. The stub can also run on its own, e.g. for benchmarks::
+
+  $ python -m arsenalclientlib.stub_server --nodes 5000 --latency 0.005
+  127.0.0.1:38211
+"""
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+
+import arsenalclientlib.settings as settings
+
+STATUSES = ('inservice', 'setup', 'maintenance', 'hibernating', 'decom')
+
+# The object each kind of assignment is made to, and the key and list it is
+# recorded under.
+ASSIGNMENTS = {
+    'tag_node': ('nodes', 'node_id', 'tags', 'tags', 'tag_id'),
+    'tag_node_group': ('node_groups', 'node_group_id', 'tags', 'tags', 'tag_id'),
+    'node_group': ('nodes', 'node_id', 'node_groups', 'node_groups', 'node_group_id'),
+    'hypervisor_vm': ('nodes', 'child_node_id', 'hypervisor', 'nodes', 'parent_node_id'),
+}
+
+
+def _truthy(value):
+    return str(value).lower() in ('true', '1')
+
+
+def _matches(item, params):
+    """Matches an object against search params the way the API does."""
+
+    exact = _truthy(params.get('exact_get'))
+    for k, v in params.items():
+        if k in ('start', 'limit', 'exact_get', 'fields'):
+            continue
+        if k == 'status':
+            field = item['status']['status_name']
+        else:
+            field = item.get(k)
+        field = '' if field is None else str(field)
+        values = v.split(',')
+        if exact:
+            if field not in values:
+                return False
+        elif not any(x in field for x in values):
+            return False
+    return True
+
+
+def _summary(item, id_field, name_field):
+    return {id_field: item[id_field], name_field: item[name_field]}
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, a separate write for the body is
+    # held back by delayed ACKs on keep-alive connections.
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, method):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        if body:
+            try:
+                body = json.loads(body.decode('utf-8') if isinstance(body, bytes) else body)
+            except ValueError:
+                pass
+
+        cookies = {}
+        for c in (self.headers.get('Cookie') or '').split(';'):
+            if '=' in c:
+                k, v = c.strip().split('=', 1)
+                cookies[k] = v
+
+        status, result, headers = stub.dispatch(method, url.path, params, body, cookies)
+
+        payload = json.dumps(result).encode('utf-8') if result is not None else b''
+
+        if stub.etags and method == 'GET' and status == 200:
+            etag = '"{0}"'.format(hashlib.md5(payload).hexdigest())
+            headers = dict(headers, ETag=etag)
+            if self.headers.get('If-None-Match') == etag:
+                status = 304
+                payload = b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class StubServer(object):
+    """
+    Serves a minimal Arsenal API on a local port in a background thread.
+
+    Args:
+        latency (float): Seconds added to every request.
+        capacity (float): Requests per second served before answering
+            throttle_status. None for no limit.
+        throttle_status (int): The status returned over capacity.
+        etags (bool): Send ETags with GET responses and answer 304 to a
+            matching If-None-Match.
+        auth (bool): Answer 401 to PUTs and DELETEs without the auth_tkt
+            cookie /login hands out. See expire_auth().
+        max_limit (int): Clamp the limit of searches to this, as servers
+            with a maximum page size do. None for no maximum.
+
+    Attributes:
+        requests (list): (timestamp, method, path, status) for every request.
+    """
+
+    # settings.assignment_batch_endpoint for the stub's batch endpoints.
+    BATCH_ENDPOINT = '/api/bulk/{0}'
+
+    def __init__(self, latency=0.0, capacity=None, throttle_status=503, etags=True, auth=False,
+                 max_limit=None):
+        self.latency = latency
+        self.capacity = capacity
+        self.throttle_status = throttle_status
+        self.etags = etags
+        self.auth = auth
+        self.max_limit = max_limit
+        self.ticket = 'stub'
+        self.logins = 0
+        self.requests = []
+        self.routes = []
+        self.registered = {}
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.route('POST', r'/login$', self.login)
+        self.route('PUT', r'/api/register$', self.register)
+
+        self.objects = {'nodes': {}, 'statuses': {}, 'tags': {}, 'node_groups': {}}
+
+    def route(self, method, pattern, func):
+        """
+        Adds an endpoint. func(params, body, *groups) returns (status,
+        result) or (status, result, headers).
+        """
+
+        self.routes.append((method, re.compile(pattern), func))
+
+    def start(self):
+        self._server = _HTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def host(self):
+        """host:port of the stub, for settings.api_host."""
+
+        return '127.0.0.1:{0}'.format(self._server.server_address[1])
+
+    def configure(self):
+        """Points settings at the stub."""
+
+        settings.api_protocol = 'http'
+        settings.api_host = self.host
+        settings.ssl_verify = False
+
+    def _throttled(self, now):
+        if not self.capacity:
+            return False
+        with self._lock:
+            while self._recent and self._recent[0] <= now - 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.capacity:
+                return True
+            self._recent.append(now)
+            return False
+
+    def expire_auth(self):
+        """Rejects the cookies handed out so far, as an expired session would."""
+
+        with self._lock:
+            self.ticket = 'stub{0}'.format(self.logins + 1)
+
+    def dispatch(self, method, path, params, body, cookies=None):
+        now = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+
+        headers = {}
+        if self._throttled(now):
+            status, result = self.throttle_status, {'error': 'throttled'}
+        elif (self.auth and method in ('PUT', 'DELETE')
+              and (cookies or {}).get('auth_tkt') != self.ticket):
+            status, result = 401, {'error': 'unauthorized'}
+        else:
+            status, result = 404, {'error': 'not found'}
+            for route_method, pattern, func in self.routes:
+                m = pattern.match(path)
+                if route_method == method and m:
+                    r = func(params, body, *m.groups())
+                    status, result = r[0], r[1]
+                    if len(r) > 2:
+                        headers = r[2]
+                    break
+
+        with self._lock:
+            self.requests.append((now, method, path, status))
+        return status, result, headers
+
+    def peak_rate(self, window=1.0, time_scale=1.0):
+        """
+        The highest number of requests seen in any window seconds, as a
+        per second rate.
+
+        Args:
+            window (float): The window size in simulated seconds.
+            time_scale (float): Real seconds per simulated second.
+        """
+
+        times = sorted(r[0] for r in self.requests)
+        window = window * time_scale
+        peak = 0
+        start = 0
+        for end in range(len(times)):
+            while times[end] - times[start] >= window:
+                start += 1
+            peak = max(peak, end - start + 1)
+        return peak / (window / time_scale)
+
+    def populate(self, nodes=1000, node_groups=10):
+        """
+        Adds a fleet of nodes, the statuses and some node_groups, and serves
+        /api/nodes, /api/statuses, /api/tags, /api/node_groups and the
+        /api/*_assignments endpoints (and their /api/bulk/ versions) over
+        them.
+
+        Args:
+            nodes (int): The number of nodes.
+            node_groups (int): The number of node_groups.
+        """
+
+        with self._lock:
+            statuses = self.objects['statuses']
+            for name in STATUSES:
+                status_id = len(statuses) + 1
+                statuses[status_id] = {'status_id': status_id, 'status_name': name}
+
+            groups = self.objects['node_groups']
+            for i in range(node_groups):
+                ng_id = len(groups) + 1
+                groups[ng_id] = {'node_group_id': ng_id, 'node_group_name': 'group{0:03d}'.format(i),
+                                 'node_group_owner': 'ops@example.com', 'description': '', 'tags': []}
+
+            fleet = self.objects['nodes']
+            for i in range(nodes):
+                node_id = len(fleet) + 1
+                fleet[node_id] = {
+                    'node_id': node_id,
+                    'node_name': 'node{0:06d}.example.com'.format(node_id),
+                    'unique_id': '00:16:3e:{0:02x}:{1:02x}:{2:02x}'.format(
+                        (node_id >> 16) & 0xff, (node_id >> 8) & 0xff, node_id & 0xff),
+                    'status': dict(statuses[1]),
+                    'hardware_profile': {'hardware_profile_id': 1, 'manufacturer': 'Dell',
+                                         'model': 'PowerEdge R620'},
+                    'operating_system': {'operating_system_id': 1, 'variant': 'CentOS',
+                                         'version_number': '6.6', 'architecture': 'x86_64',
+                                         'description': 'CentOS release 6.6 (Final)'},
+                    'uptime': '10 days',
+                    'tags': [],
+                    'node_groups': [],
+                    'hypervisor': [],
+                }
+
+        for object_type in self.objects:
+            self.route('GET', r'/api/{0}$'.format(object_type), self._search_handler(object_type))
+        self.route('GET', r'/api/nodes/(\d+)$', self.get_node)
+        self.route('PUT', r'/api/nodes/(\d+)$', self.update_node)
+        self.route('PUT', r'/api/tags$', self.create_tag)
+        self.route('PUT', r'/api/node_groups$', self.create_node_group)
+        for method in ('PUT', 'DELETE'):
+            self.route(method, r'/api/(\w+)_assignments$', self._assign_handler(method))
+            self.route(method, r'/api/bulk/(\w+)_assignments$', self._assign_handler(method, bulk=True))
+        return self
+
+    def _search_handler(self, object_type):
+        def search(params, body):
+            start = int(params.get('start', 0))
+            limit = int(params.get('limit', 0)) or self.max_limit
+            if self.max_limit:
+                limit = min(limit, self.max_limit)
+            with self._lock:
+                found = [o for o in self.objects[object_type].values() if _matches(o, params)]
+            page = found[start:start + limit] if limit else found[start:]
+            if params.get('fields'):
+                fields = params['fields'].split(',')
+                page = [dict((f, o[f]) for f in fields if f in o) for o in page]
+            return 200, {'results': page, 'meta': {'total': len(found)}}
+        return search
+
+    def get_node(self, params, body, node_id):
+        with self._lock:
+            node = self.objects['nodes'].get(int(node_id))
+        if node is None:
+            return 404, None
+        return 200, {'results': [node]}
+
+    def update_node(self, params, body, node_id):
+        with self._lock:
+            node = self.objects['nodes'].get(int(node_id))
+            if node is None:
+                return 404, None
+            if 'status_id' in (body or {}):
+                node['status'] = dict(self.objects['statuses'][int(body['status_id'])])
+        return 200, node
+
+    def create_tag(self, params, body):
+        with self._lock:
+            tags = self.objects['tags']
+            for t in tags.values():
+                if t['tag_name'] == body['tag_name'] and t['tag_value'] == str(body['tag_value']):
+                    return 200, t
+            tag_id = len(tags) + 1
+            tags[tag_id] = {'tag_id': tag_id, 'tag_name': body['tag_name'],
+                            'tag_value': str(body['tag_value'])}
+        return 200, tags[tag_id]
+
+    def create_node_group(self, params, body):
+        with self._lock:
+            groups = self.objects['node_groups']
+            ng_id = len(groups) + 1
+            groups[ng_id] = dict(body, node_group_id=ng_id, tags=[])
+        return 200, groups[ng_id]
+
+    def _assign(self, method, kind, data):
+        target_type, target_key, field, source_type, source_key = ASSIGNMENTS[kind]
+        target = self.objects[target_type].get(int(data[target_key]))
+        source = self.objects[source_type].get(int(data[source_key]))
+        if target is None or source is None:
+            return False
+
+        if source_type == 'tags':
+            item = dict(source)
+        elif source_type == 'node_groups':
+            item = _summary(source, 'node_group_id', 'node_group_name')
+        else:
+            item = _summary(source, 'node_id', 'node_name')
+
+        assigned = target[field]
+        if method == 'PUT':
+            if item not in assigned:
+                assigned.append(item)
+        elif item in assigned:
+            assigned.remove(item)
+        return True
+
+    def _assign_handler(self, method, bulk=False):
+        def assign(params, body, kind):
+            if kind not in ASSIGNMENTS:
+                return 404, None
+            items = body['assignments'] if bulk else [body]
+            with self._lock:
+                for data in items:
+                    if not self._assign(method, kind, data):
+                        return 404, None
+            if bulk:
+                return 200, {'assignments': len(items)}
+            return 200, body
+        return assign
+
+    def login(self, params, body):
+        with self._lock:
+            self.logins += 1
+            ticket = self.ticket
+        return 200, None, {'Set-Cookie': 'auth_tkt={0}; Path=/'.format(ticket)}
+
+    def register(self, params, body):
+        unique_id = (body or {}).get('unique_id')
+        with self._lock:
+            node_id = self.registered.setdefault(unique_id, len(self.registered) + 1)
+        return 200, {'node_id': node_id, 'unique_id': unique_id}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a stub Arsenal API with a fleet of nodes.')
+    parser.add_argument('--nodes', type=int, default=1000, help='Number of nodes in the fleet.')
+    parser.add_argument('--node-groups', type=int, default=10, help='Number of node_groups.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request.')
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency).start()
+    server.populate(args.nodes, args.node_groups)
+    print(server.host)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
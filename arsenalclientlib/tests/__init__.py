@@ -0,0 +1,84 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Tests for the client library, run against stub_server.StubServer.
+
+  $ python -m pytest arsenalclientlib/tests
+  $ python setup.py test
+"""
+import shutil
+import tempfile
+import unittest
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.metrics import metrics
+from arsenalclientlib.stub_server import StubServer
+
+
+class StubTestCase(unittest.TestCase):
+    """
+    Starts a populated StubServer for every test and points settings at it.
+    Settings and the module level caches are restored afterwards.
+
+    Attributes:
+        stub (StubServer): The stub.
+        tmp (str): A temporary directory, removed after the test.
+    """
+
+    nodes = 50
+    stub_args = {}
+
+    def setUp(self):
+        self._settings = dict((k, v) for k, v in vars(settings).items() if not k.startswith('_'))
+        self.tmp = tempfile.mkdtemp(prefix='arsenal_test')
+
+        self.stub = StubServer(**self.stub_args).populate(nodes=self.nodes)
+        self.stub.start()
+        self.stub.configure()
+
+        settings.user_login = 'kaboom'
+        settings.cookie_file = self.tmp + '/cookie'
+        settings.retry_backoff = 0
+        settings.journal_drain_rate = 0
+        self._reset()
+
+    def tearDown(self):
+        self.stub.stop()
+        for k in [k for k in vars(settings) if not k.startswith('_')]:
+            if k not in self._settings:
+                delattr(settings, k)
+        for k, v in self._settings.items():
+            setattr(settings, k, v)
+        self._reset()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _reset(self):
+        client.session = None
+        client.cookie_cache.clear()
+        client.lookup_cache = client.LookupCache()
+        client.circuit_breaker.record_success()
+        client._batch_support.clear()
+        client.rate_limiter = client.TokenBucket()
+        metrics.reset()
+
+    def requests(self, method=None, path=None, status=None):
+        """The requests the stub served, filtered by method, path prefix and status."""
+
+        return [r for r in self.stub.requests
+                if (method is None or r[1] == method)
+                and (path is None or r[2].startswith(path))
+                and (status is None or r[3] == status)]
@@ -0,0 +1,130 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Tests of the asyncio client. Imported by test_aio, which python 2 can
+still load.
+"""
+import gc
+import asyncio
+import unittest
+
+from arsenalclientlib.aio import AsyncClient, aiohttp
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.tests import StubTestCase
+
+
+@unittest.skipIf(aiohttp is None, 'requires aiohttp')
+class TestAsyncSearch(StubTestCase):
+
+    stub_args = {'latency': 0.02}
+
+    def run_loop(self, coro):
+        errors = []
+        loop = asyncio.new_event_loop()
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        try:
+            return loop.run_until_complete(coro()), errors
+        finally:
+            gc.collect()
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            gc.collect()
+
+    def test_break_cancels_prefetch(self):
+        async def search():
+            async with AsyncClient() as aclient:
+                async for n in aclient.iter_search('nodes', 'node_name=node', page_size=10):
+                    return n['node_id']
+
+        node_id, errors = self.run_loop(search)
+        self.assertEqual(node_id, 1)
+        self.assertEqual(errors, [])
+
+    def test_raise_cancels_prefetch(self):
+        async def search():
+            async with AsyncClient() as aclient:
+                async for n in aclient.iter_search('nodes', 'node_name=node', page_size=10):
+                    raise KeyError(n['node_id'])
+
+        self.assertRaises(KeyError, self.run_loop, search)
+
+    def test_object_search(self):
+        async def search():
+            async with AsyncClient() as aclient:
+                return await aclient.object_search('nodes', 'node_name=node')
+
+        r, errors = self.run_loop(search)
+        self.assertEqual([n['node_id'] for n in r], list(range(1, self.nodes + 1)))
+        self.assertEqual(errors, [])
+
+    def test_hypervisor_cache(self):
+        unique_id = '00:16:3e:00:00:01'
+        client.find_hypervisors([unique_id])
+        self.stub.requests = []
+
+        async def assign():
+            async with AsyncClient() as aclient:
+                return await aclient.manage_hypervisor_assignments(unique_id, [{'node_id': 2,
+                                                                                'node_name': 'vm'}])
+
+        r, errors = self.run_loop(assign)
+        self.assertEqual(len(r.succeeded), 1)
+        self.assertEqual(self.requests('GET', '/api/nodes'), [])
+
+
+@unittest.skipIf(aiohttp is None, 'requires aiohttp')
+class TestAsyncRequests(StubTestCase):
+
+    def run_loop(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro())
+        finally:
+            loop.close()
+
+    def test_shares_rate_limit(self):
+        settings.rate_limit = 4.0
+        settings.rate_limit_burst = 1
+
+        async def get():
+            async with AsyncClient() as aclient:
+                await asyncio.gather(*[aclient.api_submit('/api/nodes/{0}'.format(i))
+                                       for i in range(1, 6)])
+        self.run_loop(get)
+
+        times = [ts for ts, method, path, status in self.requests('GET', '/api/nodes/')]
+        self.assertEqual(len(times), 5)
+        self.assertGreaterEqual(max(times) - min(times), 0.9 * 4 / 4.0)
+
+    def test_backoff_frees_slot(self):
+        settings.retries = 1
+        settings.retry_backoff = 0.5
+        self.stub.route('GET', r'/api/broken$', lambda params, body: (503, {'error': 'down'}))
+
+        async def get():
+            async with AsyncClient(concurrency=1) as aclient:
+                broken = asyncio.ensure_future(aclient.api_submit('/api/broken'))
+                await asyncio.sleep(0.1)
+                await aclient.api_submit('/api/nodes/1')
+                return await asyncio.gather(broken, return_exceptions=True)
+        self.run_loop(get)
+
+        broken = [ts for ts, method, path, status in self.requests('GET', '/api/broken')]
+        node = [ts for ts, method, path, status in self.requests('GET', '/api/nodes/1')]
+        self.assertEqual(len(broken), 2)
+        self.assertLess(node[0], broken[1])
@@ -0,0 +1,28 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import sys
+import unittest
+
+if sys.version_info >= (3, 6):
+    from arsenalclientlib.tests.aio import TestAsyncSearch, TestAsyncRequests
+else:
+    @unittest.skip('requires python 3.6+')
+    class TestAsyncSearch(unittest.TestCase):
+        pass
+
+    @unittest.skip('requires python 3.6+')
+    class TestAsyncRequests(unittest.TestCase):
+        pass
@@ -0,0 +1,57 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import re
+import time
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.exceptions import AuthenticationError, ConnectionFailedError
+from arsenalclientlib.tests import StubTestCase
+
+
+class TestCookieAuth(StubTestCase):
+
+    stub_args = {'auth': True}
+
+    def test_refused_login_raises(self):
+        settings.user_login = 'read_only'
+        self.assertRaises(AuthenticationError, client.get_cookie_auth)
+
+    def test_unreachable_api_raises(self):
+        settings.retries = 1
+        self.stub.stop()
+        client.session = None
+        self.assertRaises(ConnectionFailedError, client.get_cookie_auth)
+
+    def test_waiters_share_failed_login(self):
+        def refuse(params, body):
+            time.sleep(0.2)
+            return 403, {'error': 'forbidden'}
+        self.stub.routes.insert(0, ('POST', re.compile(r'/login$'), refuse))
+        nodes = client.object_search('nodes', 'node_name=node', fields='node_id,node_name')[:10]
+
+        r = client.set_status('maintenance', nodes, concurrency=10)
+
+        self.assertEqual(r.succeeded, [])
+        self.assertTrue(all(isinstance(e, AuthenticationError) for node, e in r.failed))
+        self.assertEqual(len(self.requests('POST', '/login')), 1)
+        self.assertEqual(self.requests('PUT'), [])
+
+    def test_login_retried_after_failure(self):
+        settings.user_login = 'read_only'
+        self.assertRaises(AuthenticationError, client.get_cookie_auth)
+        settings.user_login = 'kaboom'
+        self.assertIn('auth_tkt', client.get_cookie_auth())
@@ -0,0 +1,115 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import re
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.exceptions import ConflictError
+from arsenalclientlib.tests import StubTestCase
+
+
+class TestReauthMidBatch(StubTestCase):
+
+    stub_args = {'auth': True}
+
+    def test_set_status_uses_new_cookies(self):
+        nodes = client.object_search('nodes', 'node_name=node', fields='node_id,node_name')
+        client.get_cookie_auth()
+        self.stub.expire_auth()
+
+        r = client.set_status('maintenance', nodes, concurrency=1)
+
+        self.assertEqual(len(r.succeeded), len(nodes))
+        self.assertEqual(len(self.requests('PUT', '/api/nodes/', status=401)), 1)
+        self.assertEqual(self.stub.logins, 2)
+
+    def test_bulk_assign_uses_new_cookies(self):
+        nodes = client.object_search('nodes', 'node_name=node', fields='node_id,node_name')
+        client.get_cookie_auth()
+        self.stub.expire_auth()
+
+        r = client.manage_node_group_assignments('group001', nodes, chunk_size=1, concurrency=1)
+
+        self.assertEqual(len(r.succeeded), len(nodes))
+        self.assertEqual(len(self.requests('PUT', '/api/node_group_assignments', status=401)), 1)
+
+
+class TestBatchEndpoint(StubTestCase):
+
+    def setUp(self):
+        super(TestBatchEndpoint, self).setUp()
+        self.nodes = client.object_search('nodes', 'node_name=node', fields='node_id,node_name')
+
+    def assign(self, nodes, chunk_size=5):
+        return client.manage_node_group_assignments('group001', nodes, chunk_size=chunk_size,
+                                                    concurrency=10)
+
+    def test_off_by_default(self):
+        r = self.assign(self.nodes)
+        self.assertEqual(len(r.succeeded), len(self.nodes))
+        self.assertEqual(self.requests(path='/api/bulk/'), [])
+        self.assertEqual(len(self.requests('PUT', '/api/node_group_assignments')), len(self.nodes))
+
+    def test_batches(self):
+        settings.assignment_batch_endpoint = '/api/bulk/{0}'
+        r = self.assign(self.nodes)
+        self.assertEqual(len(r.succeeded), len(self.nodes))
+        self.assertEqual(len(self.requests('PUT', '/api/bulk/node_group_assignments', status=200)), 10)
+        self.assertEqual(self.requests('PUT', '/api/node_group_assignments'), [])
+
+    def test_missing_batch_endpoint_probed_once(self):
+        settings.assignment_batch_endpoint = '/api/batch/{0}'
+        r = self.assign(self.nodes)
+        self.assertEqual(len(r.succeeded), len(self.nodes))
+        self.assertEqual(len(self.requests(path='/api/batch/')), 1)
+
+        self.assign(self.nodes)
+        self.assertEqual(len(self.requests(path='/api/batch/')), 1)
+
+    def test_missing_item_keeps_batching(self):
+        settings.assignment_batch_endpoint = '/api/bulk/{0}'
+        missing = {'node_id': 9999, 'node_name': 'gone.example.com'}
+        r = self.assign([missing] + self.nodes)
+
+        self.assertEqual([item[0] for item, e in r.failed], [missing])
+        self.assertEqual(len(r.succeeded), len(self.nodes))
+        # The first chunk 404s and is sent singly, the rest are still batched.
+        self.assertEqual(len(self.requests('PUT', '/api/bulk/', status=404)), 1)
+        self.assertEqual(len(self.requests('PUT', '/api/bulk/', status=200)), 10)
+        self.assertEqual(len(self.requests('PUT', '/api/node_group_assignments')), 5)
+
+    def test_conflict_falls_back_to_singles(self):
+        settings.assignment_batch_endpoint = '/api/bulk/{0}'
+        # One conflicting item in the probed chunk, one in a later chunk.
+        conflicts = [self.nodes[2], self.nodes[12]]
+        conflict_ids = [n['node_id'] for n in conflicts]
+        single = self.stub._assign_handler('PUT')
+        bulk = self.stub._assign_handler('PUT', bulk=True)
+
+        def assign(params, body, prefix, kind):
+            items = body['assignments'] if prefix else [body]
+            if any(int(a['node_id']) in conflict_ids for a in items):
+                return 409, {'error': 'conflict'}
+            return (bulk if prefix else single)(params, body, kind)
+        self.stub.routes.insert(0, ('PUT', re.compile(r'/api/(bulk/)?(\w+)_assignments$'), assign))
+
+        r = self.assign(self.nodes)
+
+        self.assertEqual(sorted(item[0]['node_id'] for item, e in r.failed), conflict_ids)
+        self.assertTrue(all(isinstance(e, ConflictError) for item, e in r.failed))
+        self.assertEqual(len(r.succeeded), len(self.nodes) - 2)
+        self.assertEqual(len(self.requests('PUT', '/api/bulk/', status=200)), 8)
+        self.assertEqual(len(self.requests('PUT', '/api/node_group_assignments')), 10)
@@ -0,0 +1,58 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.tests import StubTestCase
+
+
+class TestConfigSettings(StubTestCase):
+
+    def test_conf_and_secret_conf(self):
+        conf = self.tmp + '/arsenal.ini'
+        secret_conf = self.tmp + '/secrets.ini'
+        with open(conf, 'w') as f:
+            f.write('[client]\nconcurrency = 25\nsearch_fields_param = fields\n')
+        with open(secret_conf, 'w') as f:
+            f.write('[secrets]\nhvm = s3cret\n')
+
+        client.configSettings(conf, secret_conf)
+
+        self.assertEqual(settings.concurrency, 25)
+        self.assertEqual(settings.search_fields_param, 'fields')
+        self.assertEqual(settings.hvm_password, 's3cret')
+
+    def conf(self, text):
+        conf = self.tmp + '/arsenal.ini'
+        with open(conf, 'w') as f:
+            f.write('[client]\n' + text)
+        client.configSettings(conf)
+
+    def test_fractional_rate_limit(self):
+        self.conf('rate_limit = 0.5\n')
+        self.assertEqual(settings.rate_limit, 0.5)
+        self.assertEqual(client.rate_limiter.rate, 0.5)
+
+    def test_fractional_request_deadline(self):
+        self.conf('request_deadline = 2.5\n')
+        self.assertEqual(settings.request_deadline, 2.5)
+        self.assertEqual(client.retry_policy.deadline, 2.5)
+
+    def test_no_timeout(self):
+        self.conf('connect_timeout = none\nread_timeout = 0\n')
+        self.assertEqual(client.get_timeout(), None)
+
+        self.conf('connect_timeout = 2.5\nread_timeout = 30\n')
+        self.assertEqual(client.get_timeout(), (2.5, 30.0))
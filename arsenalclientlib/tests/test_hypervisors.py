@@ -0,0 +1,79 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.tests import StubTestCase
+
+HYPERVISOR = '00:16:3e:00:00:01'
+
+
+class TestPersistedHypervisorCache(StubTestCase):
+
+    def setUp(self):
+        super(TestPersistedHypervisorCache, self).setUp()
+        settings.lookup_cache_file = self.tmp + '/lookup_cache'
+        self.vms = client.object_search('nodes', 'node_name=node00001', fields='node_id,node_name')
+
+    def reload(self):
+        """Starts over from the cache file, as the next run would."""
+
+        client.lookup_cache = client.LookupCache()
+        self.stub.requests = []
+
+    def test_find_hypervisors(self):
+        first = client.find_hypervisors([HYPERVISOR])
+        self.reload()
+        second = client.find_hypervisors([HYPERVISOR])
+
+        self.assertEqual(second[HYPERVISOR].to_dict(), first[HYPERVISOR].to_dict())
+        self.assertEqual(second[HYPERVISOR].node_name, 'node000001.example.com')
+        self.assertEqual(self.requests('GET', '/api/nodes'), [])
+
+    def test_one_save_per_chunk(self):
+        unique_ids = ['00:16:3e:00:00:{0:02x}'.format(i) for i in range(1, 11)]
+        saves = []
+        save = client.lookup_cache._save
+        client.lookup_cache._save = lambda: saves.append(1) or save()
+
+        found = client.find_hypervisors(unique_ids, chunk_size=5)
+
+        self.assertEqual(sorted(found), unique_ids)
+        self.assertEqual(len(saves), 2)
+        self.reload()
+        self.assertEqual(sorted(client.find_hypervisors(unique_ids)), unique_ids)
+        self.assertEqual(self.requests('GET', '/api/nodes'), [])
+
+    def test_assignments(self):
+        client.find_hypervisors([HYPERVISOR])
+        self.reload()
+
+        r = client.manage_hypervisor_assignments(HYPERVISOR, self.vms)
+
+        self.assertEqual(len(r.succeeded), len(self.vms))
+        self.assertEqual(r.failed, [])
+
+    def test_mapping(self):
+        client.find_hypervisors([HYPERVISOR])
+        self.reload()
+
+        r = client.manage_hypervisor_mapping({HYPERVISOR: self.vms})
+
+        self.assertEqual(len(r.succeeded), len(self.vms))
+        self.assertEqual(r.failed, [])
+        hypervisor = self.stub.objects['nodes'][1]
+        for n in self.vms:
+            self.assertEqual(self.stub.objects['nodes'][n.node_id]['hypervisor'],
+                             [{'node_id': 1, 'node_name': hypervisor['node_name']}])
@@ -0,0 +1,102 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import arsenalclientlib as client
+import arsenalclientlib.identity as identity
+import arsenalclientlib.settings as settings
+
+UUID = '4C4C4544-0042-3510-8052-B4C04F565931'
+
+FACTS = {
+    'kernel': 'Linux',
+    'fqdn': 'web0012.example.com',
+    'macaddress': '00:16:3e:00:00:0c',
+    'uptime': '1 day',
+}
+
+EC2_FACTS = {
+    'ec2_instance_id': 'i-0123456789abcdef0',
+    'ec2_ami_id': 'ami-12345678',
+    'ec2_hostname': 'ip-10-0-0-12.ec2.internal',
+    'ec2_public_hostname': 'ec2-54-0-0-12.compute-1.amazonaws.com',
+    'ec2_instance_type': 'm4.large',
+    'ec2_security_groups': 'web',
+    'ec2_placement_availability_zone': 'us-east-1a',
+}
+
+
+class TestEc2Identity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (settings.facter_cache_file, settings.unique_id_file,
+                      identity.DMIDECODE, identity.PRODUCT_UUID)
+        settings.facter_cache_file = os.path.join(self.tmp, 'facts')
+        settings.unique_id_file = None
+        identity.PRODUCT_UUID = os.path.join(self.tmp, 'product_uuid')
+        # A dmidecode that leaves a trace when it runs.
+        self.ran = os.path.join(self.tmp, 'dmidecode_ran')
+        identity.DMIDECODE = os.path.join(self.tmp, 'dmidecode')
+        with open(identity.DMIDECODE, 'w') as f:
+            f.write('#!/bin/sh\ntouch {0}\necho {1}\n'.format(self.ran, UUID))
+        os.chmod(identity.DMIDECODE, 0o755)
+        self.reset()
+
+    def tearDown(self):
+        (settings.facter_cache_file, settings.unique_id_file,
+         identity.DMIDECODE, identity.PRODUCT_UUID) = self.saved
+        self.reset()
+        shutil.rmtree(self.tmp)
+
+    def reset(self):
+        identity._probe = None
+        del identity._uuid[:]
+        identity._skip.clear()
+
+    def cache_facts(self, facts):
+        now = time.time()
+        cache = dict((n, [None, now]) for n in client.REGISTER_FACTS)
+        cache.update((n, [v, now]) for n, v in facts.items())
+        with open(settings.facter_cache_file, 'w') as f:
+            json.dump(cache, f)
+
+    def test_ec2_skips_probe(self):
+        self.cache_facts(dict(FACTS, **EC2_FACTS))
+
+        data = client.collect_data()
+
+        self.assertEqual(data.unique_id, EC2_FACTS['ec2_instance_id'])
+        self.assertIsNone(identity._probe)
+        self.assertFalse(os.path.exists(self.ran))
+
+    def test_hardware_uuid_without_ec2(self):
+        self.cache_facts(FACTS)
+
+        data = client.collect_data()
+
+        self.assertEqual(data.unique_id, UUID)
+        self.assertTrue(os.path.exists(self.ran))
+
+    def test_skip_before_dmidecode(self):
+        identity.skip_probe()
+        self.assertIsNone(identity.hardware_uuid())
+        self.assertFalse(os.path.exists(self.ran))
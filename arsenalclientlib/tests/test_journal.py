@@ -0,0 +1,145 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import arsenalclientlib as client
+import arsenalclientlib.journal as journal
+import arsenalclientlib.registration as registration
+import arsenalclientlib.settings as settings
+from arsenalclientlib.exceptions import AuthenticationError
+from arsenalclientlib.tests import StubTestCase
+
+ASSIGNMENTS = '/api/node_group_assignments'
+REGISTER = '/api/register'
+
+
+class JournalTestCase(StubTestCase):
+
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        settings.journal_file = self.tmp + '/journal'
+        self.journal = journal.Journal()
+
+    def enqueue(self, node_ids):
+        for node_id in node_ids:
+            self.journal.append(ASSIGNMENTS, {'node_id': node_id, 'node_group_id': 1})
+
+
+class TestDrainRate(JournalTestCase):
+
+    rate = 20.0
+
+    def setUp(self):
+        super(TestDrainRate, self).setUp()
+        settings.journal_drain_rate = self.rate
+        settings.assignment_chunk_size = 5
+
+    def assertRate(self):
+        times = [ts for ts, method, path, status in self.requests('PUT')]
+        self.assertGreaterEqual(max(times) - min(times), 0.9 * (len(times) - 1) / self.rate)
+        return len(times)
+
+    def test_singles(self):
+        self.enqueue(range(1, 12))
+        r = self.journal.drain(concurrency=10)
+
+        self.assertEqual(len(r.succeeded), 11)
+        self.assertEqual(self.assertRate(), 11)
+
+    def test_batch_falls_back_to_singles(self):
+        settings.assignment_batch_endpoint = '/api/bulk/{0}'
+        # The missing node 404s the first batch, which is then sent singly.
+        self.enqueue([9999] + list(range(1, 10)))
+        r = self.journal.drain(concurrency=10)
+
+        self.assertEqual(len(r.succeeded), 9)
+        self.assertEqual(len(self.requests('PUT', ASSIGNMENTS)), 5)
+        self.assertEqual(self.assertRate(), 7)
+
+
+class TestRejected(JournalTestCase):
+
+    stub_args = {'auth': True}
+
+    def test_auth_failure_is_rejected(self):
+        settings.user_login = 'read_only'
+        self.enqueue([1, 2])
+
+        r = self.journal.drain()
+
+        self.assertEqual(len(r.failed), 2)
+        self.assertTrue(all(isinstance(e, AuthenticationError) for record, e in r.failed))
+        self.assertEqual(self.journal.pending(), [])
+        rejected = self.journal.rejected()
+        self.assertEqual(sorted(record['data']['node_id'] for record in rejected), [1, 2])
+        self.assertTrue(all('read_only' in record['error'] for record in rejected))
+
+    def test_connection_failure_is_kept(self):
+        settings.retries = 1
+        self.enqueue([1, 2])
+        self.stub.stop()
+        client.session = None
+
+        r = self.journal.drain()
+
+        self.assertEqual(len(r.failed), 2)
+        self.assertEqual(len(self.journal.pending()), 2)
+        self.assertEqual(self.journal.rejected(), [])
+
+
+class TestSupersededRegistration(JournalTestCase):
+
+    old = {'unique_id': '00:16:3e:00:00:01', 'node_name': 'old.example.com'}
+    new = {'unique_id': '00:16:3e:00:00:01', 'node_name': 'new.example.com'}
+
+    def setUp(self):
+        super(TestSupersededRegistration, self).setUp()
+        settings.register_state_file = self.tmp + '/register_state'
+        # register() journals through the default journal.
+        self.journal = journal.get_journal()
+
+    def assertNotReplayed(self):
+        r = self.journal.drain()
+
+        self.assertEqual(r.failed, [])
+        self.assertEqual(len(self.requests('PUT', REGISTER)), 1)
+        self.assertEqual(registration.load_state()['fields']['node_name'], 'new.example.com')
+        self.assertEqual(self.journal.pending(), [])
+
+    def test_direct_register_supersedes_journal(self):
+        client.register(defer=True, data=self.old)
+        self.assertEqual(len(self.journal.pending()), 1)
+
+        client.register(force=True, data=self.new)
+
+        self.assertEqual(self.journal.pending(), [])
+        self.assertNotReplayed()
+
+    def test_drain_skips_registrations_older_than_state(self):
+        # A record supersede() missed, as when a drain had already read it.
+        self.journal.append(REGISTER, self.old)
+        settings.journal_file = None
+        client.register(force=True, data=self.new)
+        settings.journal_file = self.journal.path
+
+        self.assertNotReplayed()
+
+    def test_later_deferred_registration_replays(self):
+        client.register(force=True, data=self.old)
+        client.register(defer=True, data=self.new)
+
+        r = self.journal.drain()
+
+        self.assertEqual(len(r.succeeded), 1)
+        self.assertEqual(len(self.requests('PUT', REGISTER)), 2)
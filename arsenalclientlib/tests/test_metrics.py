@@ -0,0 +1,40 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.exceptions import ConnectionFailedError
+from arsenalclientlib.metrics import metrics
+from arsenalclientlib.tests import StubTestCase
+
+
+class TestStatusLabels(StubTestCase):
+
+    def test_success_and_connection_error_on_one_endpoint(self):
+        settings.metrics_textfile = self.tmp + '/arsenal.prom'
+        settings.retries = 1
+        data = {'unique_id': '00:16:3e:00:00:01', 'node_name': 'node000001.example.com'}
+
+        client.register(force=True, data=data)
+        self.stub.stop()
+        client.session = None
+        self.assertRaises(ConnectionFailedError, client.register, force=True, data=data)
+
+        with open(settings.metrics_textfile) as f:
+            prom = f.read()
+        self.assertIn('arsenal_http_requests_total{endpoint="/api/register",method="PUT",status="200"} 1', prom)
+        self.assertIn('arsenal_http_requests_total{endpoint="/api/register",method="PUT",status="error"} 2', prom)
+        self.assertEqual(metrics.get('http_requests_total', endpoint='/api/register', method='PUT',
+                                     status=200), 1)
@@ -0,0 +1,38 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import unittest
+
+from arsenalclientlib.model import record_type
+
+
+class TestRecord(unittest.TestCase):
+
+    def test_fields_named_like_methods(self):
+        Record = record_type(('count', 'index', 'get', 'to_dict'))
+        r = Record(3, 7, 'g', 't')
+
+        self.assertEqual([r['count'], r['index'], r['get'], r['to_dict']], [3, 7, 'g', 't'])
+        self.assertEqual([r.get('count'), r.get('index'), r.get('get')], [3, 7, 'g'])
+        self.assertEqual(r.to_dict(), {'count': 3, 'index': 7, 'get': 'g', 'to_dict': 't'})
+
+    def test_missing_fields(self):
+        r = record_type(('node_id', 'node_name'))(12, 'web0012.example.com')
+
+        for name in ('count', 'index', 'get', 'to_dict', '_fields', '__len__'):
+            self.assertRaises(KeyError, lambda: r[name])
+            self.assertEqual(r.get(name), None)
+            self.assertEqual(r.get(name, 'default'), 'default')
+        self.assertEqual((r[0], r['node_name'], r.get('node_id')), (12, 'web0012.example.com', 12))
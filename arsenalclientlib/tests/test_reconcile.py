@@ -0,0 +1,117 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from arsenalclientlib import reconcile
+from arsenalclientlib.tests import StubTestCase
+
+NODE = 'node000001.example.com'
+OTHER = 'node000002.example.com'
+
+
+class TestReconcile(StubTestCase):
+
+    nodes = 5
+
+    def node(self, node_name=NODE):
+        for n in self.stub.objects['nodes'].values():
+            if n['node_name'] == node_name:
+                return n
+
+    def tags(self, node_name=NODE):
+        return sorted('{0}={1}'.format(t['tag_name'], t['tag_value'])
+                      for t in self.node(node_name)['tags'])
+
+    def node_groups(self, node_name=NODE):
+        return sorted(ng['node_group_name'] for ng in self.node(node_name)['node_groups'])
+
+    def test_dry_run(self):
+        desired = {NODE: {'status': 'maintenance', 'tags': {'role': 'web'},
+                          'node_groups': ['group001']},
+                   OTHER: {'status': 'inservice'}}
+
+        plan = reconcile.reconcile(desired, dry_run=True)
+
+        self.assertEqual(list(plan.describe()), [
+            'put status maintenance on {0}'.format(NODE),
+            'put tag role=web on {0}'.format(NODE),
+            'put node_group group001 on {0}'.format(NODE),
+        ])
+        self.assertEqual((len(plan), plan.unchanged, plan.missing), (3, 1, []))
+        self.assertEqual(self.requests('PUT'), [])
+        self.assertEqual(self.stub.objects['tags'], {})
+
+    def test_apply(self):
+        desired = {NODE: {'status': 'maintenance', 'tags': 'role=web,env=prod',
+                          'node_groups': ['group001']}}
+
+        r = reconcile.reconcile(desired)
+
+        self.assertEqual((len(r.succeeded), r.failed), (4, []))
+        self.assertEqual(self.node()['status']['status_name'], 'maintenance')
+        self.assertEqual(self.tags(), ['env=prod', 'role=web'])
+        self.assertEqual(self.node_groups(), ['group001'])
+        self.assertEqual(self.node(OTHER)['tags'], [])
+
+    def test_second_plan_is_empty(self):
+        desired = {NODE: {'status': 'maintenance', 'tags': {'role': 'web'},
+                          'node_groups': ['group001']}}
+        reconcile.reconcile(desired)
+        self.stub.requests = []
+
+        plan = reconcile.plan(desired)
+
+        self.assertEqual((len(plan), plan.unchanged), (0, 1))
+        self.assertEqual(len(reconcile.apply(plan).succeeded), 0)
+        self.assertEqual(self.requests('PUT'), [])
+
+    def test_tag_value_swap(self):
+        reconcile.reconcile({NODE: {'tags': {'role': 'web'}}})
+        self.stub.requests = []
+
+        plan = reconcile.plan({NODE: {'tags': {'role': 'db'}}})
+        self.assertEqual(list(plan.describe()), ['delete tag role=web on {0}'.format(NODE),
+                                                 'put tag role=db on {0}'.format(NODE)])
+        r = reconcile.apply(plan)
+
+        self.assertEqual((len(r.succeeded), r.failed), (2, []))
+        self.assertEqual(self.tags(), ['role=db'])
+        assignments = [(method, path) for ts, method, path, status in self.stub.requests
+                       if path.startswith('/api/tag_node_assignments')]
+        self.assertEqual([method for method, path in assignments], ['DELETE', 'PUT'])
+
+    def test_prune(self):
+        reconcile.reconcile({NODE: {'tags': {'role': 'web', 'env': 'prod'},
+                                    'node_groups': ['group001', 'group002']}})
+        desired = {NODE: {'tags': {'role': 'web'}, 'node_groups': ['group001']}}
+
+        self.assertEqual(len(reconcile.plan(desired)), 0)
+        plan = reconcile.plan(desired, prune=True)
+        self.assertEqual(list(plan.describe()), ['delete tag env=prod on {0}'.format(NODE),
+                                                 'delete node_group group002 on {0}'.format(NODE)])
+        reconcile.apply(plan)
+
+        self.assertEqual(self.tags(), ['role=web'])
+        self.assertEqual(self.node_groups(), ['group001'])
+
+    def test_missing_nodes(self):
+        desired = {'gone.example.com': {'status': 'decom'},
+                   NODE: {'status': 'decom'}}
+
+        plan = reconcile.plan(desired)
+        r = reconcile.apply(plan)
+
+        self.assertEqual(plan.missing, ['gone.example.com'])
+        self.assertEqual(len(r.succeeded), 1)
+        self.assertEqual(self.node()['status']['status_name'], 'decom')
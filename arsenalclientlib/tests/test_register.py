@@ -0,0 +1,74 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+
+import arsenalclientlib as client
+import arsenalclientlib.registration as registration
+import arsenalclientlib.settings as settings
+from arsenalclientlib.metrics import metrics
+from arsenalclientlib.tests import StubTestCase
+
+DATA = {'unique_id': '00:16:3e:00:00:01',
+        'node_name': 'node000001.example.com',
+        'uptime': '10 days',
+        'hardware_profile': {'manufacturer': 'Dell', 'model': 'PowerEdge R620'}}
+
+
+class TestDeltaRegistration(StubTestCase):
+
+    def setUp(self):
+        super(TestDeltaRegistration, self).setUp()
+        settings.register_state_file = self.tmp + '/register_state'
+        settings.register_volatile_fields = 'uptime'
+        settings.register_interval = 3600
+        client.register(data=DATA)
+
+    def register(self, **changes):
+        data = dict(DATA, **changes)
+        client.register(data=data)
+        return len(self.requests('PUT', '/api/register'))
+
+    def test_unchanged_is_skipped(self):
+        self.assertEqual(self.register(), 1)
+        self.assertEqual(metrics.get('register_total', result='skipped'), 1)
+
+    def test_volatile_field_is_skipped(self):
+        self.assertEqual(self.register(uptime='11 days'), 1)
+
+    def test_changed_field_registers(self):
+        self.assertEqual(self.register(hardware_profile={'manufacturer': 'Dell',
+                                                         'model': 'PowerEdge R630'}), 2)
+        self.assertEqual(registration.load_state()['fields']['hardware_profile.model'],
+                         'PowerEdge R630')
+        self.assertEqual(self.register(), 3)
+
+    def test_force(self):
+        client.register(force=True, data=DATA)
+        self.assertEqual(len(self.requests('PUT', '/api/register')), 2)
+
+    def test_interval_forces_full_registration(self):
+        state = registration.load_state()
+        state['registered_at'] -= 3600
+        with open(settings.register_state_file, 'w') as f:
+            json.dump(state, f)
+
+        self.assertEqual(self.register(uptime='11 days'), 2)
+        self.assertEqual(self.register(uptime='12 days'), 2)
+
+    def test_no_state_file(self):
+        settings.register_state_file = None
+        self.assertEqual(self.register(), 2)
+        self.assertEqual(self.register(), 3)
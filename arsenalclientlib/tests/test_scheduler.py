@@ -0,0 +1,34 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import sys
+import subprocess
+import unittest
+
+from arsenalclientlib import scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_import_leaves_out_stub_server(self):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       'import sys, arsenalclientlib.scheduler; '
+                                       'print("arsenalclientlib.stub_server" in sys.modules)'])
+        self.assertEqual(out.strip(), b'False')
+
+    def test_simulate(self):
+        r = scheduler.simulate(20, window=10, time_scale=0.01)
+        self.assertEqual(r['hosts'], 20)
+        self.assertEqual(r['failed'], 0)
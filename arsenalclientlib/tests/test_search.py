@@ -0,0 +1,90 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+
+import arsenalclientlib as client
+from arsenalclientlib.tests import StubTestCase
+
+
+class TestClampedLimit(StubTestCase):
+
+    nodes = 95
+    stub_args = {'max_limit': 20}
+
+    def node_ids(self, **kwargs):
+        r = client.object_search('nodes', 'node_name=node', **kwargs)
+        return [n['node_id'] for n in r]
+
+    def test_object_search(self):
+        self.assertEqual(self.node_ids(), list(range(1, 96)))
+        self.assertEqual(len(self.requests('GET', '/api/nodes')), 5)
+
+    def test_prefetch(self):
+        r = list(client.iter_search('nodes', 'node_name=node', page_size=50, prefetch=True))
+        self.assertEqual(len(r), 95)
+
+    def test_stream(self):
+        self.assertEqual(self.node_ids(stream=True), list(range(1, 96)))
+
+
+class TestPaging(StubTestCase):
+
+    nodes = 95
+
+    def test_pages(self):
+        r = list(client.iter_search('nodes', 'node_name=node', page_size=10))
+        self.assertEqual(len(r), 95)
+        self.assertEqual(len(self.requests('GET', '/api/nodes')), 10)
+
+    def test_exact_pages(self):
+        r = list(client.iter_search('nodes', 'node_name=node', page_size=19))
+        self.assertEqual(len(r), 95)
+        self.assertEqual(len(self.requests('GET', '/api/nodes')), 5)
+
+    def test_fields(self):
+        r = client.object_search('nodes', 'node_name=node00000', fields='node_id,node_name')
+        self.assertEqual([tuple(n) for n in r],
+                         [(i, 'node{0:06d}.example.com'.format(i)) for i in range(1, 10)])
+
+
+class TestPrefetchEarlyStop(StubTestCase):
+
+    stub_args = {'latency': 0.2}
+
+    def search(self):
+        return client.iter_search('nodes', 'node_name=node', page_size=10, prefetch=True)
+
+    def test_first_result_only(self):
+        results = self.search()
+        self.assertEqual(next(results)['node_id'], 1)
+        results.close()
+        time.sleep(0.4)
+        self.assertEqual(len(self.requests('GET', '/api/nodes')), 1)
+
+    def test_close_mid_page(self):
+        results = self.search()
+        next(results)
+        next(results)
+        started = time.time()
+        results.close()
+        # The prefetch in flight isn't waited for, and nothing follows it.
+        self.assertLess(time.time() - started, 0.1)
+        time.sleep(0.6)
+        self.assertEqual(len(self.requests('GET', '/api/nodes')), 2)
+
+    def test_exhausted(self):
+        self.assertEqual(len(list(self.search())), self.nodes)
+        self.assertEqual(len(self.requests('GET', '/api/nodes')), 5)
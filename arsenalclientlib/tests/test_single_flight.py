@@ -0,0 +1,83 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.cache import SingleFlight
+from arsenalclientlib.exceptions import ServerError
+from arsenalclientlib.tests import StubTestCase
+
+
+class TestSingleFlight(StubTestCase):
+
+    stub_args = {'latency': 0.2}
+    callers = 10
+
+    def setUp(self):
+        super(TestSingleFlight, self).setUp()
+        self.saved = client.single_flight
+        client.single_flight = SingleFlight()
+
+    def tearDown(self):
+        client.single_flight = self.saved
+        super(TestSingleFlight, self).tearDown()
+
+    def get_concurrently(self, request):
+        """Calls api_submit(request) from every caller at once."""
+
+        start = threading.Event()
+        results = []
+
+        def get():
+            start.wait()
+            try:
+                results.append(client.api_submit(request))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=get) for i in range(self.callers)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_identical_gets_share_one_request(self):
+        results = self.get_concurrently('/api/nodes/1')
+
+        self.assertEqual(len(self.requests('GET', '/api/nodes/1')), 1)
+        self.assertEqual([r['results'][0]['node_id'] for r in results], [1] * self.callers)
+        self.assertEqual((client.single_flight.misses, client.single_flight.hits),
+                         (1, self.callers - 1))
+
+    def test_errors_are_shared(self):
+        settings.retries = 0
+        self.stub.route('GET', r'/api/broken$', lambda params, body: (500, {'error': 'down'}))
+
+        results = self.get_concurrently('/api/broken')
+
+        self.assertEqual(len(self.requests('GET', '/api/broken')), 1)
+        self.assertTrue(all(isinstance(r, ServerError) for r in results))
+
+    def test_off(self):
+        settings.single_flight = False
+
+        self.get_concurrently('/api/nodes/1')
+
+        self.assertEqual(len(self.requests('GET', '/api/nodes/1')), self.callers)
+        self.assertEqual(client.single_flight.misses + client.single_flight.hits, 0)
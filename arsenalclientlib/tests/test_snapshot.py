@@ -0,0 +1,116 @@
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import re
+
+import arsenalclientlib as client
+import arsenalclientlib.settings as settings
+from arsenalclientlib.snapshot import Snapshot
+from arsenalclientlib.tests import StubTestCase
+
+
+class SnapshotTestCase(StubTestCase):
+
+    def setUp(self):
+        super(SnapshotTestCase, self).setUp()
+        self.snap = Snapshot(self.tmp + '/snapshot.db')
+
+
+class TestQuery(SnapshotTestCase):
+
+    def setUp(self):
+        super(TestQuery, self).setUp()
+        statuses = self.stub.objects['statuses']
+        for node_id in (3, 17, 42):
+            self.stub.objects['nodes'][node_id]['status'] = dict(statuses[3])
+        self.snap.refresh()
+
+    def assertSameResults(self, search, exact_get=None):
+        expected = client.object_search('nodes', search, exact_get)
+        self.assertTrue(expected, search)
+        self.assertEqual(self.snap.query('nodes', search, exact_get), expected, search)
+
+    def test_wildcard(self):
+        self.assertSameResults('node_name=node00001')
+        self.assertSameResults('node_name=node00002,node00004')
+
+    def test_exact(self):
+        self.assertSameResults('node_name=node000017.example.com', True)
+        self.assertSameResults('node_name=node000017.example.com,node000018.example.com', True)
+        self.assertIsNone(self.snap.query('nodes', 'node_name=node00001', True))
+
+    def test_status(self):
+        self.assertSameResults('status=maintenance')
+        self.assertSameResults('status=maintenance&node_name=node00004')
+        self.assertSameResults('status=inservice', True)
+
+
+class TestSync(SnapshotTestCase):
+
+    def setUp(self):
+        super(TestSync, self).setUp()
+        settings.search_page_size = 10
+
+    def sync(self):
+        r = self.snap.sync(['nodes'])
+        self.assertEqual(r.failed, [])
+        return r.succeeded[0][1]
+
+    def test_unchanged(self):
+        first = self.sync()
+        self.assertEqual((first['added'], first['not_modified']), (self.nodes, 0))
+
+        stats = self.sync()
+
+        self.assertEqual(stats['requests'], first['requests'])
+        self.assertEqual(stats['not_modified'], stats['requests'])
+        self.assertEqual((stats['added'], stats['updated'], stats['removed']), (0, 0, 0))
+        self.assertEqual(stats['bytes'], 0)
+
+    def test_removed_node_is_pruned(self):
+        self.sync()
+        del self.stub.objects['nodes'][7]
+
+        stats = self.sync()
+
+        self.assertEqual((stats['added'], stats['updated'], stats['removed']), (0, 0, 1))
+        self.assertIsNone(self.snap.query('nodes', 'node_id=7', True))
+        self.assertEqual(len(self.snap.query('nodes', 'node_name=')), self.nodes - 1)
+
+    def test_since_cursor_never_prunes(self):
+        settings.sync_since_param = 'updated_since'
+        nodes = self.stub.objects['nodes']
+        for node_id, n in nodes.items():
+            n['updated'] = '2015-01-01T00:00:{0:02d}'.format(node_id)
+
+        def search(params, body):
+            since = params.get('updated_since')
+            found = [nodes[k] for k in sorted(nodes) if not since or nodes[k]['updated'] > since]
+            start, limit = int(params['start']), int(params['limit'])
+            return 200, {'results': found[start:start + limit], 'meta': {'total': len(found)}}
+        self.stub.routes.insert(0, ('GET', re.compile(r'/api/nodes$'), search))
+
+        self.assertEqual(self.sync()['added'], self.nodes)
+        nodes[3]['node_name'] = 'renamed.example.com'
+        nodes[3]['updated'] = '2015-01-02T00:00:00'
+        del nodes[7]
+
+        stats = self.sync()
+
+        self.assertEqual((stats['added'], stats['updated'], stats['removed']), (0, 1, 0))
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(self.snap.query('nodes', 'node_id=3', True)[0]['node_name'],
+                         'renamed.example.com')
+        self.assertEqual(len(self.snap.query('nodes', 'node_id=7', True)), 1)
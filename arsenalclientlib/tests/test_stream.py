@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2015 CityGrid Media, LLC
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+import unittest
+
+import arsenalclientlib as client
+from arsenalclientlib.exceptions import ApiError
+from arsenalclientlib.stream import ResultStream
+from arsenalclientlib.tests import StubTestCase
+
+BODY = (u'{"meta": {"total": 1.5e3, "next": -0.25}, "results": '
+        u'[123, 2.5, 1e10, -7E-2, 0, -12.0e+2, "café ☃", true, null, '
+        u'{"node_id": 4567, "uptime": 3.25, "tags": [10, 200]}, [1, [22]], 98765], '
+        u'"count": 12}')
+
+
+def chunked(body, size):
+    body = body.encode('utf-8')
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class TestResultStream(unittest.TestCase):
+
+    def test_every_chunk_size(self):
+        expected = json.loads(BODY)
+        for size in range(1, len(BODY.encode('utf-8')) + 1):
+            results = ResultStream(chunked(BODY, size))
+            self.assertEqual(list(results), expected['results'], 'chunk size {0}'.format(size))
+            self.assertEqual(results.meta, {'meta': expected['meta'], 'count': 12},
+                             'chunk size {0}'.format(size))
+            self.assertEqual(results.count, len(expected['results']))
+
+    def test_split_numbers(self):
+        for chunks, value in (([b'{"results": [12', b'3]}'], 123),
+                              ([b'{"results": [2.', b'5]}'], 2.5),
+                              ([b'{"results": [1e', b'10]}'], 1e10),
+                              ([b'{"results": [-', b'4]}'], -4),
+                              ([b'{"results": [1', b'.', b'5', b'e', b'-', b'1]}'], 0.15)):
+            self.assertEqual(list(ResultStream(chunks)), [value], chunks)
+
+    def test_empty(self):
+        results = ResultStream([b'{"results": [], "meta": {"total": 0}}'])
+        self.assertEqual(list(results), [])
+        self.assertEqual(results.meta, {'meta': {'total': 0}})
+
+    def test_truncated(self):
+        self.assertRaises(ValueError, list, ResultStream([b'{"results": [1, 2']))
+
+
+class TestApiStream(StubTestCase):
+
+    def test_error_closes_response(self):
+        self.stub.route('GET', r'/api/broken$', lambda params, body: (400, {'error': 'bad request'}))
+        responses = []
+        client.get_session().hooks['response'].append(lambda r, *args, **kwargs: responses.append(r))
+
+        self.assertRaises(ApiError, client.api_stream, '/api/broken')
+        self.assertEqual(len(responses), 1)
+        # Older requests release the connection to the pool on close()
+        # instead of closing it.
+        raw = responses[0].raw
+        self.assertTrue(raw.closed or raw._connection is None)
+
+    def test_search(self):
+        r = client.object_search('nodes', 'node_name=node', stream=True)
+        self.assertEqual([n['node_id'] for n in r], list(range(1, self.nodes + 1)))
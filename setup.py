@@ -41,6 +41,9 @@ setup(name='arsenalclientlib',
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
+      extras_require={
+        'async': ['aiohttp'],
+        },
       tests_require=requires,
       test_suite="arsenalclientlib",
       )